@@ -0,0 +1,160 @@
+# Modular Python Bitcoin Miner
+# Copyright (C) 2012 Michael Sparmann (TheSeven)
+#
+#     This program is free software; you can redistribute it and/or
+#     modify it under the terms of the GNU General Public License
+#     as published by the Free Software Foundation; either version 2
+#     of the License, or (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program; if not, write to the Free Software
+#     Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Please consider donating to 1PLAPWDejJPJnY2ppYCgtw5ko8G5Q4hPzh if you
+# want to support further development of the Modular Python Bitcoin Miner.
+
+
+
+#######################
+# Event bus benchmark #
+#######################
+
+
+
+# Pushes a steady stream of events (10000 per second by default) through
+# Core.event, the dispatch table and the frontend dispatcher threads, with four
+# frontends: one that takes everything up to level 500, one each for noncefound
+# and canceljob, and one for two event types of a single worker. For comparison,
+# the same stream is broadcast to every frontend as 10-tuples, with each frontend
+# filtering on its own, like before there were subscriptions.
+# Run from anywhere: python benchmarks/eventbus.py [events per second] [seconds]
+
+
+
+import os
+import sys
+import time
+from threading import Lock, RLock
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fakecore import FakeCore, FakeWorker
+from core.core import Core
+from core.util import Bunch
+from core.basefrontend import BaseFrontend
+from core.eventbus import EventSubscription
+
+
+
+# The core's own event code
+class EventCore(FakeCore):
+
+  event = Core.__dict__["event"]
+  wants_event = Core.__dict__["wants_event"]
+  update_event_filter = Core.__dict__["update_event_filter"]
+
+
+  def __init__(self):
+    self.frontendlock = RLock()
+    self.frontends = []
+    self.eventtable = ({}, (-1, ()))
+    self.eventstats = Bunch(lock = Lock(), emitted = 0, dropped = 0)
+    super(EventCore, self).__init__()
+
+
+  def update_log_filter(self):
+    pass
+
+
+
+# Every frontend gets every event and filters on its own
+class BroadcastCore(EventCore):
+
+
+  def event(self, level, source, event, arg, message = None, worker = None, worksource = None, blockchain = None, job = None, timestamp = None):
+    data = (level, source, event, arg, message, worker, worksource, blockchain, job, timestamp or time.time())
+    for frontend in self.frontends:
+      if frontend.dispatcher: frontend.dispatcher.put(level, True, data)
+
+
+
+class CountingFrontend(BaseFrontend):
+
+  can_handle_events = True
+
+
+  def __init__(self, core, name, events, level, workers = None):
+    self.events = events
+    self.level = level
+    self.workers = workers
+    self.received = 0
+    super(CountingFrontend, self).__init__(core)
+    self.settings.name = name
+
+
+  def get_event_subscriptions(self):
+    return [EventSubscription(self.events, self.level, self.workers)]
+
+
+  def handle_event(self, event):
+    if isinstance(event, tuple):
+      level, source, name, arg, message, worker, worksource, blockchain, job, timestamp = event
+      if level > self.level: return
+      if self.events is not None and not name in self.events: return
+      if self.workers is not None and not worker in self.workers: return
+    self.received += 1
+
+
+
+def cputime():
+  return time.process_time() if hasattr(time, "process_time") else time.clock()
+
+
+
+def run(core, rate, duration):
+  workers = [FakeWorker(core) for i in range(8)]
+  frontends = [
+    CountingFrontend(core, "Everything", None, 500),
+    CountingFrontend(core, "Nonces", ["noncefound"], 1000),
+    CountingFrontend(core, "Cancels", ["canceljob"], 1000),
+    CountingFrontend(core, "One worker", ["acquirejob", "noncefound"], 1000, [workers[0]]),
+  ]
+  with core.frontendlock: core.frontends.extend(frontends)
+  for frontend in frontends: frontend.start()
+  # Don't count the events of the frontends starting up
+  time.sleep(0.1)
+  for frontend in frontends: frontend.received = 0
+  mix = [(500, "registerjob"), (450, "acquirejob"), (400, "noncefound"), (400, "hashes_calculated"), (700, "destroyjob"), (450, "canceljob")]
+  count = int(rate * duration)
+  producer = 0
+  cpu = cputime()
+  start = time.time()
+  for i in range(count):
+    level, name = mix[i % len(mix)]
+    before = time.time()
+    core.event(level, core, name, None, None, workers[i % len(workers)])
+    producer += time.time() - before
+    ahead = start + float(i + 1) / rate - time.time()
+    if ahead > 0: time.sleep(ahead)
+  # Stopping the frontends delivers everything that is still queued
+  for frontend in frontends: frontend.stop()
+  elapsed = time.time() - start
+  cpu = cputime() - cpu
+  return producer / count * 1000000, cpu / elapsed * 100, [frontend.received for frontend in frontends]
+
+
+
+def main():
+  rate = float(sys.argv[1]) if len(sys.argv) > 1 else 10000.
+  duration = float(sys.argv[2]) if len(sys.argv) > 2 else 3.
+  print("%d events at %d per second" % (rate * duration, rate))
+  for name, core in (("subscriptions", EventCore()), ("broadcast", BroadcastCore())):
+    perevent, load, received = run(core, rate, duration)
+    print("  %-14s %6.2f us per emitted event, %3.0f%% of a core, received %s" % (name + ":", perevent, load, received))
+
+
+
+if __name__ == "__main__": main()
@@ -0,0 +1,175 @@
+# Modular Python Bitcoin Miner
+# Copyright (C) 2012 Michael Sparmann (TheSeven)
+#
+#     This program is free software; you can redistribute it and/or
+#     modify it under the terms of the GNU General Public License
+#     as published by the Free Software Foundation; either version 2
+#     of the License, or (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program; if not, write to the Free Software
+#     Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Please consider donating to 1PLAPWDejJPJnY2ppYCgtw5ko8G5Q4hPzh if you
+# want to support further development of the Modular Python Bitcoin Miner.
+
+
+
+#########################################
+# Minimal core for benchmarks and tests #
+#########################################
+
+
+
+# Just enough of core.core.Core to run the real work queue, jobs, work sources
+# and blockchains in a single process, without any modules or frontends.
+
+
+
+import os
+import sys
+import time
+import threading
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from core.util import Bunch
+from core.scheduler import Scheduler
+from core.workqueue import WorkQueue
+from core.baseworker import BaseWorker
+from core.baseworksource import BaseWorkSource
+from core.worksourcegroup import WorkSourceGroup
+from core.blockchain import DummyBlockchain
+
+
+
+class FakeRegistry(object):
+
+
+  def __init__(self):
+    self.nextid = 1
+
+
+  def register(self, obj):
+    self.nextid += 1
+    return self.nextid
+
+
+  def unregister(self, id):
+    pass
+
+
+
+class FakeFetcher(object):
+
+
+  def __init__(self):
+    self.lock = threading.Condition()
+    self.wakeups = 0
+
+
+  def wakeup(self):
+    self.wakeups += 1
+
+
+  def notify_job_taken(self):
+    pass
+
+
+
+class FakeSubmitter(object):
+
+
+  def get_queue_statistics(self, worksource):
+    return 0, 0
+
+
+
+class FakeCore(object):
+
+
+  def __init__(self):
+    self.registry = FakeRegistry()
+    self.stats = Bunch(ghashes = 0, starttime = time.time())
+    self.workerlock = threading.RLock()
+    self.workers = []
+    self.blockchains = []
+    self.fetcher = FakeFetcher()
+    self.submitter = FakeSubmitter()
+    self.scheduler = Scheduler(self)
+    self.workqueue = WorkQueue(self)
+
+
+  def start(self):
+    self.scheduler.start()
+    self.workqueue.start()
+
+
+  def stop(self):
+    self.workqueue.stop()
+    self.scheduler.stop()
+
+
+  def get_blockchain_by_name(self, name):
+    for blockchain in self.blockchains:
+      if blockchain.settings.name == name: return blockchain
+    return None
+
+
+  def event(self, *args, **kwargs):
+    pass
+
+
+  def log(self, *args, **kwargs):
+    pass
+
+
+
+# Records the jobs it was asked to cancel, in order
+class FakeWorker(BaseWorker):
+
+
+  def __init__(self, core):
+    super(FakeWorker, self).__init__(core)
+    self.canceled = []
+
+
+  def notify_canceled(self, job, graceful):
+    self.canceled.append(job)
+
+
+
+# Hands out a configurable number of jobs per fetch, and tracks how often it was asked
+class FakeWorkSource(BaseWorkSource):
+
+
+  def __init__(self, core, name, priority = 1, hashrate = 0, jobs = 1, blockchain = None):
+    super(FakeWorkSource, self).__init__(core)
+    self.settings.name = name
+    self.settings.priority = priority
+    self.settings.hashrate = hashrate
+    self.blockchain = blockchain
+    self.jobsperfetch = jobs
+    self.lockoutend = 0
+    self.asked = 0
+    self.jobsfetched = 0
+
+
+  def start_fetchers(self, count, jobs):
+    self.asked += 1
+    if not self.started or not self.settings.enabled or time.time() <= self.lockoutend: return False, 0
+    self.jobsfetched += self.jobsperfetch
+    return 1, self.jobsperfetch
+
+
+
+def make_group(core, name, children, priority = 1, hashrate = 0):
+  group = WorkSourceGroup(core)
+  group.settings.name = name
+  group.settings.priority = priority
+  group.settings.hashrate = hashrate
+  for child in children: group.add_work_source(child)
+  return group
@@ -0,0 +1,132 @@
+# Modular Python Bitcoin Miner
+# Copyright (C) 2012 Michael Sparmann (TheSeven)
+#
+#     This program is free software; you can redistribute it and/or
+#     modify it under the terms of the GNU General Public License
+#     as published by the Free Software Foundation; either version 2
+#     of the License, or (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program; if not, write to the Free Software
+#     Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Please consider donating to 1PLAPWDejJPJnY2ppYCgtw5ko8G5Q4hPzh if you
+# want to support further development of the Modular Python Bitcoin Miner.
+
+
+
+###################################
+# Job membership stress benchmark #
+###################################
+
+
+
+# Registers, takes and destroys jobs across several work sources and blockchains
+# through the real work queue, with a deep job buffer, and checks that a block
+# change cancels the running jobs in registration order.
+# With --lists, the job containers are replaced by plain lists like they used to be.
+# Run from anywhere: python benchmarks/jobmembership.py [--lists] [jobs] [buffer depth]
+
+
+
+import os
+import sys
+import time
+import random
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fakecore import FakeCore, FakeWorker, FakeWorkSource, DummyBlockchain
+from core.job import Job
+import core.util
+import core.blockchain
+import core.baseworksource
+
+
+
+# The old list based containers, with the same interface as OrderedSet
+class ListSet(list):
+
+
+  def add(self, item):
+    if not item in self: self.append(item)
+
+
+  def discard(self, item):
+    while item in self: self.remove(item)
+
+
+  def pop(self):
+    return list.pop(self, 0)
+
+
+
+data = b"\0" * 80
+target = b"\xff" * 28 + b"\0" * 4
+
+
+
+def stress(core, worksources, count, depth):
+  worker = FakeWorker(core)
+  jobs = [Job(core, worksources[i % len(worksources)], time.time() + 3600, data, target, b"\0" * 32) for i in range(count)]
+  queue = core.workqueue
+  start = time.time()
+  added = 0
+  running = []
+  while added < count or running or len(queue.queue):
+    if added < count and len(queue.queue) < depth:
+      queue.add_jobs(jobs[added : added + 500])
+      added += 500
+      continue
+    job = queue.get_job(worker, 0, True)
+    if job: running.append(job)
+    # Jobs finish in random order
+    if len(running) > 64 or (running and not job):
+      job = running.pop(random.randrange(len(running)))
+      with queue.lock: job.destroy()
+  return time.time() - start
+
+
+
+def check_cancel_order(core, worksource, blockchain):
+  jobs = [Job(core, worksource, time.time() + 3600, data, target, b"\0" * 32) for i in range(20)]
+  core.workqueue.add_jobs(jobs)
+  worker = FakeWorker(core)
+  running = [core.workqueue.get_job(worker, 0) for i in range(20)]
+  for index in (3, 7, 11):
+    with core.workqueue.lock: running[index].destroy()
+  blockchain.check_job(Job(core, worksource, time.time() + 3600, b"\0" * 4 + b"\1" * 32 + b"\0" * 44, target, b"\0" * 32))
+  timeout = time.time() + 5
+  expected = [job for job in running if not job.destroyed]
+  while len(worker.canceled) < len(expected) and time.time() < timeout: time.sleep(0.01)
+  return worker.canceled == expected
+
+
+
+def main():
+  args = sys.argv[1:]
+  lists = "--lists" in args
+  args = [arg for arg in args if arg != "--lists"]
+  count = int(args[0]) if len(args) > 0 else 100000
+  depth = int(args[1]) if len(args) > 1 else 5000
+  if lists:
+    core.util.OrderedSet = core.blockchain.OrderedSet = core.baseworksource.OrderedSet = ListSet
+  random.seed(1)
+  fakecore = FakeCore()
+  fakecore.start()
+  try:
+    blockchains = [DummyBlockchain(fakecore) for i in range(3)]
+    worksources = [FakeWorkSource(fakecore, "Work source %d" % i, blockchain = blockchains[i % 3]) for i in range(6)]
+    for worksource in worksources: worksource.start()
+    duration = stress(fakecore, worksources, count, depth)
+    leftover = sum(len(obj.jobs) for obj in worksources + blockchains)
+    print("%s: %d jobs, buffer depth %d: %.2f s, %.1f us/job, %d jobs left over" % ("lists" if lists else "OrderedSet", count, depth, duration, duration / count * 1000000, leftover))
+    print("Cancel order preserved: %s" % check_cancel_order(fakecore, worksources[0], blockchains[0]))
+  finally: fakecore.stop()
+
+
+
+if __name__ == "__main__": main()
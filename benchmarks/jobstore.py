@@ -0,0 +1,138 @@
+# Modular Python Bitcoin Miner
+# Copyright (C) 2012 Michael Sparmann (TheSeven)
+#
+#     This program is free software; you can redistribute it and/or
+#     modify it under the terms of the GNU General Public License
+#     as published by the Free Software Foundation; either version 2
+#     of the License, or (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program; if not, write to the Free Software
+#     Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Please consider donating to 1PLAPWDejJPJnY2ppYCgtw5ko8G5Q4hPzh if you
+# want to support further development of the Modular Python Bitcoin Miner.
+
+
+
+########################################
+# Work queue job store micro-benchmark #
+########################################
+
+
+
+# Compares the expiry-indexed JobStore used by the work queue with the old
+# dict of per-second job lists, for the three operations the work queue does
+# under its lock: taking a job (get_job), adding jobs (add_jobs) and removing
+# a job (remove_job). Run it from anywhere: python benchmarks/jobstore.py
+
+
+
+import os
+import sys
+import time
+import random
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from core.jobstore import JobStore
+
+
+
+class FakeJob(object):
+
+  __slots__ = ("expiry", "queuenode", "jobcount")
+
+
+  def __init__(self, expiry):
+    self.expiry = expiry
+    self.queuenode = None
+    self.jobcount = 1
+
+
+
+# The work queue storage before it was indexed, reduced to the same three operations
+class ListStore(object):
+
+
+  def __init__(self):
+    self.lists = {}
+
+
+  def add(self, job):
+    self.lists.setdefault(int(job.expiry), []).append(job)
+
+
+  def remove(self, job):
+    jobs = self.lists.get(int(job.expiry))
+    if jobs and job in jobs: jobs.remove(job)
+
+
+  def pop(self, min_expiry):
+    keys = sorted(self.lists.keys())
+    for expiry in keys:
+      if expiry <= min_expiry or not self.lists[expiry]: continue
+      return self.lists[expiry].pop(0)
+    for expiry in reversed(keys):
+      if self.lists[expiry]: return self.lists[expiry].pop(0)
+
+
+
+def make_jobs(count, now):
+  # Expiry spread over 90 seconds, like a buffer filled by several work sources
+  return [FakeJob(now + 30 + random.random() * 90) for i in range(count)]
+
+
+
+def measure(store, indexed, size, rounds):
+  now = 1000.
+  jobs = make_jobs(size, now)
+  for job in jobs:
+    if indexed: job.queuenode = store.add(job)
+    else: store.add(job)
+  # get_job: take the best match and put it back, so the size stays the same
+  start = time.time()
+  for i in range(rounds):
+    job = store.pop(now + 40)
+    if indexed: job.queuenode = store.add(job)
+    else: store.add(job)
+  get = time.time() - start
+  # remove_job: remove a random job and add it again
+  victims = [random.choice(jobs) for i in range(rounds)]
+  start = time.time()
+  for job in victims:
+    if indexed:
+      store.remove(job.queuenode)
+      job.queuenode = store.add(job)
+    else:
+      store.remove(job)
+      store.add(job)
+  remove = time.time() - start
+  # add_jobs: batches of 16 new jobs, removed again afterwards (not timed)
+  batches = [make_jobs(16, now) for i in range(max(1, rounds // 16))]
+  start = time.time()
+  for batch in batches:
+    for job in batch:
+      if indexed: job.queuenode = store.add(job)
+      else: store.add(job)
+  add = time.time() - start
+  return get / rounds * 1000000, remove / rounds * 1000000, add / (16 * len(batches)) * 1000000
+
+
+
+def main():
+  random.seed(1)
+  rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+  print("Microseconds per operation, old dict of lists -> JobStore")
+  print("%8s  %21s  %21s  %21s" % ("jobs", "get_job", "remove_job", "add_jobs (per job)"))
+  for size in (10, 100, 1000, 10000, 100000):
+    old = measure(ListStore(), False, size, rounds)
+    new = measure(JobStore(), True, size, rounds)
+    print("%8d  %9.2f -> %8.2f  %9.2f -> %8.2f  %9.2f -> %8.2f" % (size, old[0], new[0], old[1], new[1], old[2], new[2]))
+
+
+
+if __name__ == "__main__": main()
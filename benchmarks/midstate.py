@@ -0,0 +1,73 @@
+# Modular Python Bitcoin Miner
+# Copyright (C) 2012 Michael Sparmann (TheSeven)
+#
+#     This program is free software; you can redistribute it and/or
+#     modify it under the terms of the GNU General Public License
+#     as published by the Free Software Foundation; either version 2
+#     of the License, or (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program; if not, write to the Free Software
+#     Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Please consider donating to 1PLAPWDejJPJnY2ppYCgtw5ko8G5Q4hPzh if you
+# want to support further development of the Modular Python Bitcoin Miner.
+
+
+
+#############################
+# Midstate engine benchmark #
+#############################
+
+
+
+# Midstates per second of every available engine, for single midstates and batches.
+# Run from anywhere: python benchmarks/midstate.py [seconds per measurement]
+
+
+
+import os
+import sys
+import time
+import struct
+from hashlib import sha256
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from core import midstate
+
+
+
+def rate(function, count, duration):
+  start = time.time()
+  done = 0
+  while time.time() - start < duration:
+    function()
+    done += count
+  return done / (time.time() - start)
+
+
+
+def main():
+  duration = float(sys.argv[1]) if len(sys.argv) > 1 else 1.
+  headers = [sha256(struct.pack("<I", i)).digest() * 2 + b"\0" * 16 for i in range(4096)]
+  batches = (16, 256, 4096)
+  print("Midstates per second")
+  print("%-10s %10s" % ("engine", "single") + "".join(" %10s" % ("batch %d" % size) for size in batches))
+  for engineclass in midstate.engines:
+    try: engine = engineclass()
+    except Exception as e:
+      print("%-10s not available: %s" % (engineclass.name, e))
+      continue
+    line = "%-10s %10.0f" % (engine.name, rate(lambda: engine.midstate(headers[0]), 1, duration))
+    for size in batches: line += " %10.0f" % rate(lambda: engine.midstates(headers[:size]), size, duration)
+    print(line)
+  for name, reason in midstate.rejected: print("%s engine rejected: %s" % (name, reason))
+  print("Selected: %s, %s for batches" % (midstate.engine.name, midstate.batchengine.name))
+
+
+
+if __name__ == "__main__": main()
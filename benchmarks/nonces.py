@@ -0,0 +1,132 @@
+# Modular Python Bitcoin Miner
+# Copyright (C) 2012 Michael Sparmann (TheSeven)
+#
+#     This program is free software; you can redistribute it and/or
+#     modify it under the terms of the GNU General Public License
+#     as published by the Free Software Foundation; either version 2
+#     of the License, or (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program; if not, write to the Free Software
+#     Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Please consider donating to 1PLAPWDejJPJnY2ppYCgtw5ko8G5Q4hPzh if you
+# want to support further development of the Modular Python Bitcoin Miner.
+
+
+
+################################
+# Nonce verification benchmark #
+################################
+
+
+
+# Nonces per second verified by Job.nonce_found and by Job.nonces_found in batches
+# of different sizes, using the genesis block header with every other nonce valid.
+# Log lines go into a queue like they would with a frontend subscribed, events too
+# unless nobody is subscribed to them.
+# Run from anywhere: python benchmarks/nonces.py [seconds per measurement]
+
+
+
+import os
+import sys
+import time
+import struct
+from binascii import unhexlify
+from datetime import datetime
+try: from queue import Queue
+except ImportError: from Queue import Queue
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fakecore import FakeCore, FakeWorker, FakeWorkSource, DummyBlockchain
+from core.job import Job
+
+
+
+class QueueCore(FakeCore):
+
+
+  def __init__(self):
+    self.queue = Queue()
+    self.subscribed = True
+    super(QueueCore, self).__init__()
+
+
+  def wants_event(self, level, event):
+    return self.subscribed
+
+
+  def event(self, *args, **kwargs):
+    self.queue.put((args, kwargs, datetime.now()))
+
+
+  def log(self, source, message, loglevel, format = "", *args):
+    if callable(message): message = message(*args)
+    elif args: message = message % args
+    self.queue.put((source, datetime.now(), loglevel, [(message, format)]))
+
+
+  def drain(self):
+    while not self.queue.empty(): self.queue.get()
+
+
+
+class CountingWorkSource(FakeWorkSource):
+
+
+  def nonce_found(self, job, data, nonce, noncediff):
+    self.jobsfetched += 1
+
+
+
+def make_job(core):
+  header = struct.pack("<I", 1) + b"\0" * 32 + unhexlify(b"3ba3edfd7a7b12b27ac72c3e67768f617fc81bc3888a51323a9fb8aa4b1e5e4a") \
+         + struct.pack("<III", 1231006505, 0x1d00ffff, 2083236893)
+  data = struct.pack("<20I", *struct.unpack(">20I", header)) + b"\0" * 48
+  worksource = CountingWorkSource(core, "bench", blockchain = DummyBlockchain(core))
+  job = Job(core, worksource, time.time() + 60, data, b"\xff" * 32)
+  job.worker = FakeWorker(core)
+  return job
+
+
+
+def rate(core, function, duration):
+  start = time.time()
+  done = 0
+  while time.time() - start < duration:
+    done += function()
+    core.drain()
+  return done / (time.time() - start)
+
+
+
+def main():
+  duration = float(sys.argv[1]) if len(sys.argv) > 1 else 1.
+  core = QueueCore()
+  job = make_job(core)
+  good = job.data[76:80]
+  nonces = [good if i % 2 else struct.pack("<I", i) for i in range(16)]
+  expected = [bool(i % 2) for i in range(16)]
+  print("Results identical: %s" % ([job.nonce_found(nonce) for nonce in nonces] == expected == job.nonces_found(nonces)))
+  core.drain()
+  def single():
+    for nonce in nonces: job.nonce_found(nonce)
+    return len(nonces)
+  def batched(count):
+    for i in range(0, len(nonces), count): job.nonces_found(nonces[i:i + count])
+    return len(nonces)
+  for subscribed in (True, False):
+    core.subscribed = subscribed
+    print("Nonces per second, nonce events %s" % ("subscribed" if subscribed else "not subscribed"))
+    print("  nonce_found:                %8.0f" % rate(core, single, duration))
+    for count in (4, 16):
+      print("  nonces_found(%2d):           %8.0f" % (count, rate(core, lambda: batched(count), duration)))
+
+
+
+if __name__ == "__main__": main()
@@ -0,0 +1,120 @@
+# Modular Python Bitcoin Miner
+# Copyright (C) 2012 Michael Sparmann (TheSeven)
+#
+#     This program is free software; you can redistribute it and/or
+#     modify it under the terms of the GNU General Public License
+#     as published by the Free Software Foundation; either version 2
+#     of the License, or (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program; if not, write to the Free Software
+#     Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Please consider donating to 1PLAPWDejJPJnY2ppYCgtw5ko8G5Q4hPzh if you
+# want to support further development of the Modular Python Bitcoin Miner.
+
+
+
+######################################
+# SQLite statistics writer benchmark #
+######################################
+
+
+
+# Sustained events per second that the SQLite statistics logger gets to disk.
+# Events are handed to SQLiteStats.handle_event as fast as the frontend accepts
+# them, like its delivery thread would, and the frontend is stopped afterwards,
+# which writes everything that is still queued. Every 8 events belong to a new
+# job, so job rows are written as well. The database goes to a temporary directory.
+# Run from anywhere: python benchmarks/sqlitestats.py [events per measurement]
+
+
+
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+from datetime import datetime
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fakecore import FakeCore, FakeWorker, FakeWorkSource, DummyBlockchain
+from core.eventbus import Event
+from modules.theseven.sqlite.sqlitestats import SQLiteStats
+
+
+
+class LoggerCore(FakeCore):
+
+  default_loglevel = 500
+
+
+  def update_log_filter(self):
+    pass
+
+
+  def update_event_filter(self):
+    pass
+
+
+
+class FakeJob(object):
+
+
+  def __init__(self, worksource, data):
+    self.worksource = worksource
+    self.data = data
+
+
+
+def measure(directory, count, batchsize):
+  core = LoggerCore()
+  filename = os.path.join(directory, "stats%d.db" % batchsize)
+  frontend = SQLiteStats(core)
+  frontend.settings.filename = filename
+  frontend.settings.statinterval = 0
+  frontend.settings.batchsize = batchsize
+  frontend.apply_settings()
+  workers = [FakeWorker(core) for i in range(50)]
+  for i, worker in enumerate(workers): worker.settings.name = "Worker %d" % i
+  blockchain = DummyBlockchain(core)
+  worksource = FakeWorkSource(core, "Work source", blockchain = blockchain)
+  events = []
+  for i in range(count):
+    if i % 8 == 0: job = FakeJob(worksource, os.urandom(80))
+    worker = workers[i % len(workers)]
+    events.append(Event(450, worker, "noncevalid", i, "1.0", worker, worksource, blockchain, job, datetime.now()))
+  frontend.start()
+  try:
+    start = time.time()
+    for event in events: frontend.handle_event(event)
+    queued = time.time()
+  finally: frontend.stop()
+  end = time.time()
+  db = sqlite3.connect(filename)
+  rows = db.execute("SELECT COUNT(*) FROM [event]").fetchone()[0]
+  jobs = db.execute("SELECT COUNT(*) FROM [job]").fetchone()[0]
+  db.close()
+  return (queued - start) / count * 1000000, count / (end - start), rows, jobs
+
+
+
+def main():
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+  directory = tempfile.mkdtemp()
+  try:
+    print("%d events, up to batchsize events per transaction" % count)
+    for batchsize in (5000, 500, 50):
+      perevent, rate, rows, jobs = measure(directory, count, batchsize)
+      print("  batchsize %4d: %5.2f us per queued event, %7.0f events/s to disk, %d event rows, %d job rows"
+            % (batchsize, perevent, rate, rows, jobs))
+  finally: shutil.rmtree(directory)
+
+
+
+if __name__ == "__main__": main()
@@ -0,0 +1,120 @@
+# Modular Python Bitcoin Miner
+# Copyright (C) 2012 Michael Sparmann (TheSeven)
+#
+#     This program is free software; you can redistribute it and/or
+#     modify it under the terms of the GNU General Public License
+#     as published by the Free Software Foundation; either version 2
+#     of the License, or (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program; if not, write to the Free Software
+#     Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Please consider donating to 1PLAPWDejJPJnY2ppYCgtw5ko8G5Q4hPzh if you
+# want to support further development of the Modular Python Bitcoin Miner.
+
+
+
+###################################
+# Stratum job generator benchmark #
+###################################
+
+
+
+# Jobs per second generated by StratumWorkSource._generate_jobs from a synthetic
+# mining.notify (150 byte coinbase, 12 merkle branch entries), in batches of
+# different sizes, compared with building every coinbase from scratch.
+# Run from anywhere: python benchmarks/stratum.py [seconds per measurement]
+
+
+
+import os
+import sys
+import time
+import struct
+from binascii import unhexlify
+from hashlib import sha256
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fakecore import FakeCore
+from core.job import Job
+from modules.theseven.stratum.stratumworksource import StratumWorkSource
+
+
+
+def make_source(core):
+  source = StratumWorkSource(core)
+  source.shutdown = False
+  source.extranonce1 = b"\1\2\3\4"
+  source.extranonce2len = 4
+  data = {
+    "job_id": "bench",
+    "prevhash": b"\0" * 32,
+    "coinb1": b"\1" * 60,
+    "coinb2": b"\2" * 90,
+    "merkle_branch": [struct.pack("B", i) * 32 for i in range(12)],
+    "version": b"\0\0\0\2",
+    "nbits": unhexlify(b"1a0abbcd"),
+    "ntime": 0x504e86b9 - int(time.time()),
+    "extranonce1": source.extranonce1,
+    "extranonce2len": source.extranonce2len,
+    "extranonce2": 0,
+    "difficulty": 1,
+    "target": source.target,
+  }
+  source._prepare_data(data)
+  source.data = data
+  return source
+
+
+
+def generate_naive(source, count):
+  # Rebuilds and hashes the whole coinbase for every job, like the generator used to
+  data = source.data
+  jobs = []
+  now = time.time()
+  ntime = struct.pack(">I", data["ntime"] + int(now))
+  for i in range(count):
+    extranonce2 = data["extranonce2_format"] % data["extranonce2"]
+    data["extranonce2"] += 1
+    coinbase = data["coinb1"] + data["extranonce1"] + unhexlify(extranonce2.encode("ascii")) + data["coinb2"]
+    merkle = sha256(sha256(coinbase).digest()).digest()
+    for branch in data["merkle_branch"]: merkle = sha256(sha256(merkle + branch).digest()).digest()
+    merkle = struct.pack("<8I", *struct.unpack(">8I", merkle))
+    header = data["version"] + data["prevhash"] + merkle + ntime + data["nbits"] + source.tail
+    jobs.append(Job(source.core, source, now + 60, header, data["target"]))
+  return jobs
+
+
+
+def rate(function, count, duration):
+  start = time.time()
+  done = 0
+  while time.time() - start < duration:
+    function(count)
+    done += count
+  return done / (time.time() - start)
+
+
+
+def main():
+  duration = float(sys.argv[1]) if len(sys.argv) > 1 else 1.
+  source = make_source(FakeCore())
+  # Both ways have to produce the same headers
+  source.data["extranonce2"] = 0
+  naive = [job.data for job in generate_naive(source, 20)]
+  source.data["extranonce2"] = 0
+  batched = [job.data for job in source._generate_jobs(20)]
+  print("Headers identical: %s" % (naive == batched))
+  print("Jobs per second")
+  print("  rebuilding the coinbase:    %8.0f" % rate(lambda count: generate_naive(source, count), 1, duration))
+  for count in (1, 16, 64):
+    print("  _generate_jobs(%2d):         %8.0f" % (count, rate(source._generate_jobs, count, duration)))
+
+
+
+if __name__ == "__main__": main()
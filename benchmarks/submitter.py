@@ -0,0 +1,149 @@
+# Modular Python Bitcoin Miner
+# Copyright (C) 2012 Michael Sparmann (TheSeven)
+#
+#     This program is free software; you can redistribute it and/or
+#     modify it under the terms of the GNU General Public License
+#     as published by the Free Software Foundation; either version 2
+#     of the License, or (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program; if not, write to the Free Software
+#     Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Please consider donating to 1PLAPWDejJPJnY2ppYCgtw5ko8G5Q4hPzh if you
+# want to support further development of the Modular Python Bitcoin Miner.
+
+
+
+#######################################
+# Share submission overhead benchmark #
+#######################################
+
+
+
+# Per-share cost of the whole share path, from Job.nonce_found through the
+# Submitter and its threads to Job.nonce_handled_callback, for a work source that
+# accepts every share right away. Uses the real Core.log and Core.event, with
+# loggers at different levels and nobody subscribed to events. Reports the time
+# spent by the thread that found the shares, and the end-to-end throughput.
+# Run from anywhere: python benchmarks/submitter.py [shares per measurement]
+
+
+
+import os
+import sys
+import time
+import struct
+from binascii import unhexlify
+from collections import deque
+from threading import Condition, Lock, RLock
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fakecore import FakeCore, FakeWorker, FakeWorkSource, DummyBlockchain
+from core.core import Core
+from core.util import Bunch
+from core.job import Job
+from core.submitter import Submitter
+
+
+
+class QueueDispatcher(object):
+
+
+  def __init__(self):
+    self.queue = deque()
+
+
+  def put(self, level, islog, data):
+    self.queue.append(data)
+
+
+
+# The core's own logging and event code, with one logger frontend
+class LogCore(FakeCore):
+
+  log = Core.__dict__["log"]
+  log_multi = Core.__dict__["log_multi"]
+  event = Core.__dict__["event"]
+  wants_event = Core.__dict__["wants_event"]
+
+
+  def __init__(self, loglevel):
+    self.started = True
+    self.default_loglevel = loglevel
+    self.loglevel = loglevel
+    self.logbuf = {}
+    self.loglock = RLock()
+    self.logbacklog = deque()
+    self.dispatcher = QueueDispatcher()
+    self.logdispatchers = [(loglevel, self.dispatcher)]
+    self.eventtable = ({}, (-1, ()))
+    self.eventstats = Bunch(lock = Lock(), emitted = 0, dropped = 0)
+    super(LogCore, self).__init__()
+    self.submitter = Submitter(self)
+
+
+
+class InstantWorkSource(FakeWorkSource):
+
+  submit_concurrency = 4
+
+
+  def __init__(self, core):
+    super(InstantWorkSource, self).__init__(core, "bench", blockchain = DummyBlockchain(core))
+    self.handled = 0
+    self.handledlock = Condition()
+
+
+  def nonce_found(self, job, data, nonce, noncediff):
+    self.core.submitter.submit(self, job, data, nonce, noncediff)
+
+
+  def _submit_share(self, share):
+    self.core.submitter.finish(share, True)
+    with self.handledlock:
+      self.handled += 1
+      self.handledlock.notify_all()
+
+
+
+def measure(loglevel, count):
+  core = LogCore(loglevel)
+  core.start()
+  core.submitter.start()
+  try:
+    header = struct.pack("<I", 1) + b"\0" * 32 + unhexlify(b"3ba3edfd7a7b12b27ac72c3e67768f617fc81bc3888a51323a9fb8aa4b1e5e4a") \
+           + struct.pack("<III", 1231006505, 0x1d00ffff, 2083236893)
+    data = struct.pack("<20I", *struct.unpack(">20I", header)) + b"\0" * 48
+    worksource = InstantWorkSource(core)
+    worksource.start()
+    job = Job(core, worksource, time.time() + 60, data, b"\xff" * 32)
+    job.set_worker(FakeWorker(core))
+    nonce = data[76:80]
+    start = time.time()
+    for i in range(count): job.nonce_found(nonce)
+    found = time.time()
+    with worksource.handledlock:
+      while worksource.handled < count: worksource.handledlock.wait(1)
+    end = time.time()
+    return (found - start) / count * 1000000, count / (end - start), len(core.dispatcher.queue)
+  finally:
+    core.submitter.stop()
+    core.stop()
+
+
+
+def main():
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+  print("Loggers at   us/share on finder thread   shares/s end to end   log lines")
+  for loglevel in (500, 300, 100):
+    perfound, rate, lines = measure(loglevel, count)
+    print("  %3d           %8.2f                  %10.0f          %8d" % (loglevel, perfound, rate, lines))
+
+
+
+if __name__ == "__main__": main()
@@ -29,7 +29,7 @@
 import time
 import traceback
 from binascii import hexlify
-from threading import RLock, Thread
+from threading import RLock
 from .baseworksource import BaseWorkSource
 from .blockchain import DummyBlockchain
 
@@ -38,6 +38,9 @@ from .blockchain import DummyBlockchain
 class ActualWorkSource(BaseWorkSource):
 
   nonce_found_async = True
+  # Maximum number of shares that are submitted to this work source in parallel
+  submit_concurrency = 4
+  volatile_statistics = BaseWorkSource.volatile_statistics | frozenset(["locked_out"])
   settings = dict(BaseWorkSource.settings, **{
     "errorlimit": {"title": "Error limit", "type": "int", "position": 20000},
     "errorlockout_factor": {"title": "Error lockout factor", "type": "int", "position": 20100},
@@ -61,10 +64,13 @@ class ActualWorkSource(BaseWorkSource):
     self.lockoutend = 0
     self.estimated_jobs = 1
     self.estimated_expiry = 60
+    self.jobsperrequest = 1.
+    self.estimated_latency = 1.
     
       
   def _stop(self):
     self._cancel_jobs()
+    self.core.submitter.discard(self)
     super(ActualWorkSource, self)._stop()
     
     
@@ -75,6 +81,7 @@ class ActualWorkSource(BaseWorkSource):
     stats.locked_out = lockout if lockout > 0 else 0
     stats.consecutive_errors = self.errors
     stats.jobs_per_request = self.estimated_jobs
+    stats.fetch_latency = self.estimated_latency
     stats.job_expiry = self.estimated_expiry
     stats.blockchain = self.blockchain
     stats.blockchain_id = self.blockchain.id
@@ -126,12 +133,18 @@ class ActualWorkSource(BaseWorkSource):
     with self.statelock:
       self.errors = 0
       if jobs:
-        jobcount = len(jobs)
-        self.estimated_jobs = jobcount
+        jobcount = sum(job.jobcount for job in jobs)
+        self.jobsperrequest = self.jobsperrequest * 0.8 + jobcount * 0.2
+        self.estimated_jobs = max(1, int(round(self.jobsperrequest)))
         self.estimated_expiry = int(jobs[0].expiry - time.time())
         with self.stats.lock: self.stats.jobsreceived += jobcount
 
     
+  def _handle_fetch_latency(self, latency):
+    with self.statelock: self.estimated_latency = self.estimated_latency * 0.8 + latency * 0.2
+    with self.stats.lock: self.stats.latency.fetch.add(latency)
+
+
   def _handle_error(self, upload = False):
     with self.statelock:
       self.errors += 1
@@ -152,7 +165,7 @@ class ActualWorkSource(BaseWorkSource):
     self._handle_success(jobs)
     if jobs:
       accepted = self.core.workqueue.add_jobs(jobs, self, source)
-      if accepted != len(jobs): self._handle_stale()
+      if accepted != sum(job.jobcount for job in jobs): self._handle_stale()
       return accepted
     else: return 0
       
@@ -162,13 +175,18 @@ class ActualWorkSource(BaseWorkSource):
     return self._get_running_fetcher_count()
 
     
+  def get_fetch_latency(self):
+    if not self.started or not self.settings.enabled: return None
+    return self.estimated_latency
+
+    
   def start_fetchers(self, count, jobs):
     if not self.started or not self.settings.enabled or self._is_locked_out() or not count: return False, 0
     started = 0
     totaljobs = 0
     try:
       while started < count:
-        result, newjobs = self._start_fetcher()
+        result, newjobs = self._start_fetcher(jobs - totaljobs)
         totaljobs += newjobs
         if result:
           started += result
@@ -177,19 +195,23 @@ class ActualWorkSource(BaseWorkSource):
           if started: return started, totaljobs
           return result, 0
     except:
-      self.core.log(self, "Error while fetching job: %s\n" % (traceback.format_exc()), 200, "y")
+      self.core.log(self, "Error while fetching job: %s\n", 200, "y", traceback.format_exc())
       self._handle_error()
     if started: return started, totaljobs
     return False, 0
 
 
   def nonce_found(self, job, data, nonce, noncediff):
-    if self.nonce_found_async:
-      thread = Thread(None, self.nonce_found_thread, self.settings.name + "_nonce_found_" + hexlify(nonce).decode("ascii"), (job, data, nonce, noncediff))
-      thread.daemon = True
-      thread.start()
+    if self.nonce_found_async: self.core.submitter.submit(self, job, data, nonce, noncediff)
     else: self.nonce_found_thread(job, data, nonce, noncediff)
 
+
+  def _submit_share(self, share):
+    # Called by the share submitter, exceptions cause a retry
+    result = self._nonce_found(share.job, share.data, share.nonce, share.noncediff)
+    self._handle_success()
+    self.core.submitter.finish(share, result)
+
     
   def nonce_found_thread(self, job, data, nonce, noncediff):
     tries = 0
@@ -199,7 +221,7 @@ class ActualWorkSource(BaseWorkSource):
         self._handle_success()
         return job.nonce_handled_callback(nonce, noncediff, result)
       except:
-        self.core.log(self, "Error while sending share %s (difficulty %.5f): %s\n" % (hexlify(nonce).decode("ascii"), noncediff, traceback.format_exc()), 200, "y")
+        self.core.log(self, "Error while sending share %s (difficulty %.5f): %s\n", 200, "y", hexlify(nonce).decode("ascii"), noncediff, traceback.format_exc())
         tries += 1
         self._handle_error(True)
         time.sleep(min(30, tries))
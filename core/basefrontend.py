@@ -30,6 +30,8 @@ from threading import RLock
 from .util import Bunch
 from .startable import Startable
 from .inflatable import Inflatable
+from .dispatcher import FrontendDispatcher
+from .eventbus import EventSubscription
 
 
 
@@ -42,10 +44,24 @@ class BaseFrontend(Startable, Inflatable):
   can_autodetect = False
   settings = dict(Inflatable.settings, **{
     "name": {"title": "Name", "type": "string", "position": 100},
+    "queuelength": {"title": "Delivery queue length", "type": "int", "position": 200},
+    "overflowpolicy": {
+      "title": "Delivery queue overflow policy",
+      "type": "enum",
+      "values": [
+        {"value": "drop_oldest", "title": "Drop oldest messages"},
+        {"value": "drop_level", "title": "Drop messages above the overflow level"},
+        {"value": "block", "title": "Wait for the frontend"},
+      ],
+      "position": 210,
+    },
+    "overflowlevel": {"title": "Delivery queue overflow level", "type": "int", "position": 220},
   })
 
 
   def __init__(self, core, state = None):
+    # Delivers log messages and events to this frontend while it is running
+    self.dispatcher = None
     Inflatable.__init__(self, core, state)
     Startable.__init__(self)
     self.does_log = self.__class__.can_log
@@ -62,8 +78,59 @@ class BaseFrontend(Startable, Inflatable):
     Inflatable.apply_settings(self)
     if not "name" in self.settings or not self.settings.name:
       self.settings.name = getattr(self.__class__, "default_name", "Untitled frontend")
+    if not "queuelength" in self.settings: self.settings.queuelength = 10000
+    if not "overflowpolicy" in self.settings: self.settings.overflowpolicy = "drop_oldest"
+    if not "overflowlevel" in self.settings: self.settings.overflowlevel = 300
+    dispatcher = self.dispatcher
+    if dispatcher:
+      dispatcher.length = self.settings.queuelength
+      dispatcher.policy = self.settings.overflowpolicy
+      dispatcher.level = self.settings.overflowlevel
+    self._update_filters()
+
+
+  def get_log_level(self):
+    # Returns the highest log level that this frontend keeps
+    return float("inf")
+
+
+  def get_event_subscriptions(self):
+    # Returns a list of EventSubscriptions, only matching events will be queued
+    # for this frontend. Call self._update_filters() if they change.
+    return [EventSubscription()]
+
+
+  def handle_event(self, event):
+    # Frontends that still implement the old interface get the event as arguments
+    self.handle_stats_event(*event.astuple())
 
 
   def _reset(self):
     self.core.event(300, self, "reset", None, "Resetting frontend state")
     Startable._reset(self)
+
+
+  def start(self):
+    with self.start_stop_lock:
+      Startable.start(self)
+      if self.started and not self.dispatcher and (self.can_log or self.can_handle_events):
+        self.dispatcher = FrontendDispatcher(self.core, self, self.settings.queuelength,
+                                             self.settings.overflowpolicy, self.settings.overflowlevel)
+        self.dispatcher.start()
+    self._update_filters()
+
+
+  def stop(self):
+    # Stop handing out messages, deliver the ones that are still queued, then shut down
+    with self.start_stop_lock:
+      dispatcher = self.dispatcher
+      self.dispatcher = None
+      self._update_filters()
+      if dispatcher: dispatcher.stop()
+      Startable.stop(self)
+    self._update_filters()
+
+
+  def _update_filters(self):
+    self.core.update_log_filter()
+    self.core.update_event_filter()
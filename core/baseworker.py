@@ -29,7 +29,7 @@
 import time
 from threading import RLock, Thread
 from .util import Bunch
-from .statistics import StatisticsProvider
+from .statistics import StatisticsProvider, RateStatistics, LatencyStatistics, add_rate_statistics, add_waste_statistics, add_latency_statistics
 from .startable import Startable
 from .inflatable import Inflatable
 
@@ -76,6 +76,13 @@ class BaseWorker(StatisticsProvider, Startable, Inflatable):
     self.stats.sharesaccepted = 0
     self.stats.sharesrejected = 0
     self.stats.sharesinvalid = 0
+    self.stats.avgjobgap = 0
+    self.stats.maxjobgap = 0
+    self.stats.ghashes_canceled = 0
+    self.stats.ghashes_stale = 0
+    self.stats.sharesstale = 0
+    self.stats.rates = RateStatistics()
+    self.stats.latency = LatencyStatistics()
     
     
   def _get_statistics(self, stats, childstats):
@@ -90,6 +97,11 @@ class BaseWorker(StatisticsProvider, Startable, Inflatable):
     stats.sharesrejected = self.stats.sharesrejected + childstats.calculatefieldsum("sharesrejected")
     stats.sharesinvalid = self.stats.sharesinvalid + childstats.calculatefieldsum("sharesinvalid")
     stats.parallel_jobs = self.parallel_jobs + childstats.calculatefieldsum("parallel_jobs")
+    stats.avgjobgap = childstats.calculatefieldavg("avgjobgap") if childstats else self.stats.avgjobgap
+    stats.maxjobgap = max([self.stats.maxjobgap] + [child.maxjobgap for child in childstats])
+    add_rate_statistics(stats, childstats, self.stats.rates)
+    add_waste_statistics(stats, childstats, self.stats)
+    add_latency_statistics(stats, childstats, self.stats.latency)
     stats.current_job = self.job
     stats.current_work_source = getattr(stats.current_job, "worksource", None) if stats.current_job else None
     stats.current_work_source_id = stats.current_work_source.id if stats.current_work_source else None
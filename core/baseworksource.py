@@ -28,8 +28,8 @@
 
 import time
 from threading import RLock
-from .util import Bunch
-from .statistics import StatisticsProvider
+from .util import Bunch, OrderedSet
+from .statistics import StatisticsProvider, RateStatistics, LatencyStatistics, add_rate_statistics, add_waste_statistics, add_latency_statistics
 from .startable import Startable
 from .inflatable import Inflatable
 
@@ -38,6 +38,7 @@ from .inflatable import Inflatable
 class BaseWorkSource(StatisticsProvider, Startable, Inflatable):
 
   is_group = False
+  volatile_statistics = StatisticsProvider.volatile_statistics | frozenset(["oldestshare"])
   settings = dict(Inflatable.settings, **{
     "name": {"title": "Name", "type": "string", "position": 100},
     "enabled": {"title": "Enabled", "type": "boolean", "position": 200},
@@ -53,6 +54,8 @@ class BaseWorkSource(StatisticsProvider, Startable, Inflatable):
 
     self.parent = None
     self.statelock = RLock()
+    # Incremented whenever all jobs of this work source become stale (protected by the work queue lock)
+    self.generation = 0
     
     
   def destroy(self):
@@ -72,8 +75,9 @@ class BaseWorkSource(StatisticsProvider, Startable, Inflatable):
   def _reset(self):
     self.core.event(300, self, "reset", None, "Resetting work source state", worksource = self)
     Startable._reset(self)
-    self.mhashes_pending = 0
+    # Work lost to stale jobs, which the parent's scheduler gives back bit by bit
     self.mhashes_deferred = 0
+    self.accountinglocks = 0
     self.stats.starttime = time.time()
     self.stats.ghashes = 0
     self.stats.jobrequests = 0
@@ -85,7 +89,16 @@ class BaseWorkSource(StatisticsProvider, Startable, Inflatable):
     self.stats.sharesaccepted = 0
     self.stats.sharesrejected = 0
     self.stats.difficulty = 0
-    self.jobs = []
+    self.stats.ghashes_canceled = 0
+    self.stats.ghashes_stale = 0
+    self.stats.sharesstale = 0
+    self.stats.jobsexpired = 0
+    self.stats.jobsstale = 0
+    self.stats.fetchesdiscarded = 0
+    self.stats.jobsdiscarded = 0
+    self.stats.rates = RateStatistics()
+    self.stats.latency = LatencyStatistics()
+    self.jobs = OrderedSet()
     
     
   def _get_statistics(self, stats, childstats):
@@ -102,6 +115,13 @@ class BaseWorkSource(StatisticsProvider, Startable, Inflatable):
     stats.sharesaccepted = self.stats.sharesaccepted + childstats.calculatefieldsum("sharesaccepted")
     stats.sharesrejected = self.stats.sharesrejected + childstats.calculatefieldsum("sharesrejected")
     stats.difficulty = self.stats.difficulty
+    stats.accountinglocks = self.accountinglocks + childstats.calculatefieldsum("accountinglocks")
+    sharequeue, oldestshare = self.core.submitter.get_queue_statistics(self)
+    stats.sharequeue = sharequeue + childstats.calculatefieldsum("sharequeue")
+    stats.oldestshare = childstats.calculatefieldmax("oldestshare", oldestshare)
+    add_rate_statistics(stats, childstats, self.stats.rates)
+    add_waste_statistics(stats, childstats, self.stats)
+    add_latency_statistics(stats, childstats, self.stats.latency)
     
     
   def set_parent(self, parent = None):
@@ -113,29 +133,37 @@ class BaseWorkSource(StatisticsProvider, Startable, Inflatable):
 
     
   def add_job(self, job):
-    if not job in self.jobs: self.jobs.append(job)
+    self.jobs.add(job)
   
 
   def remove_job(self, job):
-    while job in self.jobs: self.jobs.remove(job)
+    # Jobs of older generations aren't in the list any more
+    if job.worksourcegeneration != self.generation: return
+    self.jobs.discard(job)
 
 
   def _cancel_jobs(self, graceful = False):
-    cancel = []
+    # Starting a new generation makes all current jobs stale at once. The work queue
+    # won't hand them out any more, and takes care of canceling and destroying them.
     with self.core.workqueue.lock:
-      while self.jobs:
-        job = self.jobs.pop(0)
-        if job.worker: cancel.append(job)
-        else: job.destroy()
-    if not graceful: self.jobs = []
-    self.core.workqueue.cancel_jobs(cancel, graceful)
+      self.generation += 1
+      jobs = self.jobs
+      self.jobs = OrderedSet()
+    if jobs: self.core.workqueue.cancel_stale_jobs(jobs, graceful)
   
 
-  def add_pending_mhashes(self, mhashes):
-    with self.statelock: self.mhashes_pending += mhashes
-    if self.parent: self.parent.add_pending_mhashes(mhashes)
-
-    
   def add_deferred_mhashes(self, mhashes):
-    with self.statelock: self.mhashes_deferred += mhashes
-    if self.parent: self.parent.add_deferred_mhashes(mhashes)
+    # Only touches our own counter, the parent's scheduler collects it using take_refund
+    with self.statelock:
+      self.accountinglocks += 1
+      self.mhashes_deferred += mhashes
+
+
+  def take_refund(self, fraction):
+    # Gives back the given fraction of the deferred mhashes, and returns that amount
+    with self.statelock:
+      self.accountinglocks += 1
+      if not self.mhashes_deferred: return 0
+      refunded = self.mhashes_deferred * fraction
+      self.mhashes_deferred -= refunded
+    return refunded
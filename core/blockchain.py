@@ -28,8 +28,8 @@
 
 import time
 from threading import RLock
-from .util import Bunch
-from .statistics import StatisticsProvider, StatisticsList
+from .util import Bunch, OrderedSet
+from .statistics import StatisticsProvider, StatisticsList, add_rate_statistics, add_waste_statistics, add_latency_statistics
 from .startable import Startable
 from .inflatable import Inflatable
 
@@ -50,6 +50,8 @@ class Blockchain(StatisticsProvider, Startable, Inflatable):
     
     self.worksourcelock = RLock()
     self.blocklock = RLock()
+    # Incremented on every block change (protected by the work queue lock)
+    self.generation = 0
 
 
   def destroy(self):
@@ -82,10 +84,12 @@ class Blockchain(StatisticsProvider, Startable, Inflatable):
     self.currentprevhash = None
     self.knownprevhashes = []
     self.timeoutend = 0
-    self.jobs = []
+    self.jobs = OrderedSet()
     self.stats.starttime = time.time()
     self.stats.blocks = 0
     self.stats.lastblock = None
+    self.stats.cancellatency = None
+    self.stats.maxcancellatency = 0
 
     
   def _get_statistics(self, stats, childstats):
@@ -93,6 +97,8 @@ class Blockchain(StatisticsProvider, Startable, Inflatable):
     stats.starttime = self.stats.starttime
     stats.blocks = self.stats.blocks
     stats.lastblock = self.stats.lastblock
+    stats.cancellatency = self.stats.cancellatency
+    stats.maxcancellatency = self.stats.maxcancellatency
     stats.ghashes = childstats.calculatefieldsum("ghashes")
     stats.avgmhps = childstats.calculatefieldsum("avgmhps")
     stats.jobsreceived = childstats.calculatefieldsum("jobsreceived")
@@ -100,15 +106,20 @@ class Blockchain(StatisticsProvider, Startable, Inflatable):
     stats.jobscanceled = childstats.calculatefieldsum("jobscanceled")
     stats.sharesaccepted = childstats.calculatefieldsum("sharesaccepted")
     stats.sharesrejected = childstats.calculatefieldsum("sharesrejected")
+    add_rate_statistics(stats, childstats)
+    add_waste_statistics(stats, childstats)
+    add_latency_statistics(stats, childstats)
     stats.children = []
     
     
   def add_job(self, job):
-    if not job in self.jobs: self.jobs.append(job)
+    self.jobs.add(job)
   
 
   def remove_job(self, job):
-    while job in self.jobs: self.jobs.remove(job)
+    # Jobs of older generations aren't in the list any more
+    if job.blockchaingeneration != self.generation: return
+    self.jobs.discard(job)
 
 
   def add_work_source(self, worksource):
@@ -123,7 +134,6 @@ class Blockchain(StatisticsProvider, Startable, Inflatable):
 
   def check_job(self, job):
     if self.currentprevhash == job.prevhash: return True
-    cancel = []
     # Needs to be locked outside of blocklock to prevent race condition
     with self.core.workqueue.lock:
       with self.blocklock:
@@ -134,17 +144,26 @@ class Blockchain(StatisticsProvider, Startable, Inflatable):
         if timeout_expired: self.knownprevhashes = [self.currentprevhash]
         else: self.knownprevhashes.append(self.currentprevhash)
         self.currentprevhash = job.prevhash
-        while self.jobs:
-          job = self.jobs.pop(0)
-          if job.worker: cancel.append(job)
-          else: job.destroy()
-        self.jobs = []
+        # All jobs of the old generation are stale now. The work queue skips them,
+        # cancels the running ones right away and destroys the rest in the background.
+        self.generation += 1
+        jobs = self.jobs
+        self.jobs = OrderedSet()
         with self.stats.lock:
           self.stats.blocks += 1
           self.stats.lastblock = now
     self.core.log(self, "New block detected\n", 300, "B")
-    self.core.workqueue.cancel_jobs(cancel)
+    self.core.workqueue.cancel_stale_jobs(jobs, False, lambda count: self._jobs_canceled(now, count))
     return True
+
+
+  def _jobs_canceled(self, detected, count):
+    # All workers were notified about the block change
+    latency = time.time() - detected
+    with self.stats.lock:
+      self.stats.cancellatency = latency
+      self.stats.maxcancellatency = max(self.stats.maxcancellatency, latency)
+    self.core.log(self, "Canceled %d running jobs within %.1f ms after block change\n", 500, "", count, latency * 1000)
  
 
  
@@ -157,19 +176,22 @@ class DummyBlockchain(object):
     self.settings = Bunch(name = "Dummy blockchain")
     
     # Initialize job list (protected by global job queue lock)
-    self.jobs = []
+    self.jobs = OrderedSet()
     self.currentprevhash = None
     self.knownprevhashes = []
     self.timeoutend = 0
     self.blocklock = RLock()
+    self.generation = 0
     
     
   def add_job(self, job):
-    if not job in self.jobs: self.jobs.append(job)
+    self.jobs.add(job)
   
 
   def remove_job(self, job):
-    while job in self.jobs: self.jobs.remove(job)
+    # Jobs of older generations aren't in the list any more
+    if job.blockchaingeneration != self.generation: return
+    self.jobs.discard(job)
     
     
   def add_work_source(self, worksource):
@@ -182,7 +204,6 @@ class DummyBlockchain(object):
   
   def check_job(self, job):
     if self.currentprevhash == job.prevhash: return True
-    cancel = []
     # Needs to be locked outside of blocklock to prevent race condition
     with self.core.workqueue.lock:
       with self.blocklock:
@@ -193,12 +214,10 @@ class DummyBlockchain(object):
         if timeout_expired: self.knownprevhashes = [self.currentprevhash]
         else: self.knownprevhashes.append(self.currentprevhash)
         self.currentprevhash = job.prevhash
-        while self.jobs:
-          job = self.jobs.pop(0)
-          if job.worker: cancel.append(job)
-          else: job.destroy()
-      self.jobs = []
+        self.generation += 1
+        jobs = self.jobs
+        self.jobs = OrderedSet()
     self.core.log(self, "New block detected\n", 300, "B")
-    self.core.workqueue.cancel_jobs(cancel)
+    self.core.workqueue.cancel_stale_jobs(jobs)
     return True
 
@@ -32,13 +32,13 @@ import time
 import pickle
 import traceback
 from datetime import datetime
-from threading import RLock, Thread, current_thread
-from .statistics import StatisticsList
+from threading import Lock, RLock, current_thread
+from .statistics import StatisticsList, StatisticsSnapshotter
 from .inflatable import Inflatable
 from .startable import Startable
 from .util import Bunch
-try: from queue import Queue
-except ImportError: from Queue import Queue
+from .eventbus import Event, build_dispatch_table
+from collections import deque
 
 
 
@@ -54,11 +54,18 @@ class Core(Startable):
 
     # Initialize log queue and hijack stdout/stderr
     self.default_loglevel = default_loglevel
-    self.logger_thread = None
-    self.logqueue = Queue()
+    # Highest log level that any logger keeps, messages above it are dropped right away
+    self.loglevel = default_loglevel
     self.logbuf = {}
-    self.event_thread = None
-    self.eventqueue = Queue()
+    # Messages are collected here until the core is running, and then handed
+    # to the dispatchers of the logger frontends, with their log levels.
+    self.loglock = RLock()
+    self.logbacklog = deque(maxlen = 10000)
+    self.logdispatchers = None
+    # Event name => (highest subscribed level, frontend dispatchers and their subscriptions),
+    # and the same for all other names. Nobody is listening until the frontends are running.
+    self.eventtable = ({}, (-1, ()))
+    self.eventstats = Bunch(lock = Lock(), emitted = 0, dropped = 0)
     self.printlock = RLock()
     self.stdout = sys.stdout
     self.stderr = sys.stderr
@@ -73,7 +80,7 @@ class Core(Startable):
     self.event(0, self, "initializing", None, "Core initializing")
 
     # Print startup message
-    self.log(self, "%s, Copyright (C) 2012 Michael Sparmann (TheSeven)\n" % Core.version, 0, "B")
+    self.log(self, "%s, Copyright (C) 2012 Michael Sparmann (TheSeven)\n", 0, "B", Core.version)
     self.log(self, "Modular Python Bitcoin Miner comes with ABSOLUTELY NO WARRANTY.\n", 0)
     self.log(self, "This is free software, and you are welcome to redistribute it under certain conditions.\n", 0)
     self.log(self, "See included file COPYING_GPLv2.txt for details.\n", 0)
@@ -104,13 +111,13 @@ class Core(Startable):
           modulepath = maintainerpath + "/" + module
           if os.path.isdir(modulepath) and os.path.isfile(modulepath + "/__init__.py"):
             try:
-              self.log(self, "Loading modules.%s.%s...\n" % (maintainer, module), 800)
+              self.log(self, "Loading modules.%s.%s...\n", 800, "", maintainer, module)
               module = getattr(__import__("modules.%s" % maintainer, globals(), locals(), [module], 0), module)
               self.frontendclasses.extend(getattr(module, "frontendclasses", []))
               self.workerclasses.extend(getattr(module, "workerclasses", []))
               self.worksourceclasses.extend(getattr(module, "worksourceclasses", []))
             except Exception as e:
-              self.log(self, "Could not load module %s.%s: %s\n" % (maintainer, module, traceback.format_exc()), 300, "yB")
+              self.log(self, "Could not load module %s.%s: %s\n", 300, "yB", maintainer, module, traceback.format_exc())
               
     # Register the detected classes in the global object registry
     for frontendclass in self.frontendclasses: frontendclass.id = self.registry.register(frontendclass)
@@ -129,6 +136,17 @@ class Core(Startable):
     self.workerlock = RLock()
     self.workers = []
     
+    # Initialize statistics snapshots
+    self.statistics = StatisticsSnapshotter(self)
+    
+    # Initialize deadline scheduler
+    from .scheduler import Scheduler
+    self.scheduler = Scheduler(self)
+
+    # Initialize share submitter
+    from .submitter import Submitter
+    self.submitter = Submitter(self)
+
     # Initialize work queue
     from .workqueue import WorkQueue
     self.workqueue = WorkQueue(self)
@@ -157,7 +175,7 @@ class Core(Startable):
       self.event(100, self, "loaded_config", None, "Successfully loaded configuration")
     except Exception as e:
       self.event(100, self, "loading_config_failed", None, "Loading configuration failed")
-      self.log(self, "Could not load instance configuration: %s\nLoading default configuration...\n" % traceback.format_exc(), 300, "yB")
+      self.log(self, "Could not load instance configuration: %s\nLoading default configuration...\n", 300, "yB", traceback.format_exc())
       self.is_new_instance = True
       self.frontends = []
       self.workers = []
@@ -195,7 +213,7 @@ class Core(Startable):
       self.event(100, self, "saved_config", None, "Successfully saved configuration")
     except Exception as e:
       self.event(100, self, "saving_config_failed", None, "Saving configuration failed")
-      self.log(self, "Could not save instance configuration: %s\n" % traceback.format_exc(), 100, "rB")
+      self.log(self, "Could not save instance configuration: %s\n", 100, "rB", traceback.format_exc())
     
     
   def _reset(self):
@@ -219,70 +237,79 @@ class Core(Startable):
     have_configurator = False
     for frontend in self.frontends:
       try:
-        self.log(self, "Starting up frontend %s...\n" % frontend.settings.name, 800)
+        self.log(self, "Starting up frontend %s...\n", 800, "", frontend.settings.name)
         frontend.start()
         if frontend.can_log: have_logger = True
         if frontend.can_configure: have_configurator = True
       except Exception as e:
-        self.log(self, "Could not start frontend %s: %s\n" % (frontend.settings.name, traceback.format_exc()), 100, "rB")
+        self.log(self, "Could not start frontend %s: %s\n", 100, "rB", frontend.settings.name, traceback.format_exc())
       
     # Warn if there is no logger frontend (needs to be fone before enabling logger thread)
     if not have_logger:
       self.log(self, "No working logger frontend module present!\n"
                      "Run with --detect-frontends after ensuring that all neccessary modules are installed.\n", 10, "rB")
 
-    # Start logger thread
-    self.log(self, "Starting up logging thread...\n", 700)
-    self.logger_thread = Thread(None, self.log_worker_thread, "core_log_worker")
-    self.logger_thread.start()
+    # Hand log messages to the frontend dispatchers from now on
+    self.log(self, "Starting up logging...\n", 700)
     self.started = True
-
-    # Start up event dispatcher thread
-    self.log(self, "Starting up event dispatcher thread...\n", 700)
-    self.event_thread = Thread(None, self.event_worker_thread, "core_event_worker")
-    self.event_thread.start()
+    self.update_log_filter()
 
     # Warn if there is no configuration frontend
     if not have_configurator:
       self.log(self, "No working configuration frontend module present!\n"
                      "Run with --detect-frontends after ensuring that all neccessary modules are installed.\n", 100, "yB")
 
+    # Report which midstate engine is used
+    from . import midstate
+    for name, reason in midstate.rejected: self.log(self, "Not using %s midstate engine: %s\n", 500, "", name, reason)
+    self.log(self, "Using %s midstate engine (%s for batches)\n", 500, "", midstate.engine.name, midstate.batchengine.name)
+
+    # Start up deadline scheduler
+    self.log(self, "Starting up scheduler...\n", 700)
+    try: self.scheduler.start()
+    except Exception as e: self.log(self, "Could not start scheduler: %s\n", 100, "rB", traceback.format_exc())
+
+    # Start up share submitter
+    self.log(self, "Starting up share submitter...\n", 700)
+    try: self.submitter.start()
+    except Exception as e: self.log(self, "Could not start share submitter: %s\n", 100, "rB", traceback.format_exc())
+
     # Start up work queue
     self.log(self, "Starting up work queue...\n", 700)
     try: self.workqueue.start()
-    except Exception as e: self.log(self, "Could not start work queue: %s\n" % traceback.format_exc(), 100, "rB")
+    except Exception as e: self.log(self, "Could not start work queue: %s\n", 100, "rB", traceback.format_exc())
 
     # Start up blockchains
     self.log(self, "Starting up blockchains...\n", 700)
     for blockchain in self.blockchains:
       try:
-        self.log(self, "Starting up blockchain %s...\n" % blockchain.settings.name, 800)
+        self.log(self, "Starting up blockchain %s...\n", 800, "", blockchain.settings.name)
         blockchain.start()
       except Exception as e:
-        self.log(self, "Could not start blockchain %s: %s\n" % (blockchain.settings.name, traceback.format_exc()), 100, "rB")
+        self.log(self, "Could not start blockchain %s: %s\n", 100, "rB", blockchain.settings.name, traceback.format_exc())
 
     # Start up work source tree
     self.log(self, "Starting up work source tree...\n", 700)
     if self.root_work_source:
       try:
-        self.log(self, "Starting up work source %s...\n" % self.root_work_source.settings.name, 800)
+        self.log(self, "Starting up work source %s...\n", 800, "", self.root_work_source.settings.name)
         self.root_work_source.start()
       except Exception as e:
-        self.log(self, "Could not start root work source %s: %s\n" % (self.root_work_source.settings.name, traceback.format_exc()), 100, "rB")
+        self.log(self, "Could not start root work source %s: %s\n", 100, "rB", self.root_work_source.settings.name, traceback.format_exc())
 
     # Start up work fetcher
     self.log(self, "Starting up work fetcher...\n", 700)
     try: self.fetcher.start()
-    except Exception as e: self.log(self, "Could not start work fetcher: %s\n" % traceback.format_exc(), 100, "rB")
+    except Exception as e: self.log(self, "Could not start work fetcher: %s\n", 100, "rB", traceback.format_exc())
     
     # Start up workers
     self.log(self, "Starting up workers...\n", 700)
     for worker in self.workers:
       try:
-        self.log(self, "Starting up worker %s...\n" % worker.settings.name, 800)
+        self.log(self, "Starting up worker %s...\n", 800, "", worker.settings.name)
         worker.start()
       except Exception as e:
-        self.log(self, "Could not start worker %s: %s\n" % (worker.settings.name, traceback.format_exc()), 100, "rB")
+        self.log(self, "Could not start worker %s: %s\n", 100, "rB", worker.settings.name, traceback.format_exc())
 
     self.log(self, "Startup completed\n", 200, "")
     self.event(100, self, "started", None, "Successfully started core")
@@ -296,63 +323,65 @@ class Core(Startable):
     self.log(self, "Shutting down workers...\n", 700)
     for worker in self.workers:
       try:
-        self.log(self, "Shutting down worker %s...\n" % worker.settings.name, 800)
+        self.log(self, "Shutting down worker %s...\n", 800, "", worker.settings.name)
         worker.stop()
       except Exception as e:
-        self.log(self, "Could not stop worker %s: %s\n" % (worker.settings.name, traceback.format_exc()), 100, "rB")
+        self.log(self, "Could not stop worker %s: %s\n", 100, "rB", worker.settings.name, traceback.format_exc())
 
     # Shut down work fetcher
     self.log(self, "Shutting down work fetcher...\n", 700)
     try: self.fetcher.stop()
-    except Exception as e: self.log(self, "Could not stop work fetcher: %s\n" % traceback.format_exc(), 100, "rB")
+    except Exception as e: self.log(self, "Could not stop work fetcher: %s\n", 100, "rB", traceback.format_exc())
 
     # Shut down work source tree
     self.log(self, "Shutting down work source tree...\n", 700)
     if self.root_work_source:
       try:
-        self.log(self, "Shutting down work source %s...\n" % self.root_work_source.settings.name, 800)
+        self.log(self, "Shutting down work source %s...\n", 800, "", self.root_work_source.settings.name)
         self.root_work_source.stop()
       except Exception as e:
-        self.log(self, "Could not stop root work source %s: %s\n" % (self.root_work_source.settings.name, traceback.format_exc()), 100, "rB")
+        self.log(self, "Could not stop root work source %s: %s\n", 100, "rB", self.root_work_source.settings.name, traceback.format_exc())
     
     # Shut down blockchains
     self.log(self, "Shutting down blockchains...\n", 700)
     for blockchain in self.blockchains:
       try:
-        self.log(self, "Shutting down blockchain %s...\n" % blockchain.settings.name, 800)
+        self.log(self, "Shutting down blockchain %s...\n", 800, "", blockchain.settings.name)
         blockchain.stop()
       except Exception as e:
-        self.log(self, "Could not stop blockchain %s: %s\n" % (blockchain.settings.name, traceback.format_exc()), 100, "rB")
+        self.log(self, "Could not stop blockchain %s: %s\n", 100, "rB", blockchain.settings.name, traceback.format_exc())
+
+    # Shut down share submitter
+    self.log(self, "Shutting down share submitter...\n", 700)
+    try: self.submitter.stop()
+    except Exception as e: self.log(self, "Could not stop share submitter: %s\n", 100, "rB", traceback.format_exc())
 
     # Shut down work queue
     self.log(self, "Shutting down work queue...\n", 700)
     try: self.workqueue.stop()
-    except Exception as e: self.log(self, "Could not stop work queue: %s\n" % traceback.format_exc(), 100, "rB")
+    except Exception as e: self.log(self, "Could not stop work queue: %s\n", 100, "rB", traceback.format_exc())
+
+    # Shut down deadline scheduler
+    self.log(self, "Shutting down scheduler...\n", 700)
+    try: self.scheduler.stop()
+    except Exception as e: self.log(self, "Could not stop scheduler: %s\n", 100, "rB", traceback.format_exc())
 
     # Save instance configuration
     self.save()
     
-    # Shut down the log worker thread
-    self.log(self, "Shutting down event dispatcher thread...\n", 700)
-    self.eventqueue.put(None)
-    self.event_thread.join(10)
-    
     # We are about to shut down the logging infrastructure, so switch back to builtin logging
-    self.log(self, "Shutting down logging thread...\n", 700)
+    self.log(self, "Shutting down logging...\n", 700)
     self.started = False
-    
-    # Shut down the log worker thread
-    self.logqueue.put(None)
-    self.logger_thread.join(10)
+    self.update_log_filter()
     
     # Shut down the frontends
     self.log(self, "Shutting down frontends...\n", 700)
     for frontend in self.frontends:
       try:
-        self.log(self, "Shutting down frontend %s...\n" % frontend.settings.name, 800)
+        self.log(self, "Shutting down frontend %s...\n", 800, "", frontend.settings.name)
         frontend.stop()
       except Exception as e:
-        self.log(self, "Could not stop frontend %s: %s\n" % (frontend.settings.name, traceback.format_exc()), 100, "rB")
+        self.log(self, "Could not stop frontend %s: %s\n", 100, "rB", frontend.settings.name, traceback.format_exc())
 
     super(Core, self)._stop()
     self.log(self, "Shutdown completed\n", 200, "")
@@ -366,7 +395,7 @@ class Core(Startable):
         try: frontendclass.autodetect(self)
         except Exception as e:
           name = "%s.%s" % (frontendclass.__module__, frontendclass.__name__)
-          self.log(self, "%s autodetection failed: %s\n" % (name, traceback.format_exc()), 300, "yB")
+          self.log(self, "%s autodetection failed: %s\n", 300, "yB", name, traceback.format_exc())
   
   
   def detect_workers(self):
@@ -376,7 +405,7 @@ class Core(Startable):
         try: workerclass.autodetect(self)
         except Exception as e:
           name = "%s.%s" % (workerclass.__module__, workerclass.__name__)
-          self.log(self, "%s autodetection failed: %s\n" % (name, traceback.format_exc()), 300, "yB")
+          self.log(self, "%s autodetection failed: %s\n", 300, "yB", name, traceback.format_exc())
 
     
   def get_blockchains(self):
@@ -409,8 +438,10 @@ class Core(Startable):
           if self.started:
             try: frontend.start()
             except Exception as e:
-              self.log(self, "Could not start frontend %s: %s\n" % (frontend.settings.name, traceback.format_exc()), 100, "yB")
+              self.log(self, "Could not start frontend %s: %s\n", 100, "yB", frontend.settings.name, traceback.format_exc())
           self.frontends.append(frontend)
+        self.update_log_filter()
+        self.update_event_filter()
 
 
   def remove_frontend(self, frontend):
@@ -420,8 +451,10 @@ class Core(Startable):
           if self.started:
             try: frontend.stop()
             except Exception as e:
-              self.log(self, "Could not stop frontend %s: %s\n" % (frontend.settings.name, traceback.format_exc()), 100, "yB")
+              self.log(self, "Could not stop frontend %s: %s\n", 100, "yB", frontend.settings.name, traceback.format_exc())
           self.frontends.remove(frontend)
+        self.update_log_filter()
+        self.update_event_filter()
 
 
   def add_worker(self, worker):
@@ -431,7 +464,7 @@ class Core(Startable):
           if self.started:
             try: worker.start()
             except Exception as e:
-              self.log(self, "Could not start worker %s: %s\n" % (worker.settings.name, traceback.format_exc()), 100, "yB")
+              self.log(self, "Could not start worker %s: %s\n", 100, "yB", worker.settings.name, traceback.format_exc())
           self.workers.append(worker)
 
 
@@ -442,7 +475,7 @@ class Core(Startable):
           if self.started:
             try: worker.stop()
             except Exception as e:
-              self.log(self, "Could not stop worker %s: %s\n" % (worker.settings.name, traceback.format_exc()), 100, "yB")
+              self.log(self, "Could not stop worker %s: %s\n", 100, "yB", worker.settings.name, traceback.format_exc())
           self.workers.remove(worker)
 
 
@@ -455,17 +488,47 @@ class Core(Startable):
       if self.started and self.root_work_source:
         try: self.root_work_source.stop()
         except Exception as e:
-          self.log(self, "Could not stop root work source %s: %s\n" % (self.root_work_source.settings.name, traceback.format_exc()), 100, "yB")
+          self.log(self, "Could not stop root work source %s: %s\n", 100, "yB", self.root_work_source.settings.name, traceback.format_exc())
       self.root_work_source = worksource
       worksource.set_parent(None)
       if self.started:
         try: worksource.start()
         except Exception as e:
-          self.log(self, "Could not start root work source %s: %s\n" % (worksource.settings.name, traceback.format_exc()), 100, "yB")
+          self.log(self, "Could not start root work source %s: %s\n", 100, "yB", worksource.settings.name, traceback.format_exc())
           
           
-  def get_job(self, worker, expiry_min_ahead, async = False):
-    return self.workqueue.get_job(worker, expiry_min_ahead, async)
+  def get_job(self, worker, expiry_min_ahead, nonblocking = False, prefetch = False):
+    return self.workqueue.get_job(worker, expiry_min_ahead, nonblocking, prefetch)
+
+
+  def cancel_prefetch(self, worker):
+    return self.workqueue.cancel_prefetch(worker)
+    
+    
+  def get_fetcher_statistics(self):
+    return self.fetcher.get_statistics()
+    
+    
+  def get_event_statistics(self):
+    table, default = self.eventtable
+    dispatchers = set(dispatcher for level, targets in list(table.values()) + [default] for dispatcher, subs in targets)
+    with self.eventstats.lock: emitted, dropped = self.eventstats.emitted, self.eventstats.dropped
+    return {
+      "eventnames": len(table),
+      "emitted": emitted,
+      "dropped": dropped,
+      "delivered": sum(dispatcher.eventsdelivered for dispatcher in dispatchers),
+      "queued": sum(len(dispatcher.queue) for dispatcher in dispatchers),
+    }
+
+
+  def get_frontend_statistics(self):
+    with self.frontendlock:
+      return [frontend.dispatcher.get_statistics() for frontend in self.frontends if frontend.dispatcher]
+    
+    
+  def get_statistics_snapshot(self, maxage = None):
+    return self.statistics.get_snapshot(maxage)
     
     
   def get_blockchain_statistics(self):
@@ -490,20 +553,62 @@ class Core(Startable):
     return self.fetcher.notify_speed_changed(worker)
     
     
-  def log(self, source, message, loglevel, format = ""):
-    # Concatenate messages until there is a linefeed
+  def update_log_filter(self):
+    # Determine the highest log level that any logger keeps. Until the core is running,
+    # messages are queued for all loggers and printed to stderr up to the default level.
+    with self.frontendlock:
+      levels = [frontend.get_log_level() for frontend in self.frontends if frontend.can_log and (frontend.started or not self.started)]
+      dispatchers = tuple((frontend.get_log_level(), frontend.dispatcher) for frontend in self.frontends
+                          if frontend.can_log and frontend.started and frontend.dispatcher)
+      if not self.started: levels.append(self.default_loglevel)
+      with self.loglock:
+        self.loglevel = max([-1] + levels)
+        if not self.started:
+          self.logdispatchers = None
+          return
+        # Deliver what was logged while the core wasn't running yet. Even with
+        # the blocking overflow policy, don't wait here, we are holding the log lock.
+        while self.logbacklog:
+          data = self.logbacklog.popleft()
+          for level, dispatcher in dispatchers:
+            if data[2] <= level: dispatcher.put(data[2], False, data, False)
+        self.logdispatchers = dispatchers
+
+
+  def log(self, source, message, loglevel, format = "", *args):
+    # Messages that no logger would keep are dropped before doing any formatting work.
+    # The message can be a format string for args, or a callable that returns the message.
+    if loglevel > self.loglevel: return
+    if callable(message): message = message(*args)
+    elif args: message = message % args
     thread = current_thread()
-    if not thread in self.logbuf: self.logbuf[thread] = [source, loglevel, [], datetime.now()]
-    if self.logbuf[thread][1] > loglevel: self.logbuf[thread][1] = loglevel
-    self.logbuf[thread][2].append((message, format))
+    buf = self.logbuf.get(thread)
+    if buf is None:
+      # Complete lines don't need to go through the buffer
+      if message[-1:] == "\n":
+        self.log_multi(source, loglevel, [(message, format)])
+        return
+      buf = [source, loglevel, [], datetime.now()]
+      self.logbuf[thread] = buf
+    # Concatenate messages until there is a linefeed
+    if buf[1] > loglevel: buf[1] = loglevel
+    buf[2].append((message, format))
     if message[-1:] != "\n": return
-    self.log_multi(*self.logbuf[thread])
     del self.logbuf[thread]
+    self.log_multi(*buf)
 
     
-  def log_multi(self, source, loglevel, messages, timestamp = datetime.now()):
-    # Put message into the queue, will be pushed to listeners by a worker thread
-    self.logqueue.put((source, timestamp, loglevel, messages))
+  def log_multi(self, source, loglevel, messages, timestamp = None):
+    if timestamp is None: timestamp = datetime.now()
+    data = (source, timestamp, loglevel, messages)
+    dispatchers = self.logdispatchers
+    if dispatchers is None:
+      with self.loglock:
+        dispatchers = self.logdispatchers
+        if dispatchers is None: self.logbacklog.append(data)
+    if dispatchers:
+      for level, dispatcher in dispatchers:
+        if loglevel <= level: dispatcher.put(loglevel, False, data)
     
     # If the core hasn't fully started up yet, the logging subsystem might not
     # work yet. Print the message to stderr as well just in case.
@@ -515,42 +620,32 @@ class Core(Startable):
         for line in message.splitlines(True): self.stderr.write(prefix + line)
 
 
-  def log_worker_thread(self):
-    while True:
-      data = self.logqueue.get()
-      
-      # We'll get a None value in the queue if the core wants us to shut down
-      if not data:
-        self.logqueue.task_done()
-        return
-      
-      for frontend in self.frontends:
-        if frontend.can_log:
-          try: frontend.write_log_message(*data)
-          except:
-            if not hasattr(frontend, "_logging_broken"):
-              frontend._logging_broken = True
-              self.log(frontend, "Exception while logging message: %s" % traceback.format_exc(), 50, "rB")
-          
-      self.logqueue.task_done()
+  def update_event_filter(self):
+    # Rebuild the event dispatch table from the subscriptions of the running frontends
+    with self.frontendlock:
+      subscriptions = [(frontend.dispatcher, frontend.get_event_subscriptions()) for frontend in self.frontends
+                       if frontend.can_handle_events and frontend.started and frontend.dispatcher]
+      self.eventtable = build_dispatch_table(subscriptions)
 
 
-  def event(self, level, source, event, arg, message = None, worker = None, worksource = None, blockchain = None, job = None, timestamp = datetime.now()):
-    self.eventqueue.put((level, source, event, arg, message, worker, worksource, blockchain, job, timestamp))
+  def wants_event(self, level, event):
+    # Lets callers skip building expensive event arguments if nobody would see them
+    table, default = self.eventtable
+    return level <= table.get(event, default)[0]
 
 
-  def event_worker_thread(self):
-    while True:
-      data = self.eventqueue.get()
-      
-      # We'll get a None value in the queue if the core wants us to shut down
-      if not data:
-        self.eventqueue.task_done()
+  def event(self, level, source, event, arg, message = None, worker = None, worksource = None, blockchain = None, job = None, timestamp = None):
+    table, default = self.eventtable
+    maxlevel, targets = table.get(event, default)
+    # Events are emitted from many threads at once
+    with self.eventstats.lock:
+      self.eventstats.emitted += 1
+      if level > maxlevel:
+        self.eventstats.dropped += 1
         return
-      
-      for frontend in self.frontends:
-        if frontend.can_handle_events:
-          try: frontend.handle_stats_event(*data)
-          except: self.log(frontend, "Exception while logging event: %s" % traceback.format_exc(), 200, "r")
-          
-      self.eventqueue.task_done()
+    record = Event(level, source, event, arg, message, worker, worksource, blockchain, job, timestamp or datetime.now())
+    for dispatcher, subscriptions in targets:
+      for subscription in subscriptions:
+        if level <= subscription.level and (not subscription.scoped or subscription.covers(worker, worksource, blockchain)):
+          dispatcher.put(level, True, record)
+          break
@@ -0,0 +1,134 @@
+# Modular Python Bitcoin Miner
+# Copyright (C) 2012 Michael Sparmann (TheSeven)
+#
+#     This program is free software; you can redistribute it and/or
+#     modify it under the terms of the GNU General Public License
+#     as published by the Free Software Foundation; either version 2
+#     of the License, or (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program; if not, write to the Free Software
+#     Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Please consider donating to 1PLAPWDejJPJnY2ppYCgtw5ko8G5Q4hPzh if you
+# want to support further development of the Modular Python Bitcoin Miner.
+
+
+
+#######################
+# Frontend dispatcher #
+#######################
+
+
+
+import time
+import traceback
+from collections import deque
+from threading import Condition, Thread, current_thread
+
+
+
+# Delivers log messages and events to one frontend on a thread of its own, so
+# that a slow frontend doesn't hold up delivery to all the others.
+# The queue is bounded. What happens if it is full depends on the policy:
+# "drop_oldest" discards the oldest queued item, "drop_level" discards new items
+# above the overflow level (more important ones are still accepted, up to twice
+# the queue length), and "block" makes the producer wait until there is space.
+class FrontendDispatcher(object):
+
+
+  def __init__(self, core, frontend, length, policy, level):
+    self.core = core
+    self.frontend = frontend
+    self.length = length
+    self.policy = policy
+    self.level = level
+    self.lock = Condition()
+    self.queue = deque()
+    self.shutdown = False
+    self.thread = None
+    self.maxqueued = 0
+    self.dropped = 0
+    self.logsdelivered = 0
+    self.eventsdelivered = 0
+    self.maxlag = 0
+
+
+  def start(self):
+    self.thread = Thread(None, self._loop, "%s_dispatcher" % self.frontend.settings.name)
+    self.thread.daemon = True
+    self.thread.start()
+
+
+  def stop(self, timeout = 5):
+    # Delivers everything that is still queued before the thread exits
+    with self.lock:
+      self.shutdown = True
+      self.lock.notify_all()
+    if self.thread and self.thread != current_thread(): self.thread.join(timeout)
+
+
+  def put(self, level, event, data, block = True):
+    with self.lock:
+      queued = len(self.queue)
+      if queued >= self.length:
+        if self.policy == "drop_level":
+          if level > self.level or queued >= 2 * self.length:
+            self.dropped += 1
+            return
+        elif self.policy == "block" and block and self.thread != current_thread():
+          while len(self.queue) >= self.length and not self.shutdown: self.lock.wait()
+        else:
+          self.queue.popleft()
+          self.dropped += 1
+      self.queue.append((time.time(), event, data))
+      if len(self.queue) > self.maxqueued: self.maxqueued = len(self.queue)
+      self.lock.notify()
+
+
+  def get_statistics(self):
+    with self.lock:
+      queued = len(self.queue)
+      lag = time.time() - self.queue[0][0] if queued else 0
+    return {
+      "name": self.frontend.settings.name,
+      "policy": self.policy,
+      "queuelength": self.length,
+      "queued": queued,
+      "maxqueued": self.maxqueued,
+      "dropped": self.dropped,
+      "logsdelivered": self.logsdelivered,
+      "eventsdelivered": self.eventsdelivered,
+      "lag": lag,
+      "maxlag": self.maxlag,
+    }
+
+
+  def _loop(self):
+    frontend = self.frontend
+    while True:
+      with self.lock:
+        while not self.queue:
+          if self.shutdown: return
+          self.lock.wait()
+        queued, event, data = self.queue.popleft()
+        # Producers might be waiting for space
+        if self.policy == "block": self.lock.notify_all()
+      lag = time.time() - queued
+      if lag > self.maxlag: self.maxlag = lag
+      if event:
+        self.eventsdelivered += 1
+        try: frontend.handle_event(data)
+        except: self.core.log(frontend, "Exception while logging event: %s", 200, "r", traceback.format_exc())
+      else:
+        self.logsdelivered += 1
+        try: frontend.write_log_message(*data)
+        except:
+          if not hasattr(frontend, "_logging_broken"):
+            frontend._logging_broken = True
+            self.core.log(frontend, "Exception while logging message: %s", 50, "rB", traceback.format_exc())
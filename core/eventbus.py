@@ -0,0 +1,98 @@
+# Modular Python Bitcoin Miner
+# Copyright (C) 2012 Michael Sparmann (TheSeven)
+#
+#     This program is free software; you can redistribute it and/or
+#     modify it under the terms of the GNU General Public License
+#     as published by the Free Software Foundation; either version 2
+#     of the License, or (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program; if not, write to the Free Software
+#     Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Please consider donating to 1PLAPWDejJPJnY2ppYCgtw5ko8G5Q4hPzh if you
+# want to support further development of the Modular Python Bitcoin Miner.
+
+
+
+#############
+# Event bus #
+#############
+
+
+
+# One event, as handed to the frontends
+class Event(object):
+
+  __slots__ = ("level", "source", "name", "arg", "message", "worker", "worksource", "blockchain", "job", "timestamp")
+
+
+  def __init__(self, level, source, name, arg, message, worker, worksource, blockchain, job, timestamp):
+    self.level = level
+    self.source = source
+    self.name = name
+    self.arg = arg
+    self.message = message
+    self.worker = worker
+    self.worksource = worksource
+    self.blockchain = blockchain
+    self.job = job
+    self.timestamp = timestamp
+
+
+  def astuple(self):
+    # The argument list of the old handle_stats_event frontend interface
+    return (self.level, self.source, self.name, self.arg, self.message,
+            self.worker, self.worksource, self.blockchain, self.job, self.timestamp)
+
+
+
+# What a frontend wants to receive: events with one of the given names (or all
+# of them if events is None) up to the given level, and optionally only those
+# that concern one of the given workers, work sources or blockchains.
+class EventSubscription(object):
+
+  __slots__ = ("events", "level", "workers", "worksources", "blockchains", "scoped")
+
+
+  def __init__(self, events = None, level = float("inf"), workers = None, worksources = None, blockchains = None):
+    self.events = None if events is None else frozenset(events)
+    self.level = level
+    self.workers = None if workers is None else frozenset(workers)
+    self.worksources = None if worksources is None else frozenset(worksources)
+    self.blockchains = None if blockchains is None else frozenset(blockchains)
+    self.scoped = workers is not None or worksources is not None or blockchains is not None
+
+
+  def covers(self, worker, worksource, blockchain):
+    if self.workers is not None and not worker in self.workers: return False
+    if self.worksources is not None and not worksource in self.worksources: return False
+    if self.blockchains is not None and not blockchain in self.blockchains: return False
+    return True
+
+
+
+# Maps event names to the frontend dispatchers that subscribed to them, along
+# with the highest level that any of these subscriptions accepts, so that
+# emitting an event only costs a dict lookup if nobody is interested in it.
+def build_dispatch_table(subscriptions):
+  # subscriptions is a list of (dispatcher, [subscription, ...]) tuples
+  def entry(name):
+    targets = []
+    for dispatcher, subs in subscriptions:
+      subs = tuple(sub for sub in subs if sub.events is None or name in sub.events)
+      if subs: targets.append((dispatcher, subs))
+    return max([-1] + [sub.level for dispatcher, subs in targets for sub in subs]), tuple(targets)
+  names = set()
+  for dispatcher, subs in subscriptions:
+    for sub in subs:
+      if sub.events is not None: names.update(sub.events)
+  table = {}
+  for name in names: table[name] = entry(name)
+  # Events that nobody subscribed to by name only go to the catch-all subscriptions
+  return table, entry(None)
@@ -26,9 +26,10 @@
 
 
 
+import math
 import time
 import traceback
-from threading import RLock, Condition, Thread, current_thread
+from threading import Lock, RLock, Condition, Thread, current_thread
 from .startable import Startable
 from .util import Bunch
 
@@ -36,6 +37,13 @@ from .util import Bunch
 
 class Fetcher(Startable):
 
+  # Time constant of the job consumption rate average (seconds)
+  consumption_tau = 30.
+  # Extra buffer time on top of the fetch latency (seconds)
+  safety_margin = 5.
+  # Maximum number of fetchers started at once
+  burst = 5
+
   
   def __init__(self, core):
     self.core = core
@@ -44,6 +52,8 @@ class Fetcher(Startable):
     super(Fetcher, self).__init__()
     # Initialize global fetcher lock and wakeup condition
     self.lock = Condition()
+    # Protects the consumption rate average, which is updated for every job taken
+    self.consumptionlock = Lock()
     # Fetcher controller thread
     self.controllerthread = None
     
@@ -53,6 +63,15 @@ class Fetcher(Startable):
     super(Fetcher, self)._reset()
     self.speedchanged = True
     self.queuetarget = 5
+    self.jobspersecond = 0
+    self.paralleljobs = 0
+    self.consumption = 0
+    self.lastconsumption = time.time()
+    self.latency = 0
+    self.inflightjobs = 0
+    self.inflightrequests = 0
+    self.retrydelay = 0.1
+    self.retrycall = None
     
 
   def _start(self):
@@ -67,6 +86,9 @@ class Fetcher(Startable):
     self.shutdown = True
     self.wakeup()
     self.controllerthread.join(10)
+    with self.lock:
+      if self.retrycall: self.core.scheduler.cancel(self.retrycall)
+      self.retrycall = None
     super(Fetcher, self)._stop()
       
       
@@ -79,40 +101,104 @@ class Fetcher(Startable):
       self.speedchanged = True
       self.lock.notify()
 
+
+  def notify_job_taken(self):
+    # Called for every job handed out to a worker. Every call adds a decaying
+    # impulse of weight 1/tau, so the sum tracks the consumption rate in jobs/s.
+    # The controller is only woken up once the queued and in flight jobs don't
+    # cover the target any more, not for every single job.
+    now = time.time()
+    with self.consumptionlock:
+      self.consumption = self._get_consumption_rate(now) + 1. / self.consumption_tau
+      self.lastconsumption = now
+    if self.core.workqueue.count + self.inflightjobs < self.queuetarget: self.wakeup()
+
+
+  def get_statistics(self):
+    queuecount = self.core.workqueue.count
+    rate = self._get_rate()
+    return {
+      "queuetarget": self.queuetarget,
+      "queuecount": queuecount,
+      "inflightjobs": self.inflightjobs,
+      "inflightrequests": self.inflightrequests,
+      "consumption": rate,
+      "latency": self.latency,
+      "runway": queuecount / rate if rate else None,
+    }
+
+
+  def _get_consumption_rate(self, now):
+    # Needs to be called with the consumption lock held
+    age = now - self.lastconsumption
+    if age <= 0: return self.consumption
+    return self.consumption * math.exp(-age / self.consumption_tau)
+
+
+  def _get_rate(self):
+    # The speed reported by the workers is the baseline, the measured consumption
+    # covers everything they don't account for (canceled jobs, short jobs, ...)
+    with self.consumptionlock: consumption = self._get_consumption_rate(time.time())
+    return max(self.jobspersecond, consumption)
+
+
+  def _update_target(self, worksource):
+    if self.speedchanged:
+      self.speedchanged = False
+      jobspersecond = 0
+      paralleljobs = 0
+      with self.core.workerlock:
+        for worker in self.core.workers:
+          jobspersecond += worker.get_jobs_per_second()
+          paralleljobs += worker.get_parallel_jobs()
+      self.jobspersecond = jobspersecond
+      self.paralleljobs = paralleljobs
+    latency = worksource.get_fetch_latency()
+    self.latency = latency if latency else 0
+    # Cover the jobs that will be consumed while a fetch is in flight, plus a safety
+    # margin. All running jobs might be canceled at once (block change), so we also
+    # need enough jobs to restart all of them right away.
+    need = int(math.ceil(self._get_rate() * (self.latency + self.safety_margin)))
+    self.queuetarget = max(5, self.paralleljobs * 2, need + self.paralleljobs)
+    self.core.workqueue.target = self.queuetarget
+
+
+  def _schedule_retry(self):
+    # Nothing could be started right now (no fetcher available, all work sources
+    # locked out, ...). Finishing fetchers wake us up, retry with an increasing
+    # delay to handle the rest.
+    if self.retrycall: return
+    self.retrycall = self.core.scheduler.schedule_in(self.retrydelay, self._retry)
+    self.retrydelay = min(5, self.retrydelay * 2)
+
+
+  def _retry(self):
+    with self.lock:
+      self.retrycall = None
+      self.lock.notify()
+
     
   def controllerloop(self):
     with self.lock:
       while not self.shutdown:
-        if self.speedchanged:
-          self.speedchanged = False
-          jobspersecond = 0
-          paralleljobs = 0
-          with self.core.workerlock:
-            for worker in self.core.workers:
-              jobspersecond += worker.get_jobs_per_second()
-              paralleljobs += worker.get_parallel_jobs()
-          self.queuetarget = max(5, paralleljobs * 2, jobspersecond * 30)
-          self.core.workqueue.target = self.queuetarget
-        
         worksource = self.core.get_root_work_source()
+        self._update_target(worksource)
         queuecount = self.core.workqueue.count
         fetchercount, jobcount = worksource.get_running_fetcher_count()
+        self.inflightrequests = fetchercount
+        self.inflightjobs = jobcount
         needjobs = self.queuetarget - queuecount - jobcount
-        startfetchers = max(0, min(5, (self.queuetarget - queuecount - jobcount // 2) // 2))
-        if not startfetchers and queuecount == 0 and fetchercount < 3: startfetchers = 1
-        if not startfetchers:
-          if self.core.workqueue.count * 2 > self.queuetarget: self.lock.wait()
-          else: self.lock.wait(0.1)
+        # Never leave a waiting worker without at least some fetchers running
+        if needjobs <= 0 and queuecount == 0 and fetchercount < 3 and self.core.workqueue.waiting: needjobs = 1
+        if needjobs <= 0:
+          self.lock.wait()
           continue
         try:
-          if startfetchers:
-            started, startedjobs = worksource.start_fetchers(startfetchers if self.core.workqueue.count * 4 < self.queuetarget else 1, needjobs)
-            if not started:
-              self.lock.wait(0.1)
-              continue
-          else: self.lock.wait(0.1)
-          lockout = time.time() + min(5, 4 * self.core.workqueue.count / self.queuetarget - 1)
-          while time.time() < lockout and self.core.workqueue.count > self.queuetarget / 4: self.lock.wait(0.1)
+          started, startedjobs = worksource.start_fetchers(min(self.burst, needjobs), needjobs)
+          if started:
+            self.retrydelay = 0.1
+            continue
         except:
-          self.core.log(self, "Error while starting fetcher thread: %s\n" % traceback.format_exc(), 100, "rB")
-          time.sleep(1)
+          self.core.log(self, "Error while starting fetcher thread: %s\n", 100, "rB", traceback.format_exc())
+        self._schedule_retry()
+        self.lock.wait()
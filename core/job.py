@@ -26,17 +26,21 @@
 
 
 
+import time
 import struct
 import traceback
 from binascii import hexlify
 from threading import Thread
-from .sha256 import SHA256
+from . import midstate as midstateengine
 from hashlib import sha256
 
 
 
 class Job(object):
 
+  # Number of jobs that this work queue entry stands for
+  jobcount = 1
+
   
   def __init__(self, core, worksource, expiry, data, target, midstate = None, identifier = None):
     self.core = core
@@ -57,13 +61,24 @@ class Job(object):
     self.destroyed = False
     self.worker = None
     self.starttime = None
+    self.requesttime = None
+    # Lifecycle timestamps: entering the work queue and being handed to a worker
+    self.queuetime = None
+    self.dispatchtime = None
     self.hashes_remaining = 2**32
+    self.queuenode = None
+    self.hashprefix = None
+    # Generations of the blockchain and work source when the job was registered
+    self.blockchaingeneration = None
+    self.worksourcegeneration = None
     
     
   def register(self):
+    self.blockchaingeneration = self.blockchain.generation
+    self.worksourcegeneration = self.worksource.generation
     self.worksource.add_job(self)
     self.blockchain.add_job(self)
-    self.worksource.add_pending_mhashes(-self.hashes_remaining / 1000000.)
+    self.queuetime = time.time()
     self.core.event(500, self.worksource, "registerjob", None, None, None, self.worksource, self.blockchain, self)
     
     
@@ -73,17 +88,32 @@ class Job(object):
     self.worksource.remove_job(self)
     self.blockchain.remove_job(self)
     self.core.workqueue.remove_job(self)
-    self.worksource.add_pending_mhashes(self.hashes_remaining / 1000000.)
+    if self.worker and self.starttime and self.dispatchtime: self.add_latency("upload", self.starttime - self.dispatchtime)
     self.core.event(700, self.worksource, "destroyjob", None, None, self.worker, self.worksource, self.blockchain, self)
     if self.worker:
       hashes = 2**32 - self.hashes_remaining
       self.core.event(400, self.worker, "hashes_calculated", hashes, None, self.worker, self.worksource, self.blockchain, self)
       ghashes = hashes / 1000000000.
+      now = time.time()
       self.core.stats.ghashes += ghashes
       with self.worksource.stats.lock:
         self.worksource.stats.ghashes += ghashes
+        self.worksource.stats.rates.hashes.add(hashes, now)
+        if self.canceled: self.worksource.stats.ghashes_canceled += ghashes
       with self.worker.stats.lock:
         self.worker.stats.ghashes += ghashes
+        self.worker.stats.rates.hashes.add(hashes, now)
+        if self.canceled: self.worker.stats.ghashes_canceled += ghashes
+        # Time between the worker asking for this job and the job being started on the device
+        if self.starttime and self.requesttime:
+          gap = max(0, self.starttime - self.requesttime)
+          self.worker.stats.avgjobgap = self.worker.stats.avgjobgap * 0.9 + gap * 0.1
+          self.worker.stats.maxjobgap = max(self.worker.stats.maxjobgap, gap)
+    
+    
+  def is_stale(self):
+    # A block change or work source flush since registration makes a job stale
+    return self.blockchaingeneration != self.blockchain.generation or self.worksourcegeneration != self.worksource.generation
     
     
   def hashes_processed(self, hashes):
@@ -92,46 +122,147 @@ class Job(object):
     
   def set_worker(self, worker):
     self.worker = worker
-    self.core.log(worker, "Mining %s:%s\n" % (self.worksource.settings.name, hexlify(self.data[:76]).decode("ascii")), 400)
+    self.dispatchtime = time.time()
+    self.core.log(worker, lambda: "Mining %s:%s\n" % (self.worksource.settings.name, hexlify(self.data[:76]).decode("ascii")), 400)
     self.core.event(450, self.worker, "acquirejob", None, None, self.worker, self.worksource, self.blockchain, self)
-    with self.worker.stats.lock: self.worker.stats.jobsaccepted += 1
-    with self.worksource.stats.lock: self.worksource.stats.jobsaccepted += 1
+    queued = self.dispatchtime - self.queuetime if self.queuetime else None
+    with self.worker.stats.lock:
+      self.worker.stats.jobsaccepted += 1
+      if queued is not None: self.worker.stats.latency.queue.add(queued)
+    with self.worksource.stats.lock:
+      self.worksource.stats.jobsaccepted += 1
+      if queued is not None: self.worksource.stats.latency.queue.add(queued)
+    
+    
+  def add_latency(self, stage, latency, count = 1):
+    # Records the latency of a lifecycle stage (see core.statistics.latency_stages)
+    # count times, for both the worker and the work source
+    with self.worker.stats.lock:
+      histogram = getattr(self.worker.stats.latency, stage)
+      for i in range(count): histogram.add(latency)
+    with self.worksource.stats.lock:
+      histogram = getattr(self.worksource.stats.latency, stage)
+      for i in range(count): histogram.add(latency)
+    
+    
+  def _get_hash_prefix(self):
+    # The byte swapped header is the same for every nonce of this job, so the SHA256
+    # state after its first 64 bytes and the remaining 12 bytes are only calculated once.
+    if not self.hashprefix:
+      header = struct.pack("<19I", *struct.unpack(">19I", self.data[:76]))
+      self.hashprefix = (sha256(header[:64]), header[64:])
+    return self.hashprefix
+    
+    
+  def _calculate_nonce_hash(self, nonce):
+    state, tail = self._get_hash_prefix()
+    hash = state.copy()
+    hash.update(tail + nonce[::-1])
+    return sha256(hash.digest()).digest()
     
     
   def nonce_found(self, nonce, ignore_invalid = False):
+    verifystart = time.time()
     nonceval = struct.unpack("<I", nonce)[0]
     self.core.event(400, self.worker, "noncefound", nonceval, None, self.worker, self.worksource, self.blockchain, self)
     data = self.data[:76] + nonce + self.data[80:]
-    hash = Job.calculate_hash(data)
+    hash = self._calculate_nonce_hash(nonce)
+    self.add_latency("verify", time.time() - verifystart)
     if hash[-4:] != b"\0\0\0\0":
       if ignore_invalid: return False
-      self.core.log(self.worker, "Got H-not-zero share %s\n" % (hexlify(nonce).decode("ascii")), 200, "yB")
+      self.core.log(self.worker, "Got H-not-zero share %s\n", 200, "yB", hexlify(nonce).decode("ascii"))
       with self.worker.stats.lock: self.worker.stats.sharesinvalid += 1
       self.core.event(300, self.worker, "nonceinvalid", nonceval, None, self.worker, self.worksource, self.blockchain, self)
       return False
-    self.core.log(self.worker, "Found share: %s:%s:%s\n" % (self.worksource.settings.name, hexlify(self.data[:76]).decode("ascii"), hexlify(nonce).decode("ascii")), 350, "g")
+    self.core.log(self.worker, lambda: "Found share: %s:%s:%s\n" % (self.worksource.settings.name, hexlify(self.data[:76]).decode("ascii"), hexlify(nonce).decode("ascii")), 350, "g")
     noncediff = 65535. * 2**48 / struct.unpack("<Q", hash[-12:-4])[0]
-    self.core.event(450, self.worker, "noncevalid", nonceval, str(noncediff), self.worker, self.worksource, self.blockchain, self)
+    if self.core.wants_event(450, "noncevalid"):
+      self.core.event(450, self.worker, "noncevalid", nonceval, str(noncediff), self.worker, self.worksource, self.blockchain, self)
     if hash[::-1] > self.target[::-1]:
       self.core.event(350, self.worksource, "noncefaileddiff", nonceval, str(self.difficulty), self.worker, self.worksource, self.blockchain, self)
-      self.core.log(self.worker, "Share %s (difficulty %.5f) didn't meet difficulty %.5f\n" % (hexlify(nonce).decode("ascii"), noncediff, self.difficulty), 300, "g")
+      self.core.log(self.worker, "Share %s (difficulty %.5f) didn't meet difficulty %.5f\n", 300, "g", hexlify(nonce).decode("ascii"), noncediff, self.difficulty)
       return True
     self.worksource.nonce_found(self, data, nonce, noncediff)
     return True
     
     
+  def nonces_found(self, nonces, ignore_invalid = False):
+    # Batch version of nonce_found, for devices that report several nonces of a job at once.
+    # Events are still emitted per nonce, only the log lines are aggregated per batch.
+    # Returns the nonce_found result for each nonce.
+    if len(nonces) < 2: return [self.nonce_found(nonce, ignore_invalid) for nonce in nonces]
+    verifystart = time.time()
+    state, tail = self._get_hash_prefix()
+    copy = state.copy
+    wantfound = self.core.wants_event(400, "noncefound")
+    wantinvalid = not ignore_invalid and self.core.wants_event(300, "nonceinvalid")
+    wantvalid = self.core.wants_event(450, "noncevalid")
+    wantfailed = self.core.wants_event(350, "noncefaileddiff")
+    results = []
+    invalid = []
+    shares = []
+    failed = []
+    for nonce in nonces:
+      nonceval = struct.unpack("<I", nonce)[0]
+      if wantfound: self.core.event(400, self.worker, "noncefound", nonceval, None, self.worker, self.worksource, self.blockchain, self)
+      hash = copy()
+      hash.update(tail + nonce[::-1])
+      hash = sha256(hash.digest()).digest()
+      if hash[-4:] != b"\0\0\0\0":
+        results.append(False)
+        invalid.append(nonce)
+        if wantinvalid: self.core.event(300, self.worker, "nonceinvalid", nonceval, None, self.worker, self.worksource, self.blockchain, self)
+        continue
+      results.append(True)
+      noncediff = 65535. * 2**48 / struct.unpack("<Q", hash[-12:-4])[0]
+      if wantvalid: self.core.event(450, self.worker, "noncevalid", nonceval, str(noncediff), self.worker, self.worksource, self.blockchain, self)
+      if hash[::-1] > self.target[::-1]:
+        failed.append((nonce, noncediff))
+        if wantfailed: self.core.event(350, self.worksource, "noncefaileddiff", nonceval, str(self.difficulty), self.worker, self.worksource, self.blockchain, self)
+      else: shares.append((nonce, noncediff))
+    # Every nonce of the batch is accounted for with its share of the verification time
+    self.add_latency("verify", (time.time() - verifystart) / len(nonces), len(nonces))
+    hexnonces = lambda nonces: ",".join(hexlify(nonce).decode("ascii") for nonce in nonces)
+    if invalid and not ignore_invalid:
+      self.core.log(self.worker, "Got %d H-not-zero shares: %s\n", 200, "yB", len(invalid), hexnonces(invalid))
+      with self.worker.stats.lock: self.worker.stats.sharesinvalid += len(invalid)
+    if shares or failed:
+      self.core.log(self.worker, lambda: "Found %d shares: %s:%s:%s\n" % (len(shares) + len(failed), self.worksource.settings.name, hexlify(self.data[:76]).decode("ascii"), hexnonces(share[0] for share in shares + failed)), 350, "g")
+    if failed:
+      self.core.log(self.worker, lambda: "%d shares (%s) didn't meet difficulty %.5f\n" % (len(failed), ",".join("%s: %.5f" % (hexlify(nonce).decode("ascii"), noncediff) for nonce, noncediff in failed), self.difficulty), 300, "g")
+    for nonce, noncediff in shares: self.worksource.nonce_found(self, self.data[:76] + nonce + self.data[80:], nonce, noncediff)
+    return results
+    
+    
   def nonce_handled_callback(self, nonce, noncediff, result):
     nonceval = struct.unpack("<I", nonce)[0]
     if result == True:
-      self.core.log(self.worker, "%s accepted share %s (difficulty %.5f)\n" % (self.worksource.settings.name, hexlify(nonce).decode("ascii"), noncediff), 250, "gB")
-      with self.worker.stats.lock: self.worker.stats.sharesaccepted += self.difficulty
-      with self.worksource.stats.lock: self.worksource.stats.sharesaccepted += self.difficulty
+      self.core.log(self.worker, "%s accepted share %s (difficulty %.5f)\n", 250, "gB", self.worksource.settings.name, hexlify(nonce).decode("ascii"), noncediff)
+      with self.worker.stats.lock:
+        self.worker.stats.sharesaccepted += self.difficulty
+        self.worker.stats.rates.accepted.add(self.difficulty)
+      with self.worksource.stats.lock:
+        self.worksource.stats.sharesaccepted += self.difficulty
+        self.worksource.stats.rates.accepted.add(self.difficulty)
       self.core.event(350, self.worksource, "nonceaccepted", nonceval, None, self.worker, self.worksource, self.blockchain, self)
     else:
       if result == False or result == None or len(result) == 0: result = "Unknown reason"
-      self.core.log(self.worker, "%s rejected share %s (difficulty %.5f): %s\n" % (self.worksource.settings.name, hexlify(nonce).decode("ascii"), noncediff, result), 200, "y")
-      with self.worker.stats.lock: self.worker.stats.sharesrejected += self.difficulty
-      with self.worksource.stats.lock: self.worksource.stats.sharesrejected += self.difficulty
+      self.core.log(self.worker, "%s rejected share %s (difficulty %.5f): %s\n", 200, "y", self.worksource.settings.name, hexlify(nonce).decode("ascii"), noncediff, result)
+      # A share stands for difficulty * 2**32 hashes on average, which were wasted if it was too late
+      stale = "stale" in str(result).lower()
+      ghashes = self.difficulty * 2**32 / 1000000000.
+      with self.worker.stats.lock:
+        self.worker.stats.sharesrejected += self.difficulty
+        self.worker.stats.rates.rejected.add(self.difficulty)
+        if stale:
+          self.worker.stats.sharesstale += self.difficulty
+          self.worker.stats.ghashes_stale += ghashes
+      with self.worksource.stats.lock:
+        self.worksource.stats.sharesrejected += self.difficulty
+        self.worksource.stats.rates.rejected.add(self.difficulty)
+        if stale:
+          self.worksource.stats.sharesstale += self.difficulty
+          self.worksource.stats.ghashes_stale += ghashes
       self.core.event(300, self.worksource, "noncerejected", nonceval, result, self.worker, self.worksource, self.blockchain, self)
 
 
@@ -144,20 +275,113 @@ class Job(object):
     if self.worker:
       self.core.event(450, self.worksource, "canceljob", None, None, self.worker, self.worksource, self.blockchain, self)
       try: self.worker.notify_canceled(self, graceful)
-      except: self.core.log(self.worker, "Exception while canceling job: %s" % (traceback.format_exc()), 100, "r")
-      with self.worker.stats.lock: self.worker.stats.jobscanceled += 1
-      with self.worksource.stats.lock: self.worksource.stats.jobscanceled += 1
+      except: self.core.log(self.worker, "Exception while canceling job: %s", 100, "r", traceback.format_exc())
+      with self.worker.stats.lock:
+        self.worker.stats.jobscanceled += 1
+        self.worker.stats.rates.canceled.add(1)
+      with self.worksource.stats.lock:
+        self.worksource.stats.jobscanceled += 1
+        self.worksource.stats.rates.canceled.add(1)
       
       
   @staticmethod
   def calculate_midstate(data):
-    return struct.pack("<8I", *struct.unpack(">8I", SHA256.hash(struct.pack("<16I", *struct.unpack(">16I", data[:64])), False)))
+    return midstateengine.calculate_midstate(data)
+      
+      
+  @staticmethod
+  def calculate_midstates(datalist):
+    return midstateengine.calculate_midstates(datalist)
       
       
   @staticmethod
   def calculate_hash(data):
     return sha256(sha256(struct.pack("<20I", *struct.unpack(">20I", data[:80]))).digest()).digest()
 
+
+
+
+
+# Stands for count jobs that only differ in their ntime (ntime rolling).
+# The template sits in the work queue, the work source's and the blockchain's
+# job lists as a single entry, and only creates (and registers) a concrete Job
+# with the next ntime value when a worker takes one from the work queue.
+# Destroying the template (expiry, block change, flush) drops all jobs that
+# weren't taken yet at once.
+class JobTemplate(object):
+
+  
+  def __init__(self, core, worksource, expiry, data, target, count, midstate = None, identifier = None):
+    self.core = core
+    self.worksource = worksource
+    self.blockchain = worksource.blockchain
+    self.expiry = expiry
+    self.data = data
+    self.target = target
+    self.identifier = identifier
+    self.prevhash = data[4:36]
+    # The ntime isn't part of the first 64 bytes, so all jobs share the same midstate
+    if midstate: self.midstate = midstate
+    else: self.midstate = Job.calculate_midstate(data)
+    self.jobcount = count
+    self.taken = 0
+    self.timebase = struct.unpack(">I", data[68:72])[0]
+    self.destroyed = False
+    self.worker = None
+    self.queuenode = None
+    self.queuetime = None
+    self.blockchaingeneration = None
+    self.worksourcegeneration = None
+    
+    
+  @property
+  def hashes_remaining(self):
+    return (self.jobcount - self.taken) * 2**32
+    
+    
+  def register(self):
+    self.blockchaingeneration = self.blockchain.generation
+    self.worksourcegeneration = self.worksource.generation
+    self.worksource.add_job(self)
+    self.blockchain.add_job(self)
+    self.queuetime = time.time()
+    
+    
+  def destroy(self):
+    if self.destroyed: return
+    self.destroyed = True
+    self.worksource.remove_job(self)
+    self.blockchain.remove_job(self)
+    self.core.workqueue.remove_job(self)
+    self.taken = self.jobcount
+    
+    
+  def is_stale(self):
+    return self.blockchaingeneration != self.blockchain.generation or self.worksourcegeneration != self.worksource.generation
+    
+    
+  def cancel(self, graceful = False):
+    self.destroy()
+    
+    
+  def next_job(self):
+    # Called by the work queue (with its lock held) when a worker takes one of the jobs
+    data = self.data[:68] + struct.pack(">I", self.timebase + self.taken) + self.data[72:]
+    self.taken += 1
+    if self.taken >= self.jobcount:
+      self.destroyed = True
+      self.worksource.remove_job(self)
+      self.blockchain.remove_job(self)
+    job = Job(self.core, self.worksource, self.expiry, data, self.target, self.midstate, self.identifier)
+    # The pending mhashes were already accounted for by the template
+    job.blockchaingeneration = self.blockchaingeneration
+    job.worksourcegeneration = self.worksourcegeneration
+    job.queuetime = self.queuetime
+    self.worksource.add_job(job)
+    self.blockchain.add_job(job)
+    self.core.event(500, self.worksource, "registerjob", None, None, None, self.worksource, self.blockchain, job)
+    return job
+
     
     
 class ValidationJob(object):
@@ -0,0 +1,175 @@
+# Modular Python Bitcoin Miner
+# Copyright (C) 2012 Michael Sparmann (TheSeven)
+#
+#     This program is free software; you can redistribute it and/or
+#     modify it under the terms of the GNU General Public License
+#     as published by the Free Software Foundation; either version 2
+#     of the License, or (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program; if not, write to the Free Software
+#     Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Please consider donating to 1PLAPWDejJPJnY2ppYCgtw5ko8G5Q4hPzh if you
+# want to support further development of the Modular Python Bitcoin Miner.
+
+
+
+############################
+# Expiry-indexed job store #
+############################
+
+
+
+from bisect import bisect_left, bisect_right
+
+
+
+# Handle for one job in a store, used for O(1) removal.
+# A node can stand for several jobs (job.jobcount, e.g. a rolled job template),
+# the weight is the number of jobs that can still be taken from it.
+class JobStoreNode(object):
+
+  __slots__ = ("store", "bucket", "job", "owner", "weight", "prev", "next")
+
+
+  def __init__(self, store, bucket, job, owner = None):
+    self.store = store
+    self.bucket = bucket
+    self.job = job
+    self.owner = owner
+    self.weight = job.jobcount
+    self.prev = None
+    self.next = None
+
+
+
+# FIFO list of all jobs sharing the same (integer) expiry time
+class JobStoreBucket(object):
+
+  __slots__ = ("expiry", "head", "tail", "size", "jobs")
+
+
+  def __init__(self, expiry):
+    self.expiry = expiry
+    self.head = None
+    self.tail = None
+    # Number of nodes and number of jobs in the bucket
+    self.size = 0
+    self.jobs = 0
+
+
+
+# Jobs are kept in per-second FIFO buckets, and the bucket keys in a sorted list.
+# There are only as many buckets as there are distinct expiry seconds in the buffer
+# (usually well below a hundred), so finding a bucket is a binary search, and adding
+# or removing a job through its handle doesn't depend on the number of jobs at all.
+# Not thread safe, the work queue protects this with its own lock.
+class JobStore(object):
+
+
+  def __init__(self):
+    self.buckets = {}
+    self.keys = []
+    self.size = 0
+    self.jobs = 0
+
+
+  def __len__(self):
+    return self.jobs
+
+
+  def add(self, job, owner = None):
+    expiry = int(job.expiry)
+    bucket = self.buckets.get(expiry)
+    if not bucket:
+      bucket = JobStoreBucket(expiry)
+      self.buckets[expiry] = bucket
+      self.keys.insert(bisect_left(self.keys, expiry), expiry)
+    node = JobStoreNode(self, bucket, job, owner)
+    node.prev = bucket.tail
+    if bucket.tail: bucket.tail.next = node
+    else: bucket.head = node
+    bucket.tail = node
+    bucket.size += 1
+    bucket.jobs += node.weight
+    self.size += 1
+    self.jobs += node.weight
+    return node
+
+
+  def remove(self, node):
+    if node.store is not self: return False
+    bucket = node.bucket
+    if node.prev: node.prev.next = node.next
+    else: bucket.head = node.next
+    if node.next: node.next.prev = node.prev
+    else: bucket.tail = node.prev
+    node.store = node.bucket = node.prev = node.next = None
+    bucket.size -= 1
+    bucket.jobs -= node.weight
+    self.size -= 1
+    self.jobs -= node.weight
+    if not bucket.size: self._remove_bucket(bucket.expiry)
+    return True
+
+
+  def pop(self, min_expiry):
+    # Take the job whose expiry is closest to, but above min_expiry.
+    # If there is none, take the one with the latest expiry.
+    # Nodes that stand for several jobs only lose one unit of weight, and are
+    # only removed (and job.queuenode.store cleared) once the last one is taken.
+    if not self.keys: return None
+    index = bisect_right(self.keys, min_expiry)
+    if index >= len(self.keys): index = -1
+    bucket = self.buckets[self.keys[index]]
+    node = bucket.head
+    job = node.job
+    if node.weight > 1:
+      node.weight -= 1
+      bucket.jobs -= 1
+      self.jobs -= 1
+    else: self.remove(node)
+    return job
+
+
+  def count_between(self, start, end):
+    # Number of jobs whose integer expiry is > start and <= end
+    count = 0
+    for index in range(bisect_right(self.keys, start), bisect_right(self.keys, end)):
+      count += self.buckets[self.keys[index]].jobs
+    return count
+
+
+  def pop_expired(self, now):
+    # Remove and return all jobs (or templates) whose integer expiry is <= now, oldest first
+    jobs = []
+    while self.keys and self.keys[0] <= now:
+      bucket = self.buckets.pop(self.keys.pop(0))
+      node = bucket.head
+      while node:
+        jobs.append(node.job)
+        next = node.next
+        node.store = node.bucket = node.prev = node.next = None
+        node = next
+      self.size -= bucket.size
+      self.jobs -= bucket.jobs
+    return jobs
+
+
+  def first_expiry(self, after = None):
+    # Smallest integer expiry present that is > after, or None if there is none
+    if after is None: index = 0
+    else: index = bisect_right(self.keys, after)
+    if index >= len(self.keys): return None
+    return self.keys[index]
+
+
+  def _remove_bucket(self, expiry):
+    del self.buckets[expiry]
+    del self.keys[bisect_left(self.keys, expiry)]
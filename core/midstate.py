@@ -0,0 +1,238 @@
+# Modular Python Bitcoin Miner
+# Copyright (C) 2012 Michael Sparmann (TheSeven)
+#
+#     This program is free software; you can redistribute it and/or
+#     modify it under the terms of the GNU General Public License
+#     as published by the Free Software Foundation; either version 2
+#     of the License, or (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program; if not, write to the Free Software
+#     Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Please consider donating to 1PLAPWDejJPJnY2ppYCgtw5ko8G5Q4hPzh if you
+# want to support further development of the Modular Python Bitcoin Miner.
+
+
+
+################################
+# Midstate calculation engines #
+################################
+
+
+
+# A midstate is the SHA256 state after the first 64 bytes of a block header.
+# The header data is stored in getwork byte order (every 32 bit word swapped),
+# and the midstate is returned in the same format.
+# Several engines are available, the fastest one that works on this system is
+# picked at import time. Every engine has to reproduce a few known answers
+# before it is used, the reasons why engines were skipped end up in rejected.
+
+
+
+import struct
+from binascii import unhexlify
+from hashlib import sha256
+from .sha256 import SHA256
+
+
+
+_iv = SHA256().state
+_k = SHA256._k
+
+
+
+# Engines provide midstate(data), either as a method or as an instance attribute
+class MidstateEngine(object):
+
+  name = None
+  # Batches smaller than this are calculated one by one using the single midstate engine
+  minbatch = 1
+
+
+  def midstates(self, datalist):
+    return [self.midstate(data) for data in datalist]
+
+
+
+# The original implementation, very slow, but known to be correct
+class ReferenceMidstateEngine(MidstateEngine):
+
+  name = "reference"
+
+
+  def midstate(self, data):
+    return struct.pack("<8I", *struct.unpack(">8I", SHA256.hash(struct.pack("<16I", *struct.unpack(">16I", data[:64])), False)))
+
+
+
+# Pure Python, with the message schedule and all rounds unrolled into straight line
+# code (generated below), and the working variables renamed instead of shifted
+class PythonMidstateEngine(MidstateEngine):
+
+  name = "python"
+
+
+  def __init__(self):
+    lines = ["def midstate(data, unpack = struct.Struct('<16I').unpack, pack = struct.Struct('<8I').pack):",
+             "  w0, w1, w2, w3, w4, w5, w6, w7, w8, w9, w10, w11, w12, w13, w14, w15 = unpack(data[:64])"]
+    for i in range(16, 64):
+      lines.append("  x = w%d; y = w%d" % (i - 15, i - 2))
+      lines.append("  w%d = (w%d + (((x >> 7) | (x << 25)) ^ ((x >> 18) | (x << 14)) ^ (x >> 3)) + w%d"
+                   " + (((y >> 17) | (y << 15)) ^ ((y >> 19) | (y << 13)) ^ (y >> 10))) & 0xffffffff" % (i, i - 16, i - 7))
+    v = ["a", "b", "c", "d", "e", "f", "g", "h"]
+    lines.append("  %s = %s" % (", ".join(v), ", ".join("0x%08x" % x for x in _iv)))
+    for i in range(64):
+      a, b, c, d, e, f, g, h = v
+      lines.append("  t = %s + (((%s >> 6) | (%s << 26)) ^ ((%s >> 11) | (%s << 21)) ^ ((%s >> 25) | (%s << 7)))"
+                   " + (%s ^ (%s & (%s ^ %s))) + 0x%08x + w%d" % (h, e, e, e, e, e, e, g, e, f, g, _k[i], i))
+      lines.append("  %s = (%s + t) & 0xffffffff" % (d, d))
+      lines.append("  %s = (t + (((%s >> 2) | (%s << 30)) ^ ((%s >> 13) | (%s << 19)) ^ ((%s >> 22) | (%s << 10)))"
+                   " + ((%s & %s) | (%s & (%s | %s)))) & 0xffffffff" % (h, a, a, a, a, a, a, a, b, c, a, b))
+      v = [h, a, b, c, d, e, f, g]
+    lines.append("  return pack(%s)" % ", ".join("(%s + 0x%08x) & 0xffffffff" % (v[i], _iv[i]) for i in range(8)))
+    namespace = {"struct": struct}
+    exec(compile("\n".join(lines), "<midstate>", "exec"), namespace)
+    self.midstate = namespace["midstate"]
+
+
+
+# Uses the SHA256 compression function of OpenSSL's libcrypto through ctypes
+class OpenSSLMidstateEngine(MidstateEngine):
+
+  name = "openssl"
+
+
+  def __init__(self):
+    import ctypes
+    import ctypes.util
+    path = None
+    for name in ("crypto", "libeay32"):
+      path = ctypes.util.find_library(name)
+      if path: break
+    if not path: raise Exception("libcrypto not found")
+    lib = ctypes.CDLL(path)
+    lib.SHA256_Init.argtypes = [ctypes.c_void_p]
+    lib.SHA256_Transform.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+    lib.SHA256_Transform.restype = None
+    # SHA256_CTX is 8 state words, 2 length words, 16 data words and 2 more words
+    contexttype = ctypes.c_uint32 * 28
+    init = lib.SHA256_Init
+    transform = lib.SHA256_Transform
+    swap = struct.Struct("<16I").unpack
+    pack = struct.Struct(">16I").pack
+    packstate = struct.Struct("<8I").pack
+    def midstate(data):
+      context = contexttype()
+      init(context)
+      transform(context, pack(*swap(data[:64])))
+      return packstate(*context[:8])
+    self.midstate = midstate
+
+
+
+# NumPy, calculates all midstates of a batch at once. There is a lot of per
+# call overhead, so this is only used for large batches.
+class NumPyMidstateEngine(MidstateEngine):
+
+  name = "numpy"
+  minbatch = 32
+
+
+  def __init__(self):
+    import numpy
+    self.numpy = numpy
+    self.iv = numpy.array(_iv, dtype = numpy.uint32).reshape(8, 1)
+    self.k = [numpy.uint32(k) for k in _k]
+
+
+  def midstate(self, data):
+    return self.midstates([data])[0]
+
+
+  def midstates(self, datalist):
+    np = self.numpy
+    count = len(datalist)
+    if not count: return []
+    words = np.frombuffer(b"".join([data[:64] for data in datalist]), dtype = "<u4").astype(np.uint32).reshape(count, 16).T
+    w = [words[i] for i in range(16)]
+    for i in range(16, 64):
+      x = w[i - 15]
+      y = w[i - 2]
+      w.append(w[i - 16] + (((x >> 7) | (x << 25)) ^ ((x >> 18) | (x << 14)) ^ (x >> 3)) + w[i - 7]
+               + (((y >> 17) | (y << 15)) ^ ((y >> 19) | (y << 13)) ^ (y >> 10)))
+    a, b, c, d, e, f, g, h = [np.full(count, x, dtype = np.uint32) for x in _iv]
+    for i in range(64):
+      t1 = h + (((e >> 6) | (e << 26)) ^ ((e >> 11) | (e << 21)) ^ ((e >> 25) | (e << 7))) + (g ^ (e & (f ^ g))) + self.k[i] + w[i]
+      t2 = (((a >> 2) | (a << 30)) ^ ((a >> 13) | (a << 19)) ^ ((a >> 22) | (a << 10))) + ((a & b) | (c & (a | b)))
+      h, g, f, e, d, c, b, a = g, f, e, d + t1, c, b, a, t1 + t2
+    state = (np.array([a, b, c, d, e, f, g, h]) + self.iv).T.astype("<u4").tobytes()
+    return [state[i : i + 32] for i in range(0, 32 * count, 32)]
+
+
+
+# Engines in order of preference, more can be added before calling select_engines()
+engines = [OpenSSLMidstateEngine, NumPyMidstateEngine, PythonMidstateEngine, ReferenceMidstateEngine]
+
+# Known answers, calculated using the reference engine: the bytes 0x00 to 0x3f,
+# and the SHA256 of the little endian integers 0, 1 and 2, each repeated twice.
+known_vectors = [struct.pack("64B", *range(64))] + [sha256(struct.pack("<I", i)).digest() * 2 for i in range(3)]
+known_midstates = [
+  unhexlify(b"eb9adee680e26bb67096801ee2c1e9d548f259c85748cd32bbf41edb5fc526c3"),
+  unhexlify(b"9128bc28edfbe76c86673490721d66561a48e99e362c2628765753b1b7cc538d"),
+  unhexlify(b"cb1a7e7e9d287a28694a78831e44a05c3a4ea62fd7563fcda7d0c99f1951badd"),
+  unhexlify(b"b46ff5908eb8c5e516affcb9436a70bd97c9c0c9b9f3098fba1afbc418f3958f"),
+]
+
+
+
+def check_engine(engine):
+  # Returns None if the engine reproduces all known answers, both for single midstates and batches
+  if [engine.midstate(data) for data in known_vectors] != known_midstates: return "wrong single midstate results"
+  if engine.midstates(known_vectors) != known_midstates: return "wrong batch midstate results"
+  return None
+
+
+
+def select_engines():
+  # Checking the reference engine here would slow down every startup,
+  # the test suite compares it with the known answers instead.
+  global engine, batchengine, rejected
+  usable = []
+  rejected = []
+  for engineclass in engines:
+    try:
+      candidate = engineclass()
+      reason = None if engineclass is ReferenceMidstateEngine else check_engine(candidate)
+    except Exception as e: reason = "%s: %s" % (e.__class__.__name__, e)
+    if reason: rejected.append((engineclass.name, reason))
+    else: usable.append(candidate)
+  # Use the first engine without a minimum batch size for single midstates,
+  # and the first engine overall for batches that are large enough for it.
+  single = [candidate for candidate in usable if candidate.minbatch <= 1]
+  engine = single[0] if single else ReferenceMidstateEngine()
+  batchengine = usable[0] if usable else engine
+
+
+
+def calculate_midstate(data):
+  return engine.midstate(data)
+
+
+
+def calculate_midstates(datalist):
+  if len(datalist) < batchengine.minbatch: return engine.midstates(datalist)
+  return batchengine.midstates(datalist)
+
+
+
+engine = None
+batchengine = None
+# (engine name, reason) for all engines that can't be used
+rejected = []
+select_engines()
@@ -0,0 +1,136 @@
+# Modular Python Bitcoin Miner
+# Copyright (C) 2012 Michael Sparmann (TheSeven)
+#
+#     This program is free software; you can redistribute it and/or
+#     modify it under the terms of the GNU General Public License
+#     as published by the Free Software Foundation; either version 2
+#     of the License, or (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program; if not, write to the Free Software
+#     Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Please consider donating to 1PLAPWDejJPJnY2ppYCgtw5ko8G5Q4hPzh if you
+# want to support further development of the Modular Python Bitcoin Miner.
+
+
+
+######################
+# Deadline scheduler #
+######################
+
+
+
+import time
+import heapq
+import traceback
+from threading import Condition, Thread
+from .startable import Startable
+from .util import Bunch
+
+
+
+# Handle for a scheduled call, can be passed to Scheduler.cancel()
+class ScheduledCall(object):
+
+  __slots__ = ("deadline", "callback", "args", "canceled")
+
+
+  def __init__(self, deadline, callback, args):
+    self.deadline = deadline
+    self.callback = callback
+    self.args = args
+    self.canceled = False
+
+
+
+# Runs callbacks at (absolute, time.time() based) deadlines from a single thread.
+# The calls are kept in a heap ordered by deadline, and the thread sleeps until
+# the earliest one is due, so nothing is polled. Canceled calls are left in the
+# heap and skipped, the heap is compacted if they start to dominate it.
+# Callbacks should be short, anything slow needs to be handed off to another thread.
+class Scheduler(Startable):
+
+
+  def __init__(self, core):
+    self.core = core
+    self.id = -6
+    self.settings = Bunch(name = "Scheduler")
+    self.lock = Condition()
+    self.shutdown = True
+    super(Scheduler, self).__init__()
+
+
+  def _reset(self):
+    super(Scheduler, self)._reset()
+    self.heap = []
+    self.sequence = 0
+    self.canceled = 0
+
+
+  def _start(self):
+    super(Scheduler, self)._start()
+    self.shutdown = False
+    self.thread = Thread(None, self._loop, "scheduler")
+    self.thread.daemon = True
+    self.thread.start()
+
+
+  def _stop(self):
+    with self.lock:
+      self.shutdown = True
+      self.lock.notify()
+    self.thread.join(5)
+    super(Scheduler, self)._stop()
+
+
+  def schedule(self, deadline, callback, *args):
+    call = ScheduledCall(deadline, callback, args)
+    with self.lock:
+      self.sequence += 1
+      heapq.heappush(self.heap, (deadline, self.sequence, call))
+      if self.heap[0][2] is call: self.lock.notify()
+    return call
+
+
+  def schedule_in(self, delay, callback, *args):
+    return self.schedule(time.time() + delay, callback, *args)
+
+
+  def cancel(self, call):
+    with self.lock:
+      if call.canceled: return
+      call.canceled = True
+      self.canceled += 1
+      if self.canceled > 64 and self.canceled * 2 > len(self.heap):
+        self.heap = [entry for entry in self.heap if not entry[2].canceled]
+        heapq.heapify(self.heap)
+        self.canceled = 0
+
+
+  def _loop(self):
+    with self.lock:
+      while not self.shutdown:
+        if not self.heap:
+          self.lock.wait()
+          continue
+        deadline, sequence, call = self.heap[0]
+        if call.canceled:
+          heapq.heappop(self.heap)
+          self.canceled -= 1
+          continue
+        delay = deadline - time.time()
+        if delay > 0:
+          self.lock.wait(delay)
+          continue
+        heapq.heappop(self.heap)
+        call.canceled = True
+        self.lock.release()
+        try: call.callback(*call.args)
+        except: self.core.log(self, "Exception in scheduled call: %s\n", 100, "r", traceback.format_exc())
+        finally: self.lock.acquire()
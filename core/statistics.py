@@ -26,11 +26,34 @@
 
 
 
+import time
+from bisect import bisect_left
 from threading import RLock
 from .util import Bunch
 
 
 
+# Rolling rate statistics: window length in seconds and field name suffix
+rate_windows = ((60, "1m"), (300, "5m"), (900, "15m"))
+rate_fields = frozenset(prefix + suffix for seconds, suffix in rate_windows
+                        for prefix in ("mhps_", "acceptrate_", "rejectrate_", "rejectratio_", "cancelrate_"))
+
+# Wasted work: hashes on jobs that were canceled before they were finished, hashes
+# that went into shares that were rejected as stale (and those shares), jobs that
+# expired or became stale in the work queue before anyone took them, and fetch
+# responses (and their jobs) that were thrown away
+waste_fields = ("ghashes_canceled", "ghashes_stale", "sharesstale", "jobsexpired", "jobsstale", "fetchesdiscarded", "jobsdiscarded")
+
+# Job lifecycle stages that latency histograms are kept for:
+# fetch: getwork round trip, queue: time in the work queue, upload: handing the job
+# to the worker until it runs on the device, verify: checking a nonce, submit: share
+# submission round trip
+latency_stages = ("fetch", "queue", "upload", "verify", "submit")
+# Upper bounds of the latency histogram buckets (seconds), plus one overflow bucket
+latency_buckets = (.001, .002, .005, .01, .02, .05, .1, .2, .5, 1., 2., 5., 10., 20., 60.)
+
+
+
 class Statistics(Bunch):
 
 
@@ -50,14 +73,205 @@ class StatisticsList(list):
     return sum(element[field] for element in self)
 
     
+  def calculatefieldmax(self, field, default = 0):
+    return max([default] + [element[field] for element in self])
+
+    
   def calculatefieldavg(self, field):
     if len(self) == 0: return 0
-    return 1. * sum(element[field] in self) / len(self)
+    return 1. * sum(element[field] for element in self) / len(self)
     
     
     
+# Sums of a value over the last few minutes, kept in a ring of fixed width time
+# buckets. Memory use is fixed, and adding a value is O(1) (plus clearing the
+# buckets that were skipped since the last call).
+class RollingWindow(object):
+
+  __slots__ = ("width", "buckets", "index", "bucketstart", "created")
+
+
+  def __init__(self, width = 10, length = 90, now = None):
+    if now is None: now = time.time()
+    self.width = width
+    self.buckets = [0] * length
+    self.index = 0
+    self.bucketstart = now
+    self.created = now
+
+
+  def _advance(self, now):
+    steps = int((now - self.bucketstart) / self.width)
+    if steps <= 0: return
+    length = len(self.buckets)
+    for i in range(min(steps, length)):
+      self.index = (self.index + 1) % length
+      self.buckets[self.index] = 0
+    self.bucketstart += steps * self.width
+
+
+  def add(self, value, now = None):
+    if now is None: now = time.time()
+    self._advance(now)
+    self.buckets[self.index] += value
+
+
+  def rate(self, seconds, now = None):
+    # Average per second over the last seconds (at most width * length)
+    if now is None: now = time.time()
+    self._advance(now)
+    length = len(self.buckets)
+    count = min(length, max(1, int(seconds / self.width)))
+    total = 0
+    for i in range(count): total += self.buckets[(self.index - i) % length]
+    # The current bucket is only partially filled, and young windows don't cover the full time yet
+    covered = min((count - 1) * self.width + now - self.bucketstart, now - self.created)
+    if covered <= 0: return 0.
+    return total / float(covered)
+
+
+
+# Rolling windows of the values that the rate statistics of a worker or work
+# source are derived from. Protected by the stats lock of their owner.
+class RateStatistics(object):
+
+  __slots__ = ("hashes", "accepted", "rejected", "canceled")
+
+
+  def __init__(self):
+    now = time.time()
+    self.hashes = RollingWindow(now = now)
+    self.accepted = RollingWindow(now = now)
+    self.rejected = RollingWindow(now = now)
+    self.canceled = RollingWindow(now = now)
+
+
+
+def add_rate_statistics(stats, childstats, rates = None):
+  # Rates of the children add up, the reject ratio is calculated from the sums.
+  # Share rates are in difficulty 1 shares per minute, cancel rates in canceled jobs per minute.
+  now = time.time()
+  for seconds, suffix in rate_windows:
+    mhps = childstats.calculatefieldsum("mhps_" + suffix)
+    accepted = childstats.calculatefieldsum("acceptrate_" + suffix)
+    rejected = childstats.calculatefieldsum("rejectrate_" + suffix)
+    canceled = childstats.calculatefieldsum("cancelrate_" + suffix)
+    if rates:
+      mhps += rates.hashes.rate(seconds, now) / 1000000.
+      accepted += rates.accepted.rate(seconds, now) * 60
+      rejected += rates.rejected.rate(seconds, now) * 60
+      canceled += rates.canceled.rate(seconds, now) * 60
+    stats["mhps_" + suffix] = mhps
+    stats["acceptrate_" + suffix] = accepted
+    stats["rejectrate_" + suffix] = rejected
+    stats["rejectratio_" + suffix] = rejected / (accepted + rejected) if accepted + rejected else 0.
+    stats["cancelrate_" + suffix] = canceled
+
+
+
+# Latency distribution of one job lifecycle stage, in fixed buckets
+class LatencyHistogram(object):
+
+  __slots__ = ("buckets", "count", "total", "max")
+
+
+  def __init__(self):
+    self.buckets = [0] * (len(latency_buckets) + 1)
+    self.count = 0
+    self.total = 0.
+    self.max = 0.
+
+
+  def add(self, latency):
+    if latency < 0: latency = 0.
+    self.buckets[bisect_left(latency_buckets, latency)] += 1
+    self.count += 1
+    self.total += latency
+    if latency > self.max: self.max = latency
+
+
+  def merge(self, buckets, count, total, max):
+    mine = self.buckets
+    for i, value in enumerate(buckets):
+      if value: mine[i] += value
+    self.count += count
+    self.total += total
+    if max > self.max: self.max = max
+
+
+  def get_statistics(self):
+    # The percentiles are the upper bounds of the buckets that contain them (or the
+    # maximum, if that is lower), and are all found in one pass over the buckets.
+    result = {
+      "buckets": list(self.buckets),
+      "count": self.count,
+      "total": self.total,
+      "max": self.max,
+      "avg": self.total / self.count if self.count else 0.,
+      "p50": 0.,
+      "p90": 0.,
+      "p99": 0.,
+    }
+    if not self.count: return result
+    pending = [("p50", .5 * self.count), ("p90", .9 * self.count), ("p99", .99 * self.count)]
+    seen = 0
+    for i, count in enumerate(self.buckets):
+      if not count: continue
+      seen += count
+      while pending and seen >= pending[0][1]:
+        result[pending.pop(0)[0]] = min(latency_buckets[i], self.max) if i < len(latency_buckets) else self.max
+      if not pending: break
+    return result
+
+
+
+# Latency histograms of all job lifecycle stages of a worker or work source.
+# Protected by the stats lock of their owner.
+class LatencyStatistics(object):
+
+  __slots__ = latency_stages
+
+
+  def __init__(self):
+    for stage in latency_stages: setattr(self, stage, LatencyHistogram())
+
+
+
+def add_waste_statistics(stats, childstats, own = None):
+  # Needs stats.ghashes to be set already. Not every object tracks every kind of waste.
+  for field in waste_fields:
+    stats[field] = (own.get(field, 0) if own else 0) + childstats.calculatefieldsum(field)
+  # Canceled jobs aren't necessarily useless until the cancellation, so this is an upper bound
+  wasted = stats.ghashes_canceled + stats.ghashes_stale
+  stats.wastedratio = min(1., wasted / stats.ghashes) if stats.ghashes else 0.
+
+
+
+def add_latency_statistics(stats, childstats, latency = None):
+  # The histograms of the children are merged into the ones of the parent
+  children = [child.latency for child in childstats if "latency" in child]
+  result = {}
+  for stage in latency_stages:
+    own = getattr(latency, stage) if latency else None
+    if own and not children:
+      result[stage] = own.get_statistics()
+      continue
+    histogram = LatencyHistogram()
+    if own: histogram.merge(own.buckets, own.count, own.total, own.max)
+    for child in children:
+      other = child[stage]
+      if other["count"]: histogram.merge(other["buckets"], other["count"], other["total"], other["max"])
+    result[stage] = histogram.get_statistics()
+  stats.latency = result
+
+
+
 class StatisticsProvider(object):
 
+  # Fields that change just because time passes. They don't make a node count as
+  # changed in statistics snapshots.
+  volatile_statistics = frozenset(["avgmhps"]) | rate_fields
+
 
   def __init__(self):
     self.stats = Bunch()
@@ -78,3 +292,109 @@ class StatisticsProvider(object):
     for child in self.children: childstats.append(child.get_statistics())
     with self.stats.lock: self._get_statistics(stats, childstats)
     return stats
+
+
+
+# A consistent picture of the whole statistics tree. Snapshots are shared between
+# all consumers and must not be modified. Every node has a "version" field, the
+# snapshot version in which any of its non-volatile fields last changed.
+class StatisticsSnapshot(object):
+
+
+  def __init__(self, version, timestamp, starttime, ghashes, workers, worksources, blockchains, nodes, removed, oldestversion):
+    self.version = version
+    self.timestamp = timestamp
+    self.starttime = starttime
+    self.ghashes = ghashes
+    self.avgmhps = 1000. * ghashes / (timestamp - starttime)
+    self.workers = workers
+    self.worksources = worksources
+    self.blockchains = blockchains
+    # Node id => (node, parent id), for all nodes of the tree
+    self.nodes = nodes
+    # Node id => version in which the node disappeared, for nodes that disappeared after oldestversion
+    self.removed = removed
+    self.oldestversion = oldestversion
+
+
+  def get_changes(self, since):
+    # Returns the nodes that changed after the given version (without their
+    # children, but with the id of their parent), the ids of removed nodes, and
+    # whether this is a full refresh. If removals after since might have been
+    # forgotten already, all nodes are returned, and the caller has to drop
+    # every node that it knew about before.
+    full = since < self.oldestversion
+    if full: since = 0
+    changed = []
+    for node, parent in self.nodes.values():
+      if node.version <= since: continue
+      copy = Statistics()
+      copy.update(node)
+      del copy["children"]
+      copy.parent = parent
+      changed.append(copy)
+    removed = [] if full else [id for id, version in self.removed.items() if version > since]
+    return changed, removed, full
+
+
+
+# Builds statistics snapshots for the core. A snapshot is reused until it is
+# older than maxage seconds, so no matter how many consumers poll the statistics,
+# the tree is walked (and all the node locks are taken) at most once per interval.
+class StatisticsSnapshotter(object):
+
+  maxage = 1
+  # Removed nodes are remembered for this many versions, consumers that are further
+  # behind than that get a full refresh
+  removedversions = 1000
+
+
+  def __init__(self, core):
+    self.core = core
+    self.lock = RLock()
+    self.version = 0
+    self.snapshot = None
+    # Node id => (version, non-volatile fields) as of the last snapshot
+    self.nodestate = {}
+    self.removed = {}
+    # Removals up to this version were forgotten
+    self.oldestversion = 0
+
+
+  def get_snapshot(self, maxage = None):
+    if maxage is None: maxage = self.maxage
+    with self.lock:
+      now = time.time()
+      snapshot = self.snapshot
+      if snapshot and 0 <= now - snapshot.timestamp < maxage: return snapshot
+      self.version += 1
+      workers = self.core.get_worker_statistics()
+      worksources = self.core.get_work_source_statistics()
+      blockchains = self.core.get_blockchain_statistics()
+      nodes = {}
+      nodestate = {}
+      for root in workers + worksources + blockchains: self._visit(root, None, nodes, nodestate)
+      for id in self.nodestate:
+        if not id in nodestate: self.removed[id] = self.version
+      for id in nodestate: self.removed.pop(id, None)
+      cutoff = self.version - self.removedversions
+      if cutoff > self.oldestversion:
+        self.oldestversion = cutoff
+        for id, version in list(self.removed.items()):
+          if version <= cutoff: del self.removed[id]
+      self.nodestate = nodestate
+      self.snapshot = StatisticsSnapshot(self.version, now, self.core.stats.starttime, self.core.stats.ghashes,
+                                         workers, worksources, blockchains, nodes, dict(self.removed), self.oldestversion)
+      return self.snapshot
+
+
+  def _visit(self, node, parent, nodes, nodestate):
+    fields = dict(node)
+    del fields["children"]
+    for key in node.obj.volatile_statistics: fields.pop(key, None)
+    previous = self.nodestate.get(node.id)
+    version = previous[0] if previous and previous[1] == fields else self.version
+    node.version = version
+    nodestate[node.id] = (version, fields)
+    nodes[node.id] = (node, parent)
+    for child in node.children: self._visit(child, node.id, nodes, nodestate)
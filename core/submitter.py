@@ -0,0 +1,244 @@
+# Modular Python Bitcoin Miner
+# Copyright (C) 2012 Michael Sparmann (TheSeven)
+#
+#     This program is free software; you can redistribute it and/or
+#     modify it under the terms of the GNU General Public License
+#     as published by the Free Software Foundation; either version 2
+#     of the License, or (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program; if not, write to the Free Software
+#     Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Please consider donating to 1PLAPWDejJPJnY2ppYCgtw5ko8G5Q4hPzh if you
+# want to support further development of the Modular Python Bitcoin Miner.
+
+
+
+###################
+# Share submitter #
+###################
+
+
+
+import time
+import traceback
+from binascii import hexlify
+from collections import deque
+from threading import Condition, Thread
+from .startable import Startable
+from .util import Bunch
+
+
+
+# One share on its way to a work source
+class Share(object):
+
+  __slots__ = ("worksource", "job", "data", "nonce", "noncediff", "id", "created", "tries", "waiting", "done")
+
+
+  def __init__(self, worksource, job, data, nonce, noncediff, id):
+    self.worksource = worksource
+    self.job = job
+    self.data = data
+    self.nonce = nonce
+    self.noncediff = noncediff
+    self.id = id
+    self.created = time.time()
+    self.tries = 0
+    # Whether the share is waiting for a retry
+    self.waiting = False
+    self.done = False
+
+
+
+# Per work source submission queue
+class ShareQueue(object):
+
+  __slots__ = ("worksource", "shares", "outstanding", "running", "ready")
+
+
+  def __init__(self, worksource):
+    self.worksource = worksource
+    # Shares waiting for a submitter thread
+    self.shares = deque()
+    # All shares that weren't handled yet (queued, waiting for a retry or submitted), by id
+    self.outstanding = {}
+    # Number of submitter threads currently working on shares of this work source
+    self.running = 0
+    # Whether the queue is in the submitter's ready list
+    self.ready = False
+
+
+
+# Submits shares to their work sources using a bounded pool of threads.
+# Every work source gets its own queue, and the threads serve the queues of all
+# work sources round robin, with at most worksource.submit_concurrency threads
+# working for the same work source at a time. If a submission fails, the share
+# is handed to the scheduler and queued again after an exponential backoff,
+# so no thread is blocked while waiting for the retry.
+# Work sources get a share through their _submit_share(share) method, which
+# runs on a submitter thread and has to call finish(share, result) once the
+# share was handled (possibly later, from a different thread), or raise an
+# exception if the submission should be retried.
+class Submitter(Startable):
+
+  # Maximum number of submitter threads
+  maxthreads = 8
+  # Maximum delay between retries (seconds)
+  maxretrydelay = 30
+
+
+  def __init__(self, core):
+    self.core = core
+    self.id = -7
+    self.settings = Bunch(name = "Share submitter")
+    self.lock = Condition()
+    self.shutdown = True
+    super(Submitter, self).__init__()
+
+
+  def _reset(self):
+    super(Submitter, self)._reset()
+    self.queues = {}
+    self.readyqueues = deque()
+    self.threads = []
+    self.idle = 0
+    self.shareid = 0
+
+
+  def _start(self):
+    super(Submitter, self)._start()
+    self.shutdown = False
+
+
+  def _stop(self):
+    with self.lock:
+      self.shutdown = True
+      self.lock.notify_all()
+      threads = self.threads
+    for thread in threads: thread.join(1)
+    super(Submitter, self)._stop()
+
+
+  def submit(self, worksource, job, data, nonce, noncediff):
+    with self.lock:
+      self.shareid += 1
+      share = Share(worksource, job, data, nonce, noncediff, self.shareid)
+      queue = self.queues.get(worksource)
+      if not queue:
+        queue = ShareQueue(worksource)
+        self.queues[worksource] = queue
+      queue.outstanding[share.id] = share
+      queue.shares.append(share)
+      self._make_ready(queue)
+    return share
+
+
+  def finish(self, share, result):
+    # The work source is done with the share, report the result to the job
+    with self.lock:
+      if share.done: return
+      share.done = True
+      queue = self.queues.get(share.worksource)
+      if queue:
+        del queue.outstanding[share.id]
+        self._cleanup(queue)
+    share.job.add_latency("submit", time.time() - share.created)
+    share.job.nonce_handled_callback(share.nonce, share.noncediff, result)
+
+
+  def discard(self, worksource):
+    # Drop all shares of a work source that weren't submitted yet
+    with self.lock:
+      queue = self.queues.get(worksource)
+      if not queue: return
+      shares = list(queue.shares) + [share for share in queue.outstanding.values() if share.waiting]
+      queue.shares.clear()
+      for share in shares:
+        share.done = True
+        del queue.outstanding[share.id]
+      self._cleanup(queue)
+      count = len(shares)
+    if count: self.core.log(worksource, "Discarding %d unsubmitted shares\n", 200, "y", count)
+
+
+  def get_queue_statistics(self, worksource):
+    # Returns the number of shares that weren't handled yet, and the age of the oldest one
+    with self.lock:
+      queue = self.queues.get(worksource)
+      if not queue or not queue.outstanding: return 0, 0
+      return len(queue.outstanding), time.time() - queue.outstanding[min(queue.outstanding)].created
+
+
+  def _cleanup(self, queue):
+    if queue.outstanding or queue.running or queue.ready: return
+    if self.queues.get(queue.worksource) is queue: del self.queues[queue.worksource]
+
+
+  def _make_ready(self, queue):
+    if queue.ready or not queue.shares or queue.running >= queue.worksource.submit_concurrency: return
+    queue.ready = True
+    self.readyqueues.append(queue)
+    if self.idle: self.lock.notify()
+    elif len(self.threads) < self.maxthreads and not self.shutdown:
+      thread = Thread(None, self._loop, "share_submitter_%d" % len(self.threads))
+      thread.daemon = True
+      thread.start()
+      self.threads.append(thread)
+
+
+  def _requeue(self, share):
+    with self.lock:
+      share.waiting = False
+      if share.done: return
+      queue = self.queues.get(share.worksource)
+      if not queue: return
+      if not share.worksource.started:
+        # The work source went away while the share was waiting
+        share.done = True
+        del queue.outstanding[share.id]
+        self._cleanup(queue)
+        return
+      # Retries go first, they have been waiting for long enough already
+      queue.shares.appendleft(share)
+      self._make_ready(queue)
+
+
+  def _failed(self, share):
+    share.tries += 1
+    worksource = share.worksource
+    worksource._handle_error(True)
+    delay = min(self.maxretrydelay, 2 ** (share.tries - 1))
+    with self.lock: share.waiting = True
+    self.core.log(worksource, "Error while sending share %s (difficulty %.5f), retrying in %d seconds: %s\n", 200, "y", hexlify(share.nonce).decode("ascii"), share.noncediff, delay, traceback.format_exc())
+    self.core.scheduler.schedule_in(delay, self._requeue, share)
+
+
+  def _loop(self):
+    with self.lock:
+      while not self.shutdown:
+        if not self.readyqueues:
+          self.idle += 1
+          self.lock.wait()
+          self.idle -= 1
+          continue
+        queue = self.readyqueues.popleft()
+        queue.ready = False
+        share = queue.shares.popleft()
+        queue.running += 1
+        self._make_ready(queue)
+        self.lock.release()
+        try:
+          try: share.worksource._submit_share(share)
+          except: self._failed(share)
+        finally:
+          self.lock.acquire()
+          queue.running -= 1
+          self._make_ready(queue)
+          self._cleanup(queue)
@@ -26,6 +26,10 @@
 
 
 
+from collections import OrderedDict
+
+
+
 class OutputRedirector(object):
 
 
@@ -59,3 +63,42 @@ class Bunch(dict):
   def __setstate__(self, state):
     self.update(state)
     self.__dict__ = self
+
+
+
+# Set that remembers insertion order, used for the job lists of work sources and
+# blockchains. Adding, removing and membership tests are O(1). Iteration returns
+# the items in the order in which they were added (oldest first), adding an item
+# that is already present doesn't change its position.
+class OrderedSet(object):
+
+
+  def __init__(self, items = ()):
+    self.map = OrderedDict()
+    for item in items: self.map[item] = None
+
+
+  def __len__(self):
+    return len(self.map)
+
+
+  def __contains__(self, item):
+    return item in self.map
+
+
+  def __iter__(self):
+    return iter(self.map)
+
+
+  def add(self, item):
+    if item not in self.map: self.map[item] = None
+
+
+  def discard(self, item):
+    self.map.pop(item, None)
+
+
+  def pop(self):
+    # Removes and returns the oldest item
+    if not self.map: raise KeyError("pop from an empty set")
+    return self.map.popitem(False)[0]
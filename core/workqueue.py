@@ -27,11 +27,15 @@
 
 
 import time
+import traceback
+from collections import deque
 from threading import Condition, RLock, Thread
 from .startable import Startable
+from .jobstore import JobStore
+from .job import JobTemplate
 from .util import Bunch
-try: from queue import Queue
-except: from Queue import Queue
+try: from queue import Queue, Empty
+except: from Queue import Queue, Empty
 
 
 
@@ -42,6 +46,7 @@ class WorkQueue(Startable):
     self.core = core
     self.id = -3
     self.settings = Bunch(name = "Work queue")
+    self.shutdown = True
     super(WorkQueue, self).__init__()
     # Initialize global work queue lock and wakeup condition
     self.lock = Condition()
@@ -51,171 +56,304 @@ class WorkQueue(Startable):
   def _reset(self):
     self.core.event(300, self, "reset", None, "Resetting work queue state")
     super(WorkQueue, self)._reset()
-    # Initialize job list container and count
-    self.lists = {}
+    # Initialize job store and count
+    self.queue = JobStore()
     self.target = 5
     self.count = 0
     self.expirycutoff = 0
-    # Initialize taken job list container
-    self.takenlists = {}
+    # Initialize taken job store
+    self.taken = JobStore()
+    # Initialize prefetch slots: Jobs reserved for a specific worker, which will
+    # be handed out to it on its next get_job call. The node owner is the worker.
+    self.reserved = JobStore()
+    self.prefetchslots = {}
+    self.prefetched = {}
+    self.hungry = set()
+    self.waiting = 0
+    # Scheduled call for the next expiry or cutoff transition
+    self.cleanuptimer = None
     
     
   def add_job(self, job, source = None, subsource = "unknown source"):
     if not source: source = self
     with self.lock:
       if not job.blockchain.check_job(job):
-        mhashes = job.hashes_remaining / 1000000.
-        job.worksource.add_pending_mhashes(-mhashes)
-        job.worksource.add_deferred_mhashes(mhashes)
-        self.core.log(source, "Discarding one job from %s because it is stale\n" % subsource, 500)
+        job.worksource.add_deferred_mhashes(job.hashes_remaining / 1000000.)
+        self._count_unused(job, "jobsstale")
+        self.core.log(source, "Discarding one job from %s because it is stale\n", 500, "", subsource)
         return False
-      expiry = int(job.expiry)
-      if not expiry in self.lists: self.lists[expiry] = [job]
-      else: self.lists[expiry].append(job)
-      if expiry > self.expirycutoff: self.count += 1
+      self._add_job_internal(job)
       job.register()
+      if self.hungry: self._fill_prefetch_slots()
       self.lock.notify_all()
-      self.core.log(source, "Got one job from %s\n" % subsource, 500)
+      self.core.log(source, "Got one job from %s\n", 500, "", subsource)
       return True
     
     
   def add_jobs(self, jobs, source = None, subsource = "unknown source"):
     if not source: source = self
     with self.lock:
-      seen = {}
+      discarded = {}
       accepted = 0
       dropped = 0
       for job in jobs:
         if not job.blockchain.check_job(job):
-          dropped += 1
-          if not job.worksource in seen:
-            mhashes = 2**32 / 1000000.
-            job.worksource.add_pending_mhashes(-mhashes)
-            job.worksource.add_deferred_mhashes(mhashes)
-            seen[job.worksource] = True
+          dropped += job.jobcount
+          self._count_unused(job, "jobsstale")
+          discarded[job.worksource] = discarded.get(job.worksource, 0) + job.hashes_remaining / 1000000.
         else:
-          expiry = int(job.expiry)
-          if not expiry in self.lists: self.lists[expiry] = [job]
-          else: self.lists[expiry].append(job)
-          if expiry > self.expirycutoff: self.count += 1
+          self._add_job_internal(job)
           job.register()
-          accepted += 1
+          accepted += job.jobcount
+      # Stale jobs count as processed, and are given back to the work source later. Each
+      # discarded job is credited with its remaining hashes, summed up per work source
+      # so that every work source's statelock is only taken once per batch.
+      for worksource, mhashes in discarded.items(): worksource.add_deferred_mhashes(mhashes)
+      if self.hungry: self._fill_prefetch_slots()
       self.lock.notify_all()
-      if accepted: self.core.log(source, "Got %d jobs from %s\n" % (accepted, subsource), 500)
-      if dropped: self.core.log(source, "Discarding %d jobs from %s because they are stale\n" % (dropped, subsource), 500)
+      if accepted: self.core.log(source, "Got %d jobs from %s\n", 500, "", accepted, subsource)
+      if dropped: self.core.log(source, "Discarding %d jobs from %s because they are stale\n", 500, "", dropped, subsource)
       return accepted
     
     
   def cancel_jobs(self, jobs, graceful = False):
     if not jobs: return
-    self.cancelqueue.put((jobs, graceful))
+    self.cancelqueue.put((jobs, graceful, False, None))
+
+
+  def cancel_stale_jobs(self, jobs, graceful = False, callback = None):
+    # Takes the job list of a generation that just became stale (block change or work
+    # source flush). The jobs that are running on a worker are canceled first, and
+    # callback(count) is called once all of their workers were notified. The remaining
+    # ones are taken out of the queue right away, so that the count is correct for the
+    # fetcher, and are destroyed whenever the cancel thread has nothing more urgent to do.
+    with self.lock:
+      for job in jobs:
+        if job.queuenode and job.queuenode.store is not self.taken: self._unqueue(job)
+    self.cancelqueue.put((jobs, graceful, True, callback))
+    self.core.fetcher.wakeup()
     
     
   def remove_job(self, job):
     with self.lock:
-      try:
-        expiry = int(job.expiry)
-        try:
-          self.lists[expiry].remove(job)
-          if expiry > self.expirycutoff: self.count -= 1
-        except: pass
-        try: self.takenlists[expiry].remove(job)
-        except: pass
-      except: pass
+      if job.queuenode: self._unqueue(job)
+
+
+  def _unqueue(self, job):
+    node = job.queuenode
+    job.queuenode = None
+    if node.store is self.queue and node.bucket.expiry > self.expirycutoff: self.count -= node.weight
+    elif node.store is self.reserved: self._release_prefetched_job(node.owner)
+    node.store.remove(node)
       
       
-  def get_job(self, worker, expiry_min_ahead, async = False):
+  def get_job(self, worker, expiry_min_ahead, nonblocking = False, prefetch = False):
+    requesttime = time.time()
     with self.lock:
       while True:
-        job = self._get_job_internal(expiry_min_ahead)
+        job = self._take_prefetched_job(worker, expiry_min_ahead)
+        if not job: job = self._get_job_internal(expiry_min_ahead)
         if job:
           job.set_worker(worker)
-          expiry = int(job.expiry)
-          if int(job.expiry) <= self.expirycutoff: self.count += 1
-          if not expiry in self.takenlists: self.takenlists[expiry] = [job]
-          else: self.takenlists[expiry].append(job)
+          job.queuenode = self.taken.add(job)
+          if job.queuenode.bucket.size == 1: self._schedule_cleanup()
           break
-        elif async: return None
+        elif nonblocking: return None
         self.lock.release()
         with self.core.fetcher.lock:
           self.lock.acquire()
           self.core.fetcher.wakeup()
+        self.waiting += 1
         self.lock.wait()
-    self.core.fetcher.wakeup()
+        self.waiting -= 1
+      # Reserve the worker's next job right away, so that it doesn't
+      # need to wait for one once it's done with the current job.
+      if prefetch: self._prefetch_job(worker, expiry_min_ahead)
+    job.requesttime = requesttime
+    self.core.fetcher.notify_job_taken()
     return job
 
 
+  def cancel_prefetch(self, worker):
+    # Give back the job reserved for a worker, and don't reserve any new ones for it.
+    with self.lock:
+      self.prefetchslots.pop(worker, None)
+      self.hungry.discard(worker)
+      job = self.prefetched.pop(worker, None)
+      if not job: return
+      self.reserved.remove(job.queuenode)
+      self._add_job_internal(job)
+      self.lock.notify_all()
+
+
+  def _add_job_internal(self, job):
+    job.queuenode = self.queue.add(job)
+    if job.queuenode.bucket.expiry > self.expirycutoff: self.count += job.queuenode.weight
+    # Only a newly created bucket can move the next deadline
+    if job.queuenode.bucket.size == 1: self._schedule_cleanup()
+
+
+  def _prefetch_job(self, worker, expiry_min_ahead):
+    self.prefetchslots[worker] = expiry_min_ahead
+    if worker in self.prefetched: return
+    # Workers that are blocked in get_job have priority over filling prefetch slots
+    job = None
+    if len(self.queue) > self.waiting: job = self._get_job_internal(expiry_min_ahead)
+    if not job:
+      self.hungry.add(worker)
+      return
+    self.hungry.discard(worker)
+    self.prefetched[worker] = job
+    job.queuenode = self.reserved.add(job, worker)
+    if job.queuenode.bucket.size == 1: self._schedule_cleanup()
+
+
+  def _fill_prefetch_slots(self):
+    for worker in list(self.hungry):
+      if len(self.queue) <= self.waiting: return
+      self._prefetch_job(worker, self.prefetchslots[worker])
+
+
+  def _take_prefetched_job(self, worker, expiry_min_ahead):
+    self.hungry.discard(worker)
+    job = self.prefetched.pop(worker, None)
+    if not job: return None
+    self.reserved.remove(job.queuenode)
+    job.queuenode = None
+    # Stale jobs are destroyed by the cancel thread
+    if job.is_stale(): return None
+    if job.expiry > time.time() + expiry_min_ahead: return job
+    # The job doesn't meet the requested expiry any more. Put it back
+    # into the queue and let _get_job_internal pick the best match.
+    self._add_job_internal(job)
+    return None
+
+
+  def _release_prefetched_job(self, worker):
+    # The reserved job is gone (block change, expiry, ...), get a new one as soon as possible
+    del self.prefetched[worker]
+    if worker in self.prefetchslots: self.hungry.add(worker)
+
+
+  def _count_unused(self, job, field):
+    # Accounts for jobs that are thrown away without anyone having worked on them.
+    # Templates only count the jobs that weren't taken yet.
+    count = int(job.hashes_remaining // 2**32)
+    if not count: return
+    with job.worksource.stats.lock: job.worksource.stats[field] += count
+
+
   def _get_job_internal(self, expiry_min_ahead):
-    keys = sorted(self.lists.keys())
+    # Look for a job that meets min_expiry as closely as possible.
+    # If there is none, take the job with the latest expiry.
     min_expiry = time.time() + expiry_min_ahead
-    # Look for a job that meets min_expiry as closely as possible
-    for expiry in keys:
-      if expiry <= min_expiry: continue
-      list = self.lists[expiry]
-      if not list: continue
-      self.count -= 1
-      return list.pop(0)
-    # If there was none, look for the job with the latest expiry
-    keys.reverse()
-    for expiry in keys:
-      if expiry > min_expiry: continue
-      list = self.lists[expiry]
-      if not list: continue
-      self.count -= 1
-      return list.pop(0)
-    # There were no jobs at all
-    return None
+    while True:
+      job = self.queue.pop(min_expiry)
+      if not job: return None
+      if int(job.expiry) > self.expirycutoff: self.count -= 1
+      # Templates stay in the queue until their last job was taken
+      if not job.queuenode.store: job.queuenode = None
+      # Jobs that became stale just now may not have been taken out of the
+      # queue yet. Skip them, the cancel thread will destroy them.
+      if job.is_stale():
+        if job.queuenode: self._unqueue(job)
+        continue
+      if isinstance(job, JobTemplate): job = job.next_job()
+      return job
 
         
   def _start(self):
     super(WorkQueue, self)._start()
     self.shutdown = False
-    self.cleanupthread = Thread(None, self._cleanuploop, "workqueue_cleanup")
-    self.cleanupthread.daemon = True
-    self.cleanupthread.start()
     self.cancelthread = Thread(None, self._cancelloop, "workqueue_cancelworker")
     self.cancelthread.daemon = True
     self.cancelthread.start()
+    with self.lock: self._schedule_cleanup()
   
   
   def _stop(self):
-    self.shutdown = True
-    self.cleanupthread.join(5)
+    with self.lock:
+      self.shutdown = True
+      if self.cleanuptimer: self.core.scheduler.cancel(self.cleanuptimer)
+      self.cleanuptimer = None
     self.cancelqueue.put(None)
     self.cancelthread.join(5)
     self._reset()
     super(WorkQueue, self)._stop()
 
+
+  def _schedule_cleanup(self):
+    # Figure out when the next job will leave the usable count (10 seconds before
+    # its expiry), or expire while queued or taken, and make sure that we wake up
+    # at that point. Needs to be called with the lock held.
+    if self.shutdown: return
+    deadline = None
+    for expiry in (self.queue.first_expiry(), self.taken.first_expiry(), self.reserved.first_expiry()):
+      if expiry is not None and (deadline is None or expiry < deadline): deadline = expiry
+    expiry = self.queue.first_expiry(self.expirycutoff)
+    if expiry is not None and (deadline is None or expiry - 10 < deadline): deadline = expiry - 10
+    if self.cleanuptimer:
+      if deadline is not None and self.cleanuptimer.deadline <= deadline: return
+      self.core.scheduler.cancel(self.cleanuptimer)
+      self.cleanuptimer = None
+    if deadline is not None: self.cleanuptimer = self.core.scheduler.schedule(deadline, self._cleanup)
+
     
-  def _cleanuploop(self):
-    while not self.shutdown:
+  def _cleanup(self):
+    with self.lock:
+      if self.shutdown: return
+      self.cleanuptimer = None
       now = time.time()
-      cancel = []
-      with self.lock:
-        keys = sorted(self.lists.keys())
-        cutoff = now + 10
-        for expiry in keys:
-          if expiry > cutoff: break
-          if expiry > self.expirycutoff and expiry <= cutoff: self.count -= len(self.lists[expiry])
-          if expiry <= now:
-            while self.lists[expiry]: self.lists[expiry].pop(0).destroy()
-            del self.lists[expiry]
-        self.expirycutoff = cutoff
-        keys = sorted(self.takenlists.keys())
-        for expiry in keys:
-          if expiry <= now:
-            while self.takenlists[expiry]: cancel.append(self.takenlists[expiry].pop(0))
-            del self.takenlists[expiry]
-      self.core.fetcher.wakeup()
-      self.cancel_jobs(cancel)
-      time.sleep(1)
+      count = self.count
+      cutoff = now + 10
+      self.count -= self.queue.count_between(self.expirycutoff, cutoff)
+      self.expirycutoff = cutoff
+      for job in self.queue.pop_expired(now):
+        job.queuenode = None
+        self._count_unused(job, "jobsexpired")
+        job.destroy()
+      for job in self.reserved.pop_expired(now):
+        self._release_prefetched_job(job.queuenode.owner)
+        job.queuenode = None
+        self._count_unused(job, "jobsexpired")
+        job.destroy()
+      cancel = self.taken.pop_expired(now)
+      for job in cancel: job.queuenode = None
+      self._schedule_cleanup()
+      dropped = self.count < count
+    if dropped: self.core.fetcher.wakeup()
+    self.cancel_jobs(cancel)
 
   
   def _cancelloop(self):
+    stale = deque()
     while True:
-      data = self.cancelqueue.get()
+      # Canceling running jobs has priority, stale jobs that are still
+      # queued are only destroyed if there is nothing else to do.
+      try: data = self.cancelqueue.get(not stale)
+      except Empty:
+        self._destroy_stale_jobs(stale)
+        continue
       if not data: return
-      jobs, graceful = data
+      jobs, graceful, isstale, callback = data
+      if isstale:
+        stale.extend(jobs)
+        # Nobody can take a stale job any more, so the set of running ones is final
+        jobs = [job for job in jobs if job.worker]
       for job in jobs:
         try: job.cancel(graceful)
-        except: self.core.log(self.core, "Error while canceling job: %s\n" % traceback.format_exc(), 100, "r")
+        except: self.core.log(self.core, "Error while canceling job: %s\n", 100, "r", traceback.format_exc())
+      if callback:
+        try: callback(len(jobs))
+        except: self.core.log(self.core, "Error while canceling jobs: %s\n", 100, "r", traceback.format_exc())
+
+
+  def _destroy_stale_jobs(self, stale):
+    # Only a few jobs at a time, to keep the lock available for the workers.
+    # Running jobs will be destroyed by their workers.
+    with self.lock:
+      for i in range(min(64, len(stale))):
+        job = stale.popleft()
+        if job.worker or job.destroyed: continue
+        self._count_unused(job, "jobsstale")
+        job.destroy()
@@ -26,13 +26,48 @@
 
 
 
+import math
 import time
 import traceback
+from heapq import heappush, heappop
 from threading import RLock
 from .baseworksource import BaseWorkSource
 
 
 
+# Scheduling state of one child of a work source group
+class FairShareEntry(object):
+
+  __slots__ = ("worksource", "state", "vtime", "tokens", "tokentime", "seq", "reservationseq", "recentjobs", "recenttime")
+
+
+  def __init__(self, worksource, now):
+    self.worksource = worksource
+    # "ready" (in the run queue), "busy" (being asked for jobs), "parked" or "removed"
+    self.state = None
+    # Jobs handed out so far, divided by the priority
+    self.vtime = 0
+    # Jobs reserved by the configured hashrate that weren't handed out yet
+    self.tokens = 0
+    self.tokentime = now
+    # Only the most recently pushed heap items of an entry are valid
+    self.seq = None
+    self.reservationseq = None
+    # Decaying count of the jobs handed out recently, to weight the child's fetch latency
+    self.recentjobs = 0
+    self.recenttime = now
+
+
+
+# Jobs are distributed among the children using stride scheduling: every child has a
+# virtual time, which advances by the number of jobs that it handed out divided by its
+# priority, and the ready child with the lowest virtual time is asked first.
+# Children with a configured hashrate additionally collect tokens at that rate (up to
+# distribution_granularity jobs), and are asked first whenever they have a job worth
+# of them. Children that are disabled, locked out or failed to start a fetcher are
+# parked until their lockout ends (or for recheck_interval) instead of being asked on
+# every pick. All of this is kept in heaps, so a pick is O(log n) in the number of
+# children. Children with a priority of 0 are only asked if nobody else has jobs.
 class WorkSourceGroup(BaseWorkSource):
 
   version = "core.worksourcegroup v0.1.0"
@@ -41,6 +76,12 @@ class WorkSourceGroup(BaseWorkSource):
   settings = dict(BaseWorkSource.settings, **{
     "distribution_granularity": {"title": "Distribution granularity", "type": "float", "position": 20000},
   })
+  # Seconds before a parked child without a known lockout end is asked again
+  recheck_interval = 1
+  # Mhashes per job
+  jobmhashes = 2**32 / 1000000.
+  # Time constant of the recent job counts that weight the children's fetch latencies (seconds)
+  share_tau = 60.
 
 
   def __init__(self, core, state = None):
@@ -59,8 +100,14 @@ class WorkSourceGroup(BaseWorkSource):
 
   def _reset(self):
     super(WorkSourceGroup, self)._reset()
-    self.last_index = 0
-    self.last_time = time.time()
+    # Scheduler state, entries for the children are added when the group is started
+    self.entries = {}
+    self.runqueue = []
+    self.reservations = []
+    self.parked = []
+    self.seq = 0
+    # Virtual time of the last pick, for children with and without a priority
+    self.vtimes = [0, 0]
 
       
   def apply_settings(self):
@@ -91,11 +138,12 @@ class WorkSourceGroup(BaseWorkSource):
         if not worksource in self.children:
           if self.started:
             try:
-              self.core.log(self, "Starting up work source %s...\n" % (worksource.settings.name), 800)
+              self.core.log(self, "Starting up work source %s...\n", 800, "", worksource.settings.name)
               worksource.start()
             except Exception as e:
-              self.core.log(self, "Could not start work source %s: %s\n" % (worksource.settings.name, traceback.format_exc()), 100, "yB")
+              self.core.log(self, "Could not start work source %s: %s\n", 100, "yB", worksource.settings.name, traceback.format_exc())
           self.children.append(worksource)
+          if self.started: self._add_entry(worksource)
 
     
   def remove_work_source(self, worksource):
@@ -105,11 +153,12 @@ class WorkSourceGroup(BaseWorkSource):
           worksource.set_parent()
           if self.started:
             try:
-              self.core.log(self, "Shutting down work source %s...\n" % (worksource.settings.name), 800)
+              self.core.log(self, "Shutting down work source %s...\n", 800, "", worksource.settings.name)
               worksource.stop()
             except Exception as e:
-              self.core.log(self, "Could not stop work source %s: %s\n" % (worksource.settings.name, traceback.format_exc()), 100, "yB")
+              self.core.log(self, "Could not stop work source %s: %s\n", 100, "yB", worksource.settings.name, traceback.format_exc())
           self.children.remove(worksource)
+          self._remove_entry(worksource)
         
         
   def _start(self):
@@ -117,91 +166,164 @@ class WorkSourceGroup(BaseWorkSource):
     with self.childlock:
       for worksource in self.children:
         try:
-          self.core.log(self, "Starting up work source %s...\n" % (worksource.settings.name), 800)
+          self.core.log(self, "Starting up work source %s...\n", 800, "", worksource.settings.name)
           worksource.start()
         except Exception as e:
-          self.core.log(self, "Could not start work source %s: %s\n" % (worksource.settings.name, traceback.format_exc()), 100, "yB")
+          self.core.log(self, "Could not start work source %s: %s\n", 100, "yB", worksource.settings.name, traceback.format_exc())
+        self._add_entry(worksource)
   
   
   def _stop(self):
     with self.childlock:
       for worksource in self.children:
         try:
-          self.core.log(self, "Shutting down work source %s...\n" % (worksource.settings.name), 800)
+          self.core.log(self, "Shutting down work source %s...\n", 800, "", worksource.settings.name)
           worksource.stop()
         except Exception as e:
-          self.core.log(self, "Could not stop work source %s: %s\n" % (worksource.settings.name, traceback.format_exc()), 100, "yB")
+          self.core.log(self, "Could not stop work source %s: %s\n", 100, "yB", worksource.settings.name, traceback.format_exc())
     super(WorkSourceGroup, self)._stop()
       
       
-  def _distribute_mhashes(self):
+  def _add_entry(self, worksource):
     with self.statelock:
-      now = time.time()
-      timestep = now - self.last_time
-      self.last_time = now
-      mhashes_remaining = 2**32 / 1000000. * self.settings.distribution_granularity
-      total_priority = 0
-      for child in self.children:
-        if child.settings.enabled:
-          with child.statelock:
-            total_priority += child.settings.priority
-            mhashes = timestep * child.settings.hashrate
-            child.mhashes_pending += mhashes + child.mhashes_deferred * 0.1
-            mhashes_remaining -= mhashes
-            child.mhashes_deferred *= 0.9
-      if mhashes_remaining > 0 and total_priority > 0:
-        unit = mhashes_remaining / total_priority
-        for child in self.children:
-          if child.settings.enabled:
-            with child.statelock:
-              mhashes = unit * child.settings.priority
-              child.mhashes_pending += mhashes
-              mhashes_remaining -= mhashes
-
-
-  def _get_start_index(self):
+      if worksource in self.entries: return
+      entry = FairShareEntry(worksource, time.time())
+      self.entries[worksource] = entry
+      self._make_ready(entry, entry.tokentime, True)
+
+
+  def _remove_entry(self, worksource):
     with self.statelock:
-      self.last_index += 1
-      if self.last_index >= len(self.children): self.last_index = 0
-      return self.last_index
+      entry = self.entries.pop(worksource, None)
+      if entry: entry.state = "removed"
+
+
+  def _refill(self, entry, now, hashrate):
+    entry.tokens = min(self.settings.distribution_granularity, entry.tokens + (now - entry.tokentime) * hashrate / self.jobmhashes)
+    entry.tokentime = now
+
+
+  def _make_ready(self, entry, now, rejoin = False):
+    # A child doesn't get to catch up on the time it wasn't ready. Refunds for
+    # stale jobs may put it behind the others after a charge though.
+    tier = 0 if entry.worksource.settings.priority > 0 else 1
+    if rejoin: entry.vtime = max(entry.vtime, self.vtimes[tier])
+    entry.state = "ready"
+    self.seq += 1
+    entry.seq = self.seq
+    heappush(self.runqueue, (tier, entry.vtime, self.seq, entry))
+    hashrate = entry.worksource.settings.hashrate
+    if hashrate > 0:
+      self._refill(entry, now, hashrate)
+      entry.reservationseq = self.seq
+      heappush(self.reservations, (now + max(0, 1 - entry.tokens) * self.jobmhashes / hashrate, self.seq, entry))
+
+
+  def _park(self, entry, now):
+    until = getattr(entry.worksource, "lockoutend", 0)
+    if until <= now: until = now + self.recheck_interval
+    entry.state = "parked"
+    self.seq += 1
+    entry.seq = self.seq
+    heappush(self.parked, (until, self.seq, entry))
+
+
+  def _next_entry(self, now):
+    # Returns the child that should be asked next, and whether that is because of its reserved hashrate.
+    # Heap items that don't match the entry's current state and sequence number are outdated and skipped.
+    while self.parked and self.parked[0][0] <= now:
+      until, seq, entry = heappop(self.parked)
+      if entry.seq == seq and entry.state == "parked": self._make_ready(entry, now, True)
+    while self.reservations and self.reservations[0][0] <= now:
+      due, seq, entry = heappop(self.reservations)
+      if entry.reservationseq != seq or entry.state != "ready": continue
+      hashrate = entry.worksource.settings.hashrate
+      if hashrate <= 0: continue
+      self._refill(entry, now, hashrate)
+      if entry.tokens >= 1:
+        entry.state = "busy"
+        return entry, True
+      heappush(self.reservations, (now + (1 - entry.tokens) * self.jobmhashes / hashrate, seq, entry))
+    while self.runqueue:
+      tier, vtime, seq, entry = heappop(self.runqueue)
+      if entry.seq != seq or entry.state != "ready": continue
+      self.vtimes[tier] = vtime
+      entry.state = "busy"
+      return entry, False
+    return None, False
+
+
+  def _get_recent_jobs(self, entry, now):
+    return entry.recentjobs * math.exp(min(0, entry.recenttime - now) / self.share_tau)
+
+
+  def _charge(self, entry, reserved, jobs):
+    worksource = entry.worksource
+    now = time.time()
+    entry.recentjobs = self._get_recent_jobs(entry, now) + jobs
+    entry.recenttime = now
+    if reserved: entry.tokens -= jobs
+    else:
+      priority = worksource.settings.priority
+      entry.vtime += jobs / float(priority) if priority > 0 else jobs
+    # Give back some of the work that was lost because jobs turned out to be stale. We're
+    # holding our statelock, so we can pass it on to our own parent without another lock.
+    refunded = worksource.take_refund(0.1)
+    if not refunded: return
+    self.mhashes_deferred += refunded
+    if worksource.settings.priority > 0: entry.vtime -= refunded / self.jobmhashes / worksource.settings.priority
       
       
-  def _start_fetcher(self, jobs, force = False):
-    with self.childlock:
-      children = [child for child in self.children]
-      startindex = self._get_start_index()
+  def _start_fetcher(self, jobs):
     best = False
-    found = False
-    iteration = 0
-    while not found:
-      index = startindex
-      first = True
-      while index != startindex or first:
-        worksource = children[index]
-        mhashes = 0
-        if not worksource.is_group: mhashes = 2**32 / 1000000.
-        if force or worksource.mhashes_pending >= mhashes:
-          found = True
-          if mhashes: worksource.add_pending_mhashes(-mhashes)
-          result, gotjobs = worksource.start_fetchers(1, jobs)
-          if result is not False:
-            if mhashes: worksource.add_pending_mhashes(mhashes)
-            if result: return result, gotjobs
+    tried = []
+    try:
+      while True:
+        with self.statelock: entry, reserved = self._next_entry(time.time())
+        if not entry: return best, 0
+        try: result, gotjobs = entry.worksource.start_fetchers(1, jobs)
+        except:
+          self.core.log(self, "Error while fetching job from %s: %s\n", 200, "y", entry.worksource.settings.name, traceback.format_exc())
+          result, gotjobs = False, 0
+        with self.statelock:
+          if entry.state != "busy": continue
+          if result:
+            self._charge(entry, reserved, max(1, gotjobs))
+            self._make_ready(entry, time.time())
+            return result, gotjobs
+          if result is False: self._park(entry, time.time())
+          else:
+            # The child is fine, but doesn't have any jobs right now. Try the next one.
             best = result
-        index += 1
-        if index >= len(children): index = 0
-        first = False
-      if not found: self._distribute_mhashes()
-      iteration += 1
-      if iteration > 150: break
-      if iteration > 100: force = True
-    return best, 0
+            tried.append(entry)
+    finally:
+      with self.statelock:
+        now = time.time()
+        for entry in tried:
+          if entry.state == "busy": self._make_ready(entry, now)
     
     
   def get_running_fetcher_count(self):
     data = [child.get_running_fetcher_count() for child in self.children]
     return sum(child[0] for child in data), sum(child[1] for child in data)
 
+
+  def get_fetch_latency(self):
+    # Jobs are consumed from the children in proportion to their recent share of the jobs,
+    # so the buffer needs to cover the latencies weighted by those shares. Until any jobs
+    # were handed out, all children that might be asked count the same.
+    if not self.started or not self.settings.enabled: return None
+    now = time.time()
+    with self.statelock: shares = dict((worksource, self._get_recent_jobs(entry, now)) for worksource, entry in self.entries.items())
+    latencies = []
+    for child in self.children:
+      latency = child.get_fetch_latency()
+      if latency is not None: latencies.append((latency, shares.get(child, 0)))
+    if not latencies: return None
+    total = sum(share for latency, share in latencies)
+    if not total: return sum(latency for latency, share in latencies) / len(latencies)
+    return sum(latency * share for latency, share in latencies) / total
+
     
   def start_fetchers(self, count, jobs):
     if not self.started or not self.settings.enabled or not self.children or not count: return False, 0
@@ -209,8 +331,7 @@ class WorkSourceGroup(BaseWorkSource):
     result = False
     totaljobs = 0
     while started < count and totaljobs < jobs:
-      result, newjobs = self._start_fetcher(jobs)
-      if not result: result, newjobs = self._start_fetcher(jobs, True)
+      result, newjobs = self._start_fetcher(jobs - totaljobs)
       if not result: break
       started += result
       totaljobs += newjobs
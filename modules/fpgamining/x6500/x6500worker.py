@@ -210,7 +210,7 @@ class X6500Worker(BaseWorker):
         
         while not self.shutdown:
           data = self.rxconn.recv()
-          if data[0] == "log": self.core.log(self, "Proxy: %s" % data[1], data[2], data[3])
+          if data[0] == "log": self.core.log(self, "Proxy: %s", data[2], data[3], data[1])
           elif data[0] == "ping": self._proxy_message("pong")
           elif data[0] == "pong": pass
           elif data[0] == "dying": raise Exception("Proxy died!")
@@ -224,7 +224,7 @@ class X6500Worker(BaseWorker):
       # If something went wrong...
       except Exception as e:
         # ...complain about it!
-        self.core.log(self, "%s\n" % traceback.format_exc(), 100, "rB")
+        self.core.log(self, "%s\n", 100, "rB", traceback.format_exc())
       finally:
         try:
           for i in range(100): self.response_queue.put(None)
@@ -461,17 +461,19 @@ class X6500FPGA(BaseWorker):
         # This usually means that the wakeup timeout has expired.
         if not self.checksuccess: raise Exception("Timeout waiting for validation job to finish")
         # self.stats.mhps has now been populated by the listener thread
-        self.core.log(self, "Running at %f MH/s\n" % self.stats.mhps, 300, "B")
+        self.core.log(self, "Running at %f MH/s\n", 300, "B", self.stats.mhps)
         self._update_job_interval()
 
         # Main loop, continues until something goes wrong or we're shutting down.
         while not self.shutdown:
 
           # Fetch a job, add 2 seconds safety margin to the requested minimum expiration time.
-          # Blocks until one is available. Because of this we need to release the
+          # The next job is reserved for us in the background while we work on this one,
+          # so this will usually return immediately, but it might still block until one
+          # is available. Because of this we need to release the
           # wakeup lock temporarily in order to avoid possible deadlocks.
           self.wakeup.release()
-          job = self.core.get_job(self, self.jobinterval + 2)
+          job = self.core.get_job(self, self.jobinterval + 2, prefetch = True)
           self.wakeup.acquire()
           
           # If a new block was found while we were fetching that job, just discard it and get a new one.
@@ -497,10 +499,12 @@ class X6500FPGA(BaseWorker):
       # If something went wrong...
       except Exception as e:
         # ...complain about it!
-        self.core.log(self, "%s\n" % traceback.format_exc(), 100, "rB")
+        self.core.log(self, "%s\n", 100, "rB", traceback.format_exc())
       finally:
         # We're not doing productive work any more, update stats and destroy current job
         self._jobend()
+        # Hand back the job that was reserved for us, someone else might need it
+        self.core.cancel_prefetch(self)
         self.stats.mhps = 0
         try: self.wakeup.release()
         except: pass
@@ -659,7 +663,7 @@ class X6500FPGA(BaseWorker):
     speed = min(max(speed, 4), self.parent.settings.maximumspeed)
     if self.stats.speed == speed: return
     if speed == self.parent.settings.maximumspeed: self.initialramp = False
-    self.core.log(self, "%s: Setting clock speed to %.2f MHz...\n" % ("Warmup" if self.initialramp else "Tracking", speed), 500, "B")
+    self.core.log(self, "%s: Setting clock speed to %.2f MHz...\n", 500, "B", "Warmup" if self.initialramp else "Tracking", speed)
     self.parent.set_speed(self.fpga, speed)
     self.stats.speed = self.parent.get_speed(self.fpga)
     self.stats.mhps = self.stats.speed
@@ -676,7 +680,7 @@ class X6500FPGA(BaseWorker):
     interval = min(60, 2**32 / 1000000. / self.stats.mhps)
     # Add some safety margin and take user's interval setting (if present) into account.
     self.jobinterval = min(self.parent.settings.jobinterval, max(0.5, interval * 0.8 - 1))
-    self.core.log(self, "Job interval: %f seconds\n" % self.jobinterval, 400, "B")
+    self.core.log(self, "Job interval: %f seconds\n", 400, "B", self.jobinterval)
     # Tell the MPBM core that our hash rate has changed, so that it can adjust its work buffer.
     self.jobs_per_second = 1. / self.jobinterval
     self.core.notify_speed_changed(self)
@@ -57,6 +57,10 @@ class LogFileLogger(BaseFrontend):
     if self.started and self.settings.filename != self.filename: self.async_restart()
     
   
+  def get_log_level(self):
+    return self.settings.loglevel
+    
+  
   def _start(self):
     super(LogFileLogger, self)._start()
     self.filename = self.settings.filename
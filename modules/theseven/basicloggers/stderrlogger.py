@@ -59,6 +59,10 @@ class StderrLogger(BaseFrontend):
     if not "useansi" in self.settings: self.settings.useansi = "TERM" in os.environ
     
   
+  def get_log_level(self):
+    return self.settings.loglevel
+    
+  
   def _start(self):
     super(StderrLogger, self)._start()
 
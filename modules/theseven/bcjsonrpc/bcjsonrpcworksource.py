@@ -28,15 +28,12 @@
 
 import time
 import json
-import struct
 import base64
 import traceback
 from binascii import hexlify, unhexlify
 from threading import Thread, RLock, Condition
 from core.actualworksource import ActualWorkSource
-from core.job import Job
-try: from queue import Queue
-except: from Queue import Queue
+from core.job import Job, JobTemplate
 try: import http.client as http_client
 except ImportError: import httplib as http_client
 
@@ -71,8 +68,8 @@ class BCJSONRPCWorkSource(ActualWorkSource):
     self.fetcherspending = 0
     self.fetcherjobsrunning = 0
     self.fetcherjobspending = 0
-    self.uploadqueue = Queue()
-    self.uploaderthreads = []
+    self.uploadlock = RLock()
+    self.uploadconns = []
     super(BCJSONRPCWorkSource, self).__init__(core, state)
     self.extensions = "longpoll midstate rollntime"
     self.runcycle = 0
@@ -121,8 +118,7 @@ class BCJSONRPCWorkSource(ActualWorkSource):
     self.fetcherjobsrunning = 0
     self.fetcherjobspending = 0
     self.fetcherthreads = []
-    self.uploadqueue = Queue()
-    self.uploaderthreads = []
+    self._close_upload_connections()
     self.lastidentifier = None
     self.jobepoch = 0
     self.lpepoch = 0
@@ -134,6 +130,7 @@ class BCJSONRPCWorkSource(ActualWorkSource):
     self.port = self.settings.port
     self.getworkconnections = self.settings.getworkconnections
     self.uploadconnections = self.settings.uploadconnections
+    self.submit_concurrency = max(1, self.uploadconnections)
     self.longpollconnections = self.settings.longpollconnections
     if not self.settings.host or not self.settings.port: return
     self.shutdown = False
@@ -142,11 +139,6 @@ class BCJSONRPCWorkSource(ActualWorkSource):
       thread.daemon = True
       thread.start()
       self.fetcherthreads.append(thread)
-    for i in range(self.uploadconnections):
-      thread = Thread(None, self.uploader, "%s_uploader_%d" % (self.settings.name, i))
-      thread.daemon = True
-      thread.start()
-      self.uploaderthreads.append(thread)
     
     
   def _stop(self):
@@ -154,9 +146,16 @@ class BCJSONRPCWorkSource(ActualWorkSource):
     self.shutdown = True
     with self.fetcherlock: self.fetcherlock.notify_all()
     for thread in self.fetcherthreads: thread.join(1)
-    for i in self.uploaderthreads: self.uploadqueue.put(None)
-    for thread in self.uploaderthreads: thread.join(1)
+    self._close_upload_connections()
     super(BCJSONRPCWorkSource, self)._stop()
+
+
+  def _close_upload_connections(self):
+    with self.uploadlock:
+      for conn in self.uploadconns:
+        try: conn.close()
+        except: pass
+      self.uploadconns = []
     
     
   def _get_statistics(self, stats, childstats):
@@ -168,7 +167,7 @@ class BCJSONRPCWorkSource(ActualWorkSource):
     return self.fetchersrunning, self.fetcherjobsrunning + self.fetcherjobspending
   
   
-  def _start_fetcher(self):
+  def _start_fetcher(self, jobs):
     count = len(self.fetcherthreads)
     if not count: return False, 0
     with self.fetcherlock:
@@ -220,6 +219,7 @@ class BCJSONRPCWorkSource(ActualWorkSource):
         except:
           conn = None
           raise
+        self._handle_fetch_latency(time.time() - now)
         with self.statelock:
           if not self.settings.longpollconnections: self.signals_new_block = False
           else:
@@ -241,7 +241,7 @@ class BCJSONRPCWorkSource(ActualWorkSource):
                   if len(parts) != 2: raise Exception("Long poll URL contains host but no port!")
                   host = parts[0]
                   port = int(parts[1])
-                  self.core.log(self, "Found long polling URL: %s\n" % (url), 500, "g")
+                  self.core.log(self, "Found long polling URL: %s\n", 500, "g", url)
                   self.signals_new_block = True
                   self.runcycle += 1
                   for i in range(self.settings.longpollconnections):
@@ -249,14 +249,14 @@ class BCJSONRPCWorkSource(ActualWorkSource):
                     thread.daemon = True
                     thread.start()
                 except Exception as e:
-                  self.core.log(self, "Invalid long polling URL: %s (%s)\n" % (url, str(e)), 200, "y")
+                  self.core.log(self, "Invalid long polling URL: %s (%s)\n", 200, "y", url, str(e))
                 break
             if self.signals_new_block and not lpfound:
               self.runcycle += 1
               self.signals_new_block = False
         jobs = self._build_jobs(response, data, epoch, now, "getwork")
       except:
-        self.core.log(self, "Error while fetching job: %s\n" % (traceback.format_exc()), 200, "y")
+        self.core.log(self, "Error while fetching job: %s\n", 200, "y", traceback.format_exc())
         self._handle_error()
       finally:
         with self.fetcherlock:
@@ -264,62 +264,55 @@ class BCJSONRPCWorkSource(ActualWorkSource):
           self.fetcherjobsrunning -= myjobs
       if jobs:
         self._push_jobs(jobs, "getwork response")
+      # A fetcher slot is free again, let the controller decide if it needs more jobs
+      self.core.fetcher.wakeup()
         
         
-  def nonce_found(self, job, data, nonce, noncediff):
-    self.uploadqueue.put((job, data, nonce, noncediff))
-      
-      
-  def uploader(self):
-    conn = None
-    while not self.shutdown:
-      share = self.uploadqueue.get()
-      if not share: continue
-      job, data, nonce, noncediff = share
-      tries = 0
-      while True:
-        try:
-          req = json.dumps({"method": "getwork", "params": [hexlify(data).decode("ascii")], "id": 0}).encode("utf_8")
-          headers = {"User-Agent": self.useragent, "X-Mining-Extensions": self.extensions,
-                     "Content-Type": "application/json", "Content-Length": len(req)}
-          if self.auth != None: headers["Authorization"] = self.auth
-          try:
-            if conn:
-              try:
-                conn.request("POST", self.settings.path, req, headers)
-                response = conn.getresponse()
-              except:
-                conn = None
-                self.core.log(self, "Keep-alive share upload connection died\n", 500)
-            if not conn:
-              conn = http_client.HTTPConnection(self.settings.host, self.settings.port, True, self.settings.sendsharetimeout)
-              conn.request("POST", self.settings.path, req, headers)
-              response = conn.getresponse()
-            rdata = response.read()
-          except:
-            conn = None
-            raise
-          rdata = json.loads(rdata.decode("utf_8"))
-          result = False
-          if rdata["result"] == True: result = True
-          elif rdata["error"] != None: result =  rdata["error"]
-          else:
-            headers = response.getheaders()
-            for h in headers:
-              if h[0].lower() == "x-reject-reason":
-                result = h[1]
-                break
-          if result is not True:
-            self.jobepoch += 1
-            self._cancel_jobs(True)
-          self._handle_success()
-          job.nonce_handled_callback(nonce, noncediff, result)
+  def _nonce_found(self, job, data, nonce, noncediff):
+    with self.uploadlock: conn = self.uploadconns.pop() if self.uploadconns else None
+    req = json.dumps({"method": "getwork", "params": [hexlify(data).decode("ascii")], "id": 0}).encode("utf_8")
+    headers = {"User-Agent": self.useragent, "X-Mining-Extensions": self.extensions,
+               "Content-Type": "application/json", "Content-Length": len(req)}
+    if self.auth != None: headers["Authorization"] = self.auth
+    if conn:
+      try:
+        conn.request("POST", self.settings.path, req, headers)
+        response = conn.getresponse()
+        rdata = response.read()
+      except:
+        try: conn.close()
+        except: pass
+        conn = None
+        self.core.log(self, "Keep-alive share upload connection died\n", 500)
+    if not conn:
+      conn = http_client.HTTPConnection(self.settings.host, self.settings.port, True, self.settings.sendsharetimeout)
+      try:
+        conn.request("POST", self.settings.path, req, headers)
+        response = conn.getresponse()
+        rdata = response.read()
+      except:
+        # The submitter will retry, don't leave the socket behind
+        try: conn.close()
+        except: pass
+        raise
+    # The connection is still good, keep it for the next share
+    with self.uploadlock:
+      if self.shutdown: conn.close()
+      else: self.uploadconns.append(conn)
+    rdata = json.loads(rdata.decode("utf_8"))
+    result = False
+    if rdata["result"] == True: result = True
+    elif rdata["error"] != None: result =  rdata["error"]
+    else:
+      headers = response.getheaders()
+      for h in headers:
+        if h[0].lower() == "x-reject-reason":
+          result = h[1]
           break
-        except:
-          self.core.log(self, "Error while sending share %s (difficulty %.5f): %s\n" % (hexlify(nonce).decode("ascii"), noncediff, traceback.format_exc()), 200, "y")
-          tries += 1
-          self._handle_error(True)
-          time.sleep(min(30, tries))
+    if result is not True:
+      self.jobepoch += 1
+      self._cancel_jobs(True)
+    return result
 
 
   def _longpollingworker(self, host, port, path):
@@ -359,7 +352,7 @@ class BCJSONRPCWorkSource(ActualWorkSource):
         self._push_jobs(jobs, "long poll response")
       except:
         conn = None
-        self.core.log(self, "Long poll failed: %s\n" % (traceback.format_exc()), 200, "y")
+        self.core.log(self, "Long poll failed: %s\n", 200, "y", traceback.format_exc())
         tries += 1
         if time.time() - starttime >= 60: tries = 0
         if tries > 5: time.sleep(30)
@@ -370,7 +363,7 @@ class BCJSONRPCWorkSource(ActualWorkSource):
   def _build_jobs(self, response, data, epoch, now, source, ignoreempty = False, discardiffull = False):
     decoded = data.decode("utf_8")
     if len(decoded) == 0 and ignoreempty:
-      self.core.log(self, "Got empty %s response\n" % source, 500)
+      self.core.log(self, "Got empty %s response\n", 500, "", source)
       return
     decoded = json.loads(decoded)
     data = unhexlify(decoded["result"]["data"].encode("ascii"))
@@ -397,17 +390,21 @@ class BCJSONRPCWorkSource(ActualWorkSource):
     if isp2pool: expiry = 60
     self.stats.supports_rollntime = roll_ntime > 1
     if epoch != self.jobepoch:
-      self.core.log(self, "Discarding %d jobs from %s response because request was issued before flush\n" % (roll_ntime, source), 500)
-      with self.stats.lock: self.stats.jobsreceived += roll_ntime
+      self.core.log(self, "Discarding %d jobs from %s response because request was issued before flush\n", 500, "", roll_ntime, source)
+      with self.stats.lock:
+        self.stats.jobsreceived += roll_ntime
+        self.stats.fetchesdiscarded += 1
+        self.stats.jobsdiscarded += roll_ntime
       return
     if self.core.workqueue.count > self.core.workqueue.target * (1 if discardiffull else 5):
-      self.core.log(self, "Discarding %d jobs from %s response because work buffer is full\n" % (roll_ntime, source), 500)
-      with self.stats.lock: self.stats.jobsreceived += roll_ntime
+      self.core.log(self, "Discarding %d jobs from %s response because work buffer is full\n", 500, "", roll_ntime, source)
+      with self.stats.lock:
+        self.stats.jobsreceived += roll_ntime
+        self.stats.fetchesdiscarded += 1
+        self.stats.jobsdiscarded += roll_ntime
       return
     expiry += now - self.settings.expirymargin
-    midstate = Job.calculate_midstate(data)
-    prefix = data[:68]
-    timebase = struct.unpack(">I", data[68:72])[0]
-    suffix = data[72:]
-    return [Job(self.core, self, expiry, prefix + struct.pack(">I", timebase + i) + suffix, target, midstate, identifier) for i in range(roll_ntime)]
+    if roll_ntime == 1: return [Job(self.core, self, expiry, data, target, None, identifier)]
+    # The rolled jobs are only created once a worker takes them from the work queue
+    return [JobTemplate(self.core, self, expiry, data, target, roll_ntime, None, identifier)]
   
\ No newline at end of file
@@ -162,16 +162,18 @@ class BFLSingleWorker(BaseWorker):
         response = self.handle.readline()
         if response[:31] != b">>>ID: BitFORCE SHA256 Version " or response[-4:] != b">>>\n":
           raise Exception("Bad ZGX response: %s\n" % response.decode("ascii", "replace").strip())
-        self.core.log(self, "Firmware: %s\n" % (response[7:-4].decode("ascii", "replace")), 400, "B")
+        self.core.log(self, "Firmware: %s\n", 400, "B", response[7:-4].decode("ascii", "replace"))
 
         # Main loop, continues until something goes wrong or we're shutting down.
         while not self.shutdown:
 
           # Fetch a job, add 2 seconds safety margin to the requested minimum expiration time.
-          # Blocks until one is available. Because of this we need to release the
+          # The next job is reserved for us in the background while we work on this one,
+          # so this will usually return immediately, but it might still block until one
+          # is available. Because of this we need to release the
           # wakeup lock temporarily in order to avoid possible deadlocks.
           self.wakeup.release()
-          job = self.core.get_job(self, self.jobinterval + 2)
+          job = self.core.get_job(self, self.jobinterval + 2, prefetch = True)
           self.wakeup.acquire()
           
           # If a new block was found while we were fetching that job, just discard it and get a new one.
@@ -241,10 +243,12 @@ class BFLSingleWorker(BaseWorker):
       # If something went wrong...
       except Exception as e:
         # ...complain about it!
-        self.core.log(self, "%s\n" % traceback.format_exc(), 100, "rB")
+        self.core.log(self, "%s\n", 100, "rB", traceback.format_exc())
       finally:
         # We're not doing productive work any more, update stats and destroy current job
         self._jobend()
+        # Hand back the job that was reserved for us, someone else might need it
+        self.core.cancel_prefetch(self)
         self.stats.mhps = 0
         try: self.wakeup.release()
         except: pass
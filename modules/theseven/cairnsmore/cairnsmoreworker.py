@@ -232,10 +232,12 @@ class CairnsmoreWorker(BaseWorker):
         while not self.shutdown:
 
           # Fetch a job, add 2 seconds safety margin to the requested minimum expiration time.
-          # Blocks until one is available. Because of this we need to release the
+          # The next job is reserved for us in the background while we work on this one,
+          # so this will usually return immediately, but it might still block until one
+          # is available. Because of this we need to release the
           # wakeup lock temporarily in order to avoid possible deadlocks.
           self.wakeup.release()
-          job = self.core.get_job(self, self.jobinterval + 2)
+          job = self.core.get_job(self, self.jobinterval + 2, prefetch = True)
           self.wakeup.acquire()
 
           # If the job could be interpreted as a command, ignore it.
@@ -272,12 +274,14 @@ class CairnsmoreWorker(BaseWorker):
       # If something went wrong...
       except Exception as e:
         # ...complain about it!
-        self.core.log(self, "%s\n" % traceback.format_exc(), 100, "rB")
+        self.core.log(self, "%s\n", 100, "rB", traceback.format_exc())
         # Make sure that the listener thread realizes that something went wrong
         self.error = e
       finally:
         # We're not doing productive work any more, update stats and destroy current job
         self._jobend()
+        # Hand back the job that was reserved for us, someone else might need it
+        self.core.cancel_prefetch(self)
         self.stats.mhps = 0
         # Release the wake lock to allow the listener thread to move. Ignore it if that goes wrong.
         try: self.wakeup.release()
@@ -373,7 +377,7 @@ class CairnsmoreWorker(BaseWorker):
     # If an exception is thrown in the listener thread...
     except Exception as e:
       # ...complain about it...
-      self.core.log(self, "%s\n" % traceback.format_exc(), 100, "rB")
+      self.core.log(self, "%s\n", 100, "rB", traceback.format_exc())
       # ...put it into the exception container...
       self.error = e
       # ...wake up the main thread...
@@ -453,7 +457,7 @@ class CairnsmoreWorker(BaseWorker):
     speed = min(max(speed, 2), self.settings.maximumspeed // 2.5)
     if self.speed == speed: return
     if speed == self.settings.maximumspeed // 2.5: self.initialramp = False
-    self.core.log(self, "%s: Setting clock speed to %.2f MHz...\n" % ("Warmup" if self.initialramp else "Tracking", speed * 2.5), 500, "B")
+    self.core.log(self, "%s: Setting clock speed to %.2f MHz...\n", 500, "B", "Warmup" if self.initialramp else "Tracking", speed * 2.5)
     command_id = 0
     command_data = int(speed)
     command_prefix = 0b10110111
@@ -474,7 +478,7 @@ class CairnsmoreWorker(BaseWorker):
     interval = min(60, 2**32 / 1000000. / self.stats.mhps)
     # Add some safety margin and take user's interval setting (if present) into account.
     self.jobinterval = min(self.settings.jobinterval, max(0.5, interval * 0.8 - 1))
-    self.core.log(self, "Job interval: %f seconds\n" % self.jobinterval, 400, "B")
+    self.core.log(self, "Job interval: %f seconds\n", 400, "B", self.jobinterval)
     # Tell the MPBM core that our hash rate has changed, so that it can adjust its work buffer.
     self.jobs_per_second = 1. / self.jobinterval
     self.core.notify_speed_changed(self)
@@ -188,10 +188,10 @@ class FTDIJTAGHotplugWorker(BaseWorker):
     while self.children:
       child = self.children.pop(0)
       try:
-        self.core.log(self, "Shutting down worker %s...\n" % (child.settings.name), 800)
+        self.core.log(self, "Shutting down worker %s...\n", 800, "", child.settings.name)
         child.stop()
       except Exception as e:
-        self.core.log(self, "Could not stop worker %s: %s\n" % (child.settings.name, traceback.format_exc()), 100, "rB")
+        self.core.log(self, "Could not stop worker %s: %s\n", 100, "rB", child.settings.name, traceback.format_exc())
 
       
   # Main thread entry point
@@ -242,10 +242,10 @@ class FTDIJTAGHotplugWorker(BaseWorker):
             
         for serial, child in kill:
           try:
-            self.core.log(self, "Shutting down worker %s...\n" % (child.settings.name), 800)
+            self.core.log(self, "Shutting down worker %s...\n", 800, "", child.settings.name)
             child.stop()
           except Exception as e:
-            self.core.log(self, "Could not stop worker %s: %s\n" % (child.settings.name, traceback.format_exc()), 100, "rB")
+            self.core.log(self, "Could not stop worker %s: %s\n", 100, "rB", child.settings.name, traceback.format_exc())
           childstats = child.get_statistics()
           fields = ["ghashes", "jobsaccepted", "jobscanceled", "sharesaccepted", "sharesrejected", "sharesinvalid"]
           for field in fields: self.stats[field] += childstats[field]
@@ -292,11 +292,11 @@ class FTDIJTAGHotplugWorker(BaseWorker):
             self.childmap[serial] = child
             self.children.append(child)
             try:
-              self.core.log(self, "Starting up worker %s...\n" % (child.settings.name), 800)
+              self.core.log(self, "Starting up worker %s...\n", 800, "", child.settings.name)
               child.start()
             except Exception as e:
-              self.core.log(self, "Could not start worker %s: %s\n" % (child.settings.name, traceback.format_exc()), 100, "rB")
+              self.core.log(self, "Could not start worker %s: %s\n", 100, "rB", child.settings.name, traceback.format_exc())
               
-      except: self.core.log(self, "Caught exception: %s\n" % traceback.format_exc(), 100, "rB")
+      except: self.core.log(self, "Caught exception: %s\n", 100, "rB", traceback.format_exc())
           
       with self.wakeup: self.wakeup.wait(self.settings.scaninterval)
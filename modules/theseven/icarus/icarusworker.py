@@ -202,14 +202,14 @@ class IcarusWorker(BaseWorker):
         # This usually means that the wakeup timeout has expired.
         if not self.checksuccess: raise Exception("Timeout waiting for validation job to finish")
         # self.stats.mhps has now been populated by the listener thread
-        self.core.log(self, "Running at %f MH/s\n" % self.stats.mhps, 300, "B")
+        self.core.log(self, "Running at %f MH/s\n", 300, "B", self.stats.mhps)
         # Calculate the time that the device will need to process 2**32 nonces.
         # This is limited at 60 seconds in order to have some regular communication,
         # even with very slow devices (and e.g. detect if the device was unplugged).
         interval = min(60, 2**32 / 1000000. / self.stats.mhps)
         # Add some safety margin and take user's interval setting (if present) into account.
         self.jobinterval = min(self.settings.jobinterval, max(0.5, interval * 0.8 - 1))
-        self.core.log(self, "Job interval: %f seconds\n" % self.jobinterval, 400, "B")
+        self.core.log(self, "Job interval: %f seconds\n", 400, "B", self.jobinterval)
         # Tell the MPBM core that our hash rate has changed, so that it can adjust its work buffer.
         self.jobspersecond = 1. / self.jobinterval
         self.core.notify_speed_changed(self)
@@ -218,10 +218,12 @@ class IcarusWorker(BaseWorker):
         while not self.shutdown:
 
           # Fetch a job, add 2 seconds safety margin to the requested minimum expiration time.
-          # Blocks until one is available. Because of this we need to release the
+          # The next job is reserved for us in the background while we work on this one,
+          # so this will usually return immediately, but it might still block until one
+          # is available. Because of this we need to release the
           # wakeup lock temporarily in order to avoid possible deadlocks.
           self.wakeup.release()
-          job = self.core.get_job(self, self.jobinterval + 2)
+          job = self.core.get_job(self, self.jobinterval + 2, prefetch = True)
           self.wakeup.acquire()
           
           # If a new block was found while we were fetching that job, just discard it and get a new one.
@@ -250,12 +252,14 @@ class IcarusWorker(BaseWorker):
       # If something went wrong...
       except Exception as e:
         # ...complain about it!
-        self.core.log(self, "%s\n" % traceback.format_exc(), 100, "rB")
+        self.core.log(self, "%s\n", 100, "rB", traceback.format_exc())
         # Make sure that the listener thread realizes that something went wrong
         self.error = e
       finally:
         # We're not doing productive work any more, update stats and destroy current job
         self._jobend()
+        # Hand back the job that was reserved for us, someone else might need it
+        self.core.cancel_prefetch(self)
         self.stats.mhps = 0
         # Release the wake lock to allow the listener thread to move. Ignore it if that goes wrong.
         try: self.wakeup.release()
@@ -346,7 +350,7 @@ class IcarusWorker(BaseWorker):
     # If an exception is thrown in the listener thread...
     except Exception as e:
       # ...complain about it...
-      self.core.log(self, "%s\n" % traceback.format_exc(), 100, "rB")
+      self.core.log(self, "%s\n", 100, "rB", traceback.format_exc())
       # ...put it into the exception container...
       self.error = e
       # ...wake up the main thread...
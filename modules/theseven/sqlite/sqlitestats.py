@@ -27,15 +27,99 @@
 
 
 import os
+import math
 import time
+import struct
 import numbers
 import sqlite3
+import traceback
+from collections import deque
 from threading import RLock, Condition, Thread
 from core.basefrontend import BaseFrontend
+from core.eventbus import EventSubscription
 from core.statistics import Statistics
 
 
 
+# Records in the write queue are tuples, their first element is one of these
+_LOG = 0
+_EVENT = 1
+_STATS = 2
+
+# Rollup resolutions (seconds), and how many buckets of them are aggregated per maintenance step
+rollup_resolutions = ((60, 60), (3600, 24), (86400, 7))
+
+
+
+# Statistics samples (schema version 3) store all numeric fields of one object in a
+# single row. The data blob holds n little endian statcolumn ids followed by n doubles.
+def pack_sample(fields):
+  count = len(fields)
+  return struct.pack("<%dH%dd" % (count, count), *([column for column, value in fields] + [value for column, value in fields]))
+
+
+def unpack_sample(data):
+  count = len(data) // 10
+  values = struct.unpack("<%dH%dd" % (count, count), data)
+  return zip(values[:count], values[count:])
+
+
+
+# Rollups store avg, min, max and last for every column, so the data blob holds
+# n column ids followed by n times four doubles. Rollups of a single sample
+# (e.g. 1 minute rollups of samples taken every minute) use the sample format.
+def pack_rollup(fields):
+  count = len(fields)
+  values = []
+  for column, data in fields: values.extend(data)
+  return struct.pack("<%dH%dd" % (count, 4 * count), *([column for column, data in fields] + values))
+
+
+def unpack_rollup(data, samples):
+  if samples == 1: return [(column, (value, value, value, value)) for column, value in unpack_sample(data)]
+  count = len(data) // 34
+  values = struct.unpack("<%dH%dd" % (count, 4 * count), data)
+  return [(values[i], values[count + 4 * i : count + 4 * i + 4]) for i in range(count)]
+
+
+
+def accumulate_fields(aggregate, fields, samples, columns = None):
+  # Adds (column, (avg, min, max, last)) tuples that stand for samples samples to an aggregate,
+  # which maps column ids to [weighted sum, samples, min, max, last]. Fields have to be added
+  # in timestamp order. If columns is given, all other columns are ignored.
+  for column, (avg, minimum, maximum, last) in fields:
+    if columns is not None and column not in columns: continue
+    field = aggregate.get(column)
+    if field:
+      field[0] += avg * samples
+      field[1] += samples
+      if minimum < field[2]: field[2] = minimum
+      if maximum > field[3]: field[3] = maximum
+      field[4] = last
+    else: aggregate[column] = [avg * samples, samples, minimum, maximum, last]
+
+
+def finish_field(field):
+  total, count, minimum, maximum, last = field
+  return (total / count, minimum, maximum, last)
+
+
+
+# Log messages, events and statistics are put into a write queue by the delivering
+# threads, and written to the database by a dedicated writer thread. The writer
+# collects up to batchsize records (or whatever arrived within flushinterval
+# seconds), and writes them in one transaction with one executemany per table.
+# To make that possible, row ids of the log, job and statrow tables are assigned
+# by the writer instead of being read back from every single insert.
+# If the write queue is full, log messages and events are either dropped or the
+# delivering thread has to wait (which will make the delivery queue of this
+# frontend overflow instead, according to its overflow policy). Statistics are
+# always accepted.
+# Whenever the write queue is empty, the writer thread does database maintenance
+# in small steps: migrating the statistics of old databases, aggregating samples
+# into 1 minute, 1 hour and 1 day rollups, and deleting data that is older than
+# its retention time. Every step is its own short transaction, so incoming
+# records never have to wait for long.
 class SQLiteStats(BaseFrontend):
 
   version = "theseven.sqlite statistics logger v0.1.0"
@@ -48,6 +132,22 @@ class SQLiteStats(BaseFrontend):
     "loglevel": {"title": "Log level", "type": "int", "position": 2000},
     "eventlevel": {"title": "Event filter level", "type": "int", "position": 2100},
     "statinterval": {"title": "Statistics logging interval", "type": "int", "position": 3000},
+    "writequeuelength": {"title": "Write queue length", "type": "int", "position": 4000},
+    "writepolicy": {
+      "title": "Write queue overflow policy",
+      "type": "enum",
+      "values": [
+        {"value": "block", "title": "Wait for the database"},
+        {"value": "drop", "title": "Drop log messages and events"},
+      ],
+      "position": 4010,
+    },
+    "batchsize": {"title": "Maximum records per transaction", "type": "int", "position": 4100},
+    "flushinterval": {"title": "Maximum write delay (seconds)", "type": "float", "position": 4110},
+    "rawretention": {"title": "Keep statistics samples for (days, 0 = forever)", "type": "float", "position": 5000},
+    "minuteretention": {"title": "Keep 1 minute rollups for (days, 0 = forever)", "type": "float", "position": 5010},
+    "hourretention": {"title": "Keep 1 hour rollups for (days, 0 = forever)", "type": "float", "position": 5020},
+    "dayretention": {"title": "Keep 1 day rollups for (days, 0 = forever)", "type": "float", "position": 5030},
   })
 
 
@@ -56,6 +156,11 @@ class SQLiteStats(BaseFrontend):
     self.lock = RLock()
     self.conn = None
     self.statwakeup = Condition()
+    self.writelock = Condition()
+    # Read connections for statistics queries, and recent query results
+    self.readerlock = RLock()
+    self.readers = []
+    self.querycache = {}
 
 
   def apply_settings(self):
@@ -66,10 +171,27 @@ class SQLiteStats(BaseFrontend):
     if not "statinterval" in self.settings: self.settings.statinterval = 60
     if not "worksourceinterval" in self.settings: self.settings.worksourceinterval = 60
     if not "blockchaininterval" in self.settings: self.settings.blockchaininterval = 60
+    if not "writequeuelength" in self.settings or self.settings.writequeuelength < 1: self.settings.writequeuelength = 100000
+    if not "writepolicy" in self.settings or self.settings.writepolicy not in ("block", "drop"): self.settings.writepolicy = "block"
+    if not "batchsize" in self.settings or self.settings.batchsize < 1: self.settings.batchsize = 5000
+    if not "flushinterval" in self.settings or self.settings.flushinterval < 0: self.settings.flushinterval = 1.
+    if not "rawretention" in self.settings: self.settings.rawretention = 7
+    if not "minuteretention" in self.settings: self.settings.minuteretention = 60
+    if not "hourretention" in self.settings: self.settings.hourretention = 730
+    if not "dayretention" in self.settings: self.settings.dayretention = 0
     if self.started:
       if self.settings.filename != self.filename: self.async_restart()
       else:
         with self.statwakeup: self.statwakeup.notify()
+        with self.writelock: self.writelock.notify_all()
+
+
+  def get_log_level(self):
+    return self.settings.loglevel
+
+
+  def get_event_subscriptions(self):
+    return [EventSubscription(level = self.settings.eventlevel)]
 
 
   def _start(self):
@@ -80,9 +202,30 @@ class SQLiteStats(BaseFrontend):
       self.db = sqlite3.connect(self.filename, check_same_thread = False)
       self.db.text_factory = str
       self.cursor = self.db.cursor()
+      # Readers don't block the writer in WAL mode, and a commit doesn't need to wait
+      # for the disk. A crash can only lose the last few transactions.
+      self.cursor.execute("PRAGMA journal_mode = WAL")
+      self.cursor.execute("PRAGMA synchronous = NORMAL")
+      self.cursor.execute("PRAGMA temp_store = MEMORY")
+      self.cursor.execute("PRAGMA cache_size = -16384")
       self._check_schema()
       self.eventtypes = {}
       self.statcolumns = {}
+      self.nextids = {}
+      for table in ("log", "job"):
+        self.cursor.execute("SELECT MAX([id]) FROM [%s]" % table)
+        self.nextids[table] = (self.cursor.fetchone()[0] or 0) + 1
+      # Ids that were cached during the current batch, and need to be forgotten if it fails
+      self.newids = []
+      self.maintenance = None
+      self.nextmaintenance = 0
+      self.writequeue = deque()
+      self.writedeadline = 0
+      self.writesdropped = 0
+      self.writerlogging = False
+      self.writethread = Thread(None, self._writeloop, "%s_writethread" % self.settings.name)
+      self.writethread.daemon = True
+      self.writethread.start()
       self.statthread = Thread(None, self._statloop, "%s_statthread" % self.settings.name)
       self.statthread.daemon = True
       self.statthread.start()
@@ -92,45 +235,135 @@ class SQLiteStats(BaseFrontend):
     self.shutdown = True
     with self.statwakeup: self.statwakeup.notify()
     self.statthread.join(5)
+    # The writer thread writes everything that is still queued before it exits
+    with self.writelock: self.writelock.notify_all()
+    self.writethread.join(60)
     with self.lock:
       self.cursor.close()
       self.cursor = None
       self.db.commit()
       self.db.close()
       self.db = None
+    with self.readerlock:
+      for reader in self.readers: reader.close()
+      self.readers = []
+      self.querycache = {}
     super(SQLiteStats, self)._stop()
 
 
   def write_log_message(self, source, timestamp, loglevel, messages):
     if not self.started: return
     if loglevel > self.settings.loglevel: return
-    timestamp = time.mktime(timestamp.timetuple()) + timestamp.microsecond / 1000000.
-    with self.lock:
-      source = self._get_object_id(source)
-      self.cursor.execute("INSERT INTO [log]([level], [timestamp], [source]) VALUES(:level, :timestamp, :source)",
-                          {"level": loglevel, "timestamp": timestamp, "source": source})
-      parent = self.cursor.lastrowid
-      self.cursor.executemany("INSERT INTO [logfragment]([parent], [message], [format]) VALUES(:parent, :message, :format)",
-                              [{"parent": parent, "message": message, "format": format} for message, format in messages])
+    self._enqueue((_LOG, source, timestamp, loglevel, messages))
 
 
-  def handle_stats_event(self, level, source, event, arg, message, worker, worksource, blockchain, job, timestamp):
+  def handle_event(self, event):
     if not self.started: return
-    if level > self.settings.eventlevel: return
-    timestamp = time.mktime(timestamp.timetuple()) + timestamp.microsecond / 1000000.
-    with self.lock:
-      source = self._get_object_id(source)
-      worker = self._get_object_id(worker)
-      worksource = self._get_object_id(worksource)
-      blockchain = self._get_object_id(blockchain)
-      job = self._get_job_id(job)
-      eventtype = self._get_eventtype_id(event)
-      self.cursor.execute("INSERT INTO [event]([level], [timestamp], [source], [type], [argument], "
-                                              "[message], [worker], [worksource], [blockchain], [job]) "
-                                      "VALUES(:level, :timestamp, :source, :type, :argument, "
-                                             ":message, :worker, :worksource, :blockchain, :job)",
-                          {"level": level, "timestamp": timestamp, "source": source, "type": eventtype, "argument": arg,
-                           "message": message, "worker": worker, "worksource": worksource, "blockchain": blockchain, "job": job})
+    self._enqueue((_EVENT, event))
+    
+    
+  def _enqueue(self, record, force = False):
+    with self.writelock:
+      # While the writer thread is logging, it might be waiting for the thread that is
+      # delivering to us, so nobody may wait for the writer thread at that point.
+      while not force and not self.writerlogging and len(self.writequeue) >= self.settings.writequeuelength:
+        if self.shutdown or self.settings.writepolicy == "drop":
+          self.writesdropped += 1
+          return
+        self.writelock.wait()
+      if not self.writequeue:
+        self.writedeadline = time.time() + self.settings.flushinterval
+        self.writelock.notify_all()
+      self.writequeue.append(record)
+      if len(self.writequeue) == self.settings.batchsize: self.writelock.notify_all()
+
+
+  def _writeloop(self):
+    with self.writelock:
+      while True:
+        if not self.writequeue and self.shutdown: return
+        if len(self.writequeue) < self.settings.batchsize and not self.shutdown:
+          # Nothing needs to be written yet, do maintenance until it does
+          now = time.time()
+          delay = self.writedeadline - now if self.writequeue else None
+          if delay is None or delay > 0:
+            if now >= self.nextmaintenance:
+              self.writelock.release()
+              try: self._maintenance_step()
+              finally: self.writelock.acquire()
+              continue
+            if delay is None or self.nextmaintenance - now < delay: delay = self.nextmaintenance - now
+            self.writelock.wait(delay)
+            continue
+        count = min(len(self.writequeue), self.settings.batchsize)
+        batch = [self.writequeue.popleft() for i in range(count)]
+        dropped = self.writesdropped
+        self.writesdropped = 0
+        if self.writequeue: self.writedeadline = time.time() + self.settings.flushinterval
+        # Wake up delivering threads that are waiting for space in the queue
+        self.writelock.notify_all()
+        self.writelock.release()
+        try:
+          if dropped: self._writer_log("Write queue overflow, dropped %d log messages and events\n", 200, "y", dropped)
+          with self.lock: self._write_batch(batch)
+        except:
+          self._writer_log("Error while writing to the database: %s\n", 100, "r", traceback.format_exc())
+          with self.lock:
+            try: self.db.rollback()
+            except: pass
+            self._forget_new_ids()
+        finally: self.writelock.acquire()
+
+
+  def _writer_log(self, message, loglevel, format = "", *args):
+    with self.writelock:
+      self.writerlogging = True
+      self.writelock.notify_all()
+    try: self.core.log(self, message, loglevel, format, *args)
+    finally:
+      with self.writelock: self.writerlogging = False
+
+
+  def _forget_new_ids(self):
+    # The rows of these ids were rolled back, they will be looked up or created again
+    for holder, key in self.newids:
+      if isinstance(holder, dict): holder.pop(key, None)
+      elif hasattr(holder, key): delattr(holder, key)
+    self.newids = []
+
+
+  def _write_batch(self, batch):
+    logs = []
+    fragments = []
+    events = []
+    self.newids = []
+    self.pendingjobs = []
+    self.pendingsamples = []
+    for record in batch:
+      kind = record[0]
+      if kind == _EVENT:
+        event = record[1]
+        timestamp = time.mktime(event.timestamp.timetuple()) + event.timestamp.microsecond / 1000000.
+        events.append((event.level, timestamp, self._get_object_id(event.source), self._get_eventtype_id(event.name),
+                       event.arg, event.message, self._get_object_id(event.worker), self._get_object_id(event.worksource),
+                       self._get_object_id(event.blockchain), self._get_job_id(event.job)))
+      elif kind == _LOG:
+        kind, source, timestamp, loglevel, messages = record
+        timestamp = time.mktime(timestamp.timetuple()) + timestamp.microsecond / 1000000.
+        id = self.nextids["log"]
+        self.nextids["log"] += 1
+        logs.append((id, loglevel, timestamp, self._get_object_id(source)))
+        fragments.extend((id, message, format) for message, format in messages)
+      else: self._insert_stats(record[1], record[2])
+    # Parents first, because of the foreign keys
+    if self.pendingjobs: self.cursor.executemany("INSERT INTO [job]([id], [worksource], [data]) VALUES(?, ?, ?)", self.pendingjobs)
+    if logs: self.cursor.executemany("INSERT INTO [log]([id], [level], [timestamp], [source]) VALUES(?, ?, ?, ?)", logs)
+    if fragments: self.cursor.executemany("INSERT INTO [logfragment]([parent], [message], [format]) VALUES(?, ?, ?)", fragments)
+    if events: self.cursor.executemany("INSERT INTO [event]([level], [timestamp], [source], [type], [argument], "
+                                                           "[message], [worker], [worksource], [blockchain], [job]) "
+                                       "VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", events)
+    if self.pendingsamples: self.cursor.executemany("INSERT INTO [statsample]([timestamp], [subject], [parent], [data]) VALUES(?, ?, ?, ?)", self.pendingsamples)
+    self.db.commit()
       
       
   def _statloop(self):
@@ -138,29 +371,322 @@ class SQLiteStats(BaseFrontend):
       with self.statwakeup:
         if self.settings.statinterval <= 0: self.statwakeup.wait()
         else:
-          now = time.time()
-          stats = Statistics(obj = self.core, ghashes = self.core.stats.ghashes, starttime = self.core.stats.starttime)
-          stats.avgmhps =  1000. * stats.ghashes / (now - stats.starttime)
-          stats.children = self.core.get_worker_statistics() \
-                         + self.core.get_work_source_statistics() \
-                         + self.core.get_blockchain_statistics()
-          with self.lock:
-            self._insert_stats(now, stats)
-            self.db.commit()
+          snapshot = self.core.get_statistics_snapshot()
+          now = snapshot.timestamp
+          stats = Statistics(obj = self.core, ghashes = snapshot.ghashes, starttime = snapshot.starttime, avgmhps = snapshot.avgmhps)
+          stats.children = snapshot.workers + snapshot.worksources + snapshot.blockchains
+          self._enqueue((_STATS, now, stats), True)
           self.statwakeup.wait(self.settings.statinterval)
           
           
   def _insert_stats(self, timestamp, stats, parent = None):
-    self.cursor.execute("INSERT INTO [statrow]([timestamp], [subject], [parent]) VALUES(:timestamp, :subject, :parent)",
-                        {"timestamp": timestamp, "subject": self._get_object_id(stats.obj), "parent": parent})
-    row = self.cursor.lastrowid
-    for key, value in stats.items():
-      if isinstance(value, numbers.Number):
-        self.cursor.execute("INSERT INTO [statfield]([row], [column], [value]) VALUES(:row, :column, :value)",
-                            {"row": row, "column": self._get_statcolumn_id(key), "value": value})
-    for child in stats.children: self._insert_stats(timestamp, child, row)
+    # Called by the writer thread, the rows are written at the end of the batch
+    subject = self._get_object_id(stats.obj)
+    fields = [(self._get_statcolumn_id(key), value) for key, value in stats.items()
+              if key != "version" and isinstance(value, numbers.Number)]
+    self.pendingsamples.append((timestamp, subject, parent, pack_sample(fields)))
+    for child in stats.children: self._insert_stats(timestamp, child, subject)
         
     
+  def get_history_info(self):
+    # Objects and columns that statistics queries can ask for, and the available resolutions
+    reader = self._get_reader()
+    try:
+      cursor = reader.cursor()
+      cursor.execute("SELECT [o].[id], [o].[name], [t].[name] FROM [object] AS [o] INNER JOIN [objecttype] AS [t] ON [t].[id] = [o].[type]")
+      objects = [{"id": id, "name": name, "type": type} for id, name, type in cursor.fetchall()]
+      cursor.execute("SELECT [name] FROM [statcolumn]")
+      columns = [row[0] for row in cursor.fetchall()]
+      cursor.execute("SELECT MIN([timestamp]) FROM [statsample]")
+      first = cursor.fetchone()[0]
+      cursor.execute("SELECT MIN([timestamp]) FROM [statrollup]")
+      firstrollup = cursor.fetchone()[0]
+      if first is None or (firstrollup is not None and firstrollup < first): first = firstrollup
+      return {
+        "objects": objects,
+        "columns": columns,
+        "first": first,
+        "resolutions": [0] + [resolution for resolution, buckets in rollup_resolutions],
+        "retention": [self.settings.rawretention, self.settings.minuteretention, self.settings.hourretention, self.settings.dayretention],
+      }
+    finally: self._put_reader(reader)
+
+
+  def query_history(self, objects = None, columns = None, start = None, end = None, points = 300):
+    # Statistics of the given objects (ids or names) and columns (names) between start and end,
+    # in at most points buckets per object. The coarsest stored resolution that still yields
+    # that many points is used, and buckets that it doesn't cover yet are filled from the samples.
+    # Returns a header and an iterator over [object id, bucket start, samples, values] rows,
+    # with [avg, min, max, last] (or None) for every column in values.
+    now = time.time()
+    end = float(end) if end is not None else now
+    start = float(start) if start is not None else end - 86400
+    if end <= start: raise ValueError("End of time range is before its start")
+    points = max(10, min(5000, int(points)))
+    step = (end - start) / points
+    resolutions = [0] + [resolution for resolution, buckets in rollup_resolutions]
+    retention = [self.settings.rawretention, self.settings.minuteretention, self.settings.hourretention, self.settings.dayretention]
+    level = 0
+    for i, resolution in enumerate(resolutions):
+      if resolution <= step: level = i
+    # Go coarser if the data at this resolution was already deleted
+    while level + 1 < len(resolutions) and retention[level] and retention[level] > 0 and now - retention[level] * 86400 > start: level += 1
+    resolution = resolutions[level]
+    bucket = step if not resolution else resolution * max(1, int(math.ceil(step / resolution)))
+    reader = self._get_reader()
+    try:
+      cursor = reader.cursor()
+      subjects = self._resolve_objects(cursor, objects)
+      if columns is None: columns = ["mhps"]
+      columnids = self._resolve_columns(cursor, columns)
+      if resolution:
+        cursor.execute("SELECT [value] FROM [maintenance] WHERE [key] = ?", ("rollup_%d" % resolution,))
+        row = cursor.fetchone()
+        progress = row[0] if row else 0
+      else: progress = None
+    finally: self._put_reader(reader)
+    header = {
+      "start": start,
+      "end": end,
+      "resolution": resolution,
+      "bucket": bucket,
+      "columns": columns,
+      "objects": [subject[1] for subject in subjects],
+    }
+    key = (resolution, bucket, int(start // bucket), int(end // bucket), tuple(subject[0] for subject in subjects), tuple(columnids))
+    with self.readerlock:
+      cached = self.querycache.get(key)
+      if cached and cached[0] > now: return header, iter(cached[1])
+    return header, self._query_rows(key, subjects, columnids, start, end, resolution, bucket, progress)
+
+
+  def _query_rows(self, key, subjects, columnids, start, end, resolution, bucket, progress):
+    # Results are cached for a short time, so that dashboards that are refreshed
+    # by several clients don't repeat the same query. Large results aren't cached.
+    reader = self._get_reader()
+    cache = []
+    wanted = set(columnids)
+    try:
+      cursor = reader.cursor()
+      for subject, info in subjects:
+        current = None
+        samples = 0
+        aggregate = {}
+        for timestamp, count, fields in self._query_subject(cursor, subject, start, end, resolution, progress):
+          position = math.floor(timestamp / bucket) * bucket
+          if position != current:
+            if samples:
+              row = [subject, current, samples, [finish_field(aggregate[column]) if column in aggregate else None for column in columnids]]
+              if cache is not None: cache.append(row)
+              yield row
+            current = position
+            samples = 0
+            aggregate = {}
+          samples += count
+          accumulate_fields(aggregate, fields, count, wanted)
+        if samples:
+          row = [subject, current, samples, [finish_field(aggregate[column]) if column in aggregate else None for column in columnids]]
+          if cache is not None: cache.append(row)
+          yield row
+        if cache is not None and len(cache) > 20000: cache = None
+    finally: self._put_reader(reader)
+    if cache is None: return
+    with self.readerlock:
+      if len(self.querycache) >= 32: self.querycache.pop(min(self.querycache, key = lambda key: self.querycache[key][0]))
+      self.querycache[key] = (time.time() + min(bucket, 30), cache)
+
+
+  def _query_subject(self, cursor, subject, start, end, resolution, progress):
+    # Yields (timestamp, samples, fields) in timestamp order, from the rollups as far as they
+    # go, and from the samples after that. The statements never change, so they are
+    # prepared only once per read connection.
+    if resolution:
+      cursor.execute("SELECT [timestamp], [samples], [data] FROM [statrollup] WHERE [resolution] = ? AND [subject] = ? "
+                     "AND [timestamp] >= ? AND [timestamp] < ? ORDER BY [timestamp]",
+                     (resolution, subject, math.floor(start / resolution) * resolution, min(end, progress)))
+      for timestamp, samples, data in cursor: yield timestamp, samples, unpack_rollup(data, samples)
+      start = max(start, progress)
+    if start >= end: return
+    cursor.execute("SELECT [timestamp], [data] FROM [statsample] WHERE [subject] = ? AND [timestamp] >= ? AND [timestamp] < ? ORDER BY [timestamp]",
+                   (subject, start, end))
+    for timestamp, data in cursor: yield timestamp, 1, [(column, (value, value, value, value)) for column, value in unpack_sample(data)]
+
+
+  def _resolve_objects(self, cursor, objects):
+    # Returns (id, info) tuples for a list of object ids or names, or all objects if it is None
+    cursor.execute("SELECT [o].[id], [o].[name], [t].[name] FROM [object] AS [o] INNER JOIN [objecttype] AS [t] ON [t].[id] = [o].[type]")
+    known = [(id, {"id": id, "name": name, "type": type}) for id, name, type in cursor.fetchall()]
+    if objects is None: return known
+    result = []
+    for obj in objects:
+      matches = [entry for entry in known if entry[0] == obj or entry[1]["name"] == obj]
+      if not matches: raise ValueError("Unknown object: %s" % obj)
+      result.extend(matches)
+    return result
+
+
+  def _resolve_columns(self, cursor, columns):
+    result = []
+    for column in columns:
+      cursor.execute("SELECT [id] FROM [statcolumn] WHERE [name] = ?", (column,))
+      row = cursor.fetchone()
+      if not row: raise ValueError("Unknown column: %s" % column)
+      result.append(row[0])
+    return result
+
+
+  def _get_reader(self):
+    # Queries use their own connections, which can read while the writer thread writes (WAL mode)
+    with self.readerlock:
+      if not self.started: raise Exception("Statistics database is not running")
+      if self.readers: return self.readers.pop()
+      filename = self.filename
+    reader = sqlite3.connect(filename, check_same_thread = False)
+    reader.text_factory = str
+    return reader
+
+
+  def _put_reader(self, reader):
+    with self.readerlock:
+      if self.started and len(self.readers) < 4:
+        self.readers.append(reader)
+        return
+    reader.close()
+
+
+  def _maintenance_step(self):
+    # Called by the writer thread while the write queue is empty
+    try:
+      with self.lock:
+        if not self.maintenance: self.maintenance = self._maintain()
+        next(self.maintenance)
+    except StopIteration:
+      self.maintenance = None
+      self.nextmaintenance = time.time() + 60
+    except:
+      self.maintenance = None
+      self.nextmaintenance = time.time() + 60
+      self._writer_log("Error during database maintenance: %s\n", 100, "r", traceback.format_exc())
+      try: self.db.rollback()
+      except: pass
+
+
+  def _maintain(self):
+    # One pass over all maintenance tasks, yields after every step
+    while self._migrate_step(): yield
+    now = time.time()
+    limit = now - 60
+    for resolution, buckets in rollup_resolutions:
+      while self._rollup_step(resolution, buckets, limit): yield
+      # Coarser rollups are only made from complete rollups of this resolution
+      limit = self._get_progress("rollup_%d" % resolution, 0)
+    retention = [self.settings.rawretention, self.settings.minuteretention, self.settings.hourretention, self.settings.dayretention]
+    resolutions = [0] + [resolution for resolution, buckets in rollup_resolutions]
+    for i, resolution in enumerate(resolutions):
+      if not retention[i] or retention[i] <= 0: continue
+      cutoff = now - retention[i] * 86400
+      # Never delete data that wasn't aggregated into the next coarser resolution yet
+      if i + 1 < len(resolutions): cutoff = min(cutoff, self._get_progress("rollup_%d" % resolutions[i + 1], 0))
+      while self._expire_step(resolution, cutoff): yield
+
+
+  def _get_progress(self, key, default = None):
+    self.cursor.execute("SELECT [value] FROM [maintenance] WHERE [key] = ?", (key,))
+    row = self.cursor.fetchone()
+    return row[0] if row else default
+
+
+  def _set_progress(self, key, value):
+    if value is None: self.cursor.execute("DELETE FROM [maintenance] WHERE [key] = ?", (key,))
+    else: self.cursor.execute("INSERT OR REPLACE INTO [maintenance]([key], [value]) VALUES(?, ?)", (key, value))
+
+
+  def _migrate_step(self):
+    # Converts the statrow/statfield rows of schema version 2 into statistics samples.
+    # Fields were always inserted right after their row, so they are processed in id
+    # order, and the last row of a chunk is left for the next step as it might be incomplete.
+    last = self._get_progress("migrate_v2")
+    if last is None: return False
+    self.cursor.execute("SELECT [id], [row], [column], [value] FROM [statfield] WHERE [id] > ? ORDER BY [id] LIMIT 5000", (last,))
+    fields = self.cursor.fetchall()
+    if len(fields) == 5000:
+      complete = [field for field in fields if field[1] != fields[-1][1]]
+      if complete: fields = complete
+    if not fields:
+      self.cursor.execute("DROP TABLE [statfield]")
+      self.cursor.execute("DROP TABLE [statrow]")
+      self._set_progress("migrate_v2", None)
+      self.db.commit()
+      self._writer_log("Finished migrating old statistics\n", 400, "")
+      return False
+    rows = {}
+    for id, row, column, value in fields: rows.setdefault(row, []).append((column, value))
+    ids = sorted(rows)
+    samples = []
+    for i in range(0, len(ids), 500):
+      chunk = ids[i : i + 500]
+      self.cursor.execute("SELECT [r].[id], [r].[timestamp], [r].[subject], [p].[subject] FROM [statrow] AS [r] "
+                          "LEFT JOIN [statrow] AS [p] ON [p].[id] = [r].[parent] WHERE [r].[id] IN (%s)" % ", ".join("?" * len(chunk)), chunk)
+      for id, timestamp, subject, parent in self.cursor.fetchall(): samples.append((timestamp, subject, parent, pack_sample(rows[id])))
+    self.cursor.executemany("INSERT INTO [statsample]([timestamp], [subject], [parent], [data]) VALUES(?, ?, ?, ?)", samples)
+    self._set_progress("migrate_v2", fields[-1][0])
+    self.db.commit()
+    return True
+
+
+  def _rollup_step(self, resolution, buckets, limit):
+    # Aggregates the next few complete buckets of the next finer resolution (or the
+    # samples) that weren't aggregated yet. Gaps in the data are skipped.
+    key = "rollup_%d" % resolution
+    finer = [0] + [r for r, b in rollup_resolutions]
+    source = finer[finer.index(resolution) - 1]
+    progress = self._get_progress(key, 0)
+    if source: self.cursor.execute("SELECT MIN([timestamp]) FROM [statrollup] WHERE [resolution] = ? AND [timestamp] >= ?", (source, progress))
+    else: self.cursor.execute("SELECT MIN([timestamp]) FROM [statsample] WHERE [timestamp] >= ?", (progress,))
+    first = self.cursor.fetchone()[0]
+    if first is None: return False
+    start = int(first // resolution) * resolution
+    end = min(start + buckets * resolution, int(limit // resolution) * resolution)
+    if end <= start: return False
+    aggregates = {}
+    if source:
+      self.cursor.execute("SELECT [subject], [timestamp], [samples], [data] FROM [statrollup] WHERE [resolution] = ? AND [timestamp] >= ? AND [timestamp] < ? "
+                          "ORDER BY [timestamp]", (source, start, end))
+    else:
+      self.cursor.execute("SELECT [subject], [timestamp], 1, [data] FROM [statsample] WHERE [timestamp] >= ? AND [timestamp] < ? "
+                          "ORDER BY [timestamp]", (start, end))
+    for subject, timestamp, samples, data in self.cursor.fetchall():
+      bucket = (subject, int(timestamp // resolution) * resolution)
+      aggregate = aggregates.get(bucket)
+      if not aggregate:
+        aggregate = [0, {}]
+        aggregates[bucket] = aggregate
+      aggregate[0] += samples
+      if source: accumulate_fields(aggregate[1], unpack_rollup(data, samples), samples)
+      else: accumulate_fields(aggregate[1], [(column, (value, value, value, value)) for column, value in unpack_sample(data)], 1)
+    rows = []
+    for (subject, timestamp), (samples, fields) in aggregates.items():
+      if samples == 1: data = pack_sample([(column, field[4]) for column, field in fields.items()])
+      else: data = pack_rollup([(column, finish_field(field)) for column, field in fields.items()])
+      rows.append((resolution, subject, timestamp, samples, data))
+    self.cursor.executemany("INSERT OR REPLACE INTO [statrollup]([resolution], [subject], [timestamp], [samples], [data]) VALUES(?, ?, ?, ?, ?)", rows)
+    self._set_progress(key, end)
+    self.db.commit()
+    return True
+
+
+  def _expire_step(self, resolution, cutoff):
+    # Deletes a limited number of rows that are older than cutoff, returns whether there might be more
+    if resolution:
+      self.cursor.execute("DELETE FROM [statrollup] WHERE [rowid] IN (SELECT [rowid] FROM [statrollup] "
+                          "WHERE [resolution] = ? AND [timestamp] < ? LIMIT 2000)", (resolution, cutoff))
+    else:
+      self.cursor.execute("DELETE FROM [statsample] WHERE [rowid] IN (SELECT [rowid] FROM [statsample] WHERE [timestamp] < ? LIMIT 2000)", (cutoff,))
+    count = self.cursor.rowcount
+    self.db.commit()
+    return count >= 2000
+
+
   def _get_objecttype_id(self, objtype):
     if hasattr(objtype, "_ext_theseven_sqlite_objtypeid"): return objtype._ext_theseven_sqlite_objtypeid
     name = objtype.__module__ + "." + objtype.__name__
@@ -171,6 +697,7 @@ class SQLiteStats(BaseFrontend):
       self.cursor.execute("INSERT INTO [objecttype]([name]) VALUES(:name)", {"name": name})
       id = self.cursor.lastrowid
     objtype._ext_theseven_sqlite_objtypeid = id
+    self.newids.append((objtype, "_ext_theseven_sqlite_objtypeid"))
     return id
 
 
@@ -187,17 +714,20 @@ class SQLiteStats(BaseFrontend):
                           {"type": type, "name": obj.settings.name})
       id = self.cursor.lastrowid
     obj._ext_theseven_sqlite_objid = id
+    self.newids.append((obj, "_ext_theseven_sqlite_objid"))
     return id
 
 
   def _get_job_id(self, job):
     if job is None: return None
     if hasattr(job, "_ext_theseven_sqlite_jobid"): return job._ext_theseven_sqlite_jobid
-    worksource = self._get_object_id(job.worksource)
-    self.cursor.execute("INSERT INTO [job]([worksource], [data]) VALUES(:worksource, :data)",
-                        {"worksource": worksource, "data": job.data[:76]})
-    job._ext_theseven_sqlite_jobid = self.cursor.lastrowid
-    return self.cursor.lastrowid
+    # Called by the writer thread, the row is written at the end of the batch
+    id = self.nextids["job"]
+    self.nextids["job"] += 1
+    self.pendingjobs.append((id, self._get_object_id(job.worksource), job.data[:76]))
+    job._ext_theseven_sqlite_jobid = id
+    self.newids.append((job, "_ext_theseven_sqlite_jobid"))
+    return id
 
 
   def _get_eventtype_id(self, eventtype):
@@ -209,6 +739,7 @@ class SQLiteStats(BaseFrontend):
       self.cursor.execute("INSERT INTO [eventtype]([name]) VALUES(:name)", {"name": eventtype})
       id = self.cursor.lastrowid
     self.eventtypes[eventtype] = id
+    self.newids.append((self.eventtypes, eventtype))
     return id
 
 
@@ -221,6 +752,7 @@ class SQLiteStats(BaseFrontend):
       self.cursor.execute("INSERT INTO [statcolumn]([name]) VALUES(:name)", {"name": column})
       id = self.cursor.lastrowid
     self.statcolumns[column] = id
+    self.newids.append((self.statcolumns, column))
     return id
 
 
@@ -281,4 +813,28 @@ class SQLiteStats(BaseFrontend):
         self.cursor.execute("UPDATE [dbinfo] SET [value] = :version WHERE [key] = 'version'", {"version": version + 1})
         self.db.commit()
         version = 2
+      if version == 2:
+        # One row per object and sample instead of one row per field. The old rows are
+        # converted in the background (see _migrate_step), starting from statfield id 0.
+        self.cursor.execute("CREATE TABLE [statsample]([id] INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, "
+                                                      "[timestamp] REAL NOT NULL, "
+                                                      "[subject] INTEGER NOT NULL REFERENCES [object] ON DELETE RESTRICT ON UPDATE RESTRICT, "
+                                                      "[parent] INTEGER NULL REFERENCES [object] ON DELETE RESTRICT ON UPDATE RESTRICT, "
+                                                      "[data] BLOB NOT NULL)")
+        self.cursor.execute("CREATE INDEX [statsample_timestamp] ON [statsample]([timestamp])")
+        self.cursor.execute("CREATE INDEX [statsample_subject_timestamp] ON [statsample]([subject], [timestamp])")
+        self.cursor.execute("CREATE TABLE [statrollup]([id] INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, "
+                                                      "[resolution] INTEGER NOT NULL, "
+                                                      "[subject] INTEGER NOT NULL REFERENCES [object] ON DELETE RESTRICT ON UPDATE RESTRICT, "
+                                                      "[timestamp] REAL NOT NULL, "
+                                                      "[samples] INTEGER NOT NULL, "
+                                                      "[data] BLOB NOT NULL, "
+                                                      "CONSTRAINT statrollup_unique_resolution_subject_timestamp UNIQUE ([resolution], [subject], [timestamp]))")
+        self.cursor.execute("CREATE INDEX [statrollup_resolution_timestamp] ON [statrollup]([resolution], [timestamp])")
+        self.cursor.execute("CREATE TABLE [maintenance]([key] TEXT NOT NULL PRIMARY KEY, "
+                                                       "[value] REAL NOT NULL)")
+        self.cursor.execute("INSERT INTO [maintenance]([key], [value]) VALUES('migrate_v2', 0)")
+        self.cursor.execute("UPDATE [dbinfo] SET [value] = :version WHERE [key] = 'version'", {"version": version + 1})
+        self.db.commit()
+        version = 3
     except: self.db.rollback()
@@ -30,9 +30,11 @@ import sys
 import socket
 import time
 import json
+import math
 import struct
 import traceback
 from binascii import hexlify, unhexlify
+from collections import deque
 from threading import Thread, RLock, Condition
 from hashlib import sha256
 from core.actualworksource import ActualWorkSource
@@ -44,6 +46,21 @@ class StratumWorkSource(ActualWorkSource):
   
   version = "theseven.stratum work source v0.1.0"
   default_name = "Untitled Stratum work source"
+  # Sending a share doesn't wait for the response, and this keeps them in order
+  submit_concurrency = 1
+  # Maximum number of jobs generated or handed out at once
+  generator_batch = 16
+  # The job pool holds enough jobs for this many seconds of consumption...
+  pool_time = 2
+  # ...within these limits
+  pool_min = 16
+  pool_max = 256
+  # Time constant of the job consumption rate average (seconds)
+  consumption_tau = 30.
+  # Lifetime of generated jobs (seconds). Pool jobs that would expire within the
+  # margin are regenerated instead of being handed out, which also keeps their ntime fresh.
+  job_lifetime = 60
+  expiry_margin = 30
   settings = dict(ActualWorkSource.settings, **{
     "connecttimeout": {"title": "Connect timeout", "type": "float", "position": 19000},
     "responsetimeout": {"title": "Response timeout", "type": "float", "position": 19100},
@@ -56,7 +73,7 @@ class StratumWorkSource(ActualWorkSource):
 
   def __init__(self, core, state = None):
     super(StratumWorkSource, self).__init__(core, state)
-    self.datalock = RLock()
+    self.datalock = Condition()
     self.txnlock = RLock()
     self.wakeup = Condition()
     self.tail = unhexlify(b"00000000000000800000000000000000000000000000000000000000000000000000000000000000000000000000000080020000")
@@ -80,10 +97,18 @@ class StratumWorkSource(ActualWorkSource):
     self.timeoutthread = None
     self.listenerthread = None
     self.data = None
+    self.generatorthread = None
+    self.pool = deque()
+    self.poolgeneration = 0
+    self.poolsize = self.pool_min
+    self.consumption = 0
+    self.lastconsumption = time.time()
     self.txns = {}
     self.txnid = 1
     self.difficulty = 1
     self._calculate_target()
+    # Jobs are generated locally, there is no round trip to wait for
+    self.estimated_latency = 0
     
     
   def _start(self):
@@ -97,6 +122,9 @@ class StratumWorkSource(ActualWorkSource):
     self.listenerthread = Thread(None, self._listener, "%s_listener" % self.settings.name)
     self.listenerthread.daemon = True
     self.listenerthread.start()
+    self.generatorthread = Thread(None, self._generator, "%s_generator" % self.settings.name)
+    self.generatorthread.daemon = True
+    self.generatorthread.start()
     self.timeoutthread = Thread(None, self._timeout, "%s_timeout" % self.settings.name)
     self.timeoutthread.daemon = True
     self.timeoutthread.start()
@@ -105,6 +133,8 @@ class StratumWorkSource(ActualWorkSource):
   def _stop(self):
     self.shutdown = True
     with self.wakeup: self.wakeup.notify()
+    with self.datalock: self.datalock.notify_all()
+    if self.generatorthread: self.generatorthread.join(3)
     if self.timeoutthread: self.timeoutthread.join(3)
     if self.listenerthread: self.listenerthread.join(3)
     super(StratumWorkSource, self)._stop()
@@ -122,25 +152,115 @@ class StratumWorkSource(ActualWorkSource):
     return 0, 0
   
   
-  def _start_fetcher(self):
+  def _start_fetcher(self, jobs):
+    # Hand out jobs from the pool. If it has run dry, the generator
+    # will wake up the fetcher as soon as it has refilled it.
     with self.datalock:
       if not self.data or self.shutdown: return False, 0
-      extranonce2 = unhexlify((("%%0%dx" % (2 * self.data["extranonce2len"])) % self.data["extranonce2"]).encode("ascii"))
-      self.data["extranonce2"] += 1
-      coinbase = self.data["coinb1"] + self.data["extranonce1"] + extranonce2 + self.data["coinb2"]
-      merkle = sha256(sha256(coinbase).digest()).digest()
-      for branch in self.data["merkle_branch"]: merkle = sha256(sha256(merkle + branch).digest()).digest()
+      # The pool is filled in order, so the oldest jobs are at the front
+      limit = time.time() + self.expiry_margin
+      while self.pool and self.pool[0].expiry < limit: self.pool.popleft()
+      count = min(max(1, min(self.generator_batch, jobs)), len(self.pool))
+      jobs = [self.pool.popleft() for i in range(count)]
+      self._update_pool_size(count)
+      self.datalock.notify()
+    if not jobs: return 0, 0
+    self._push_jobs(jobs, "stratum generator")
+    return 1, len(jobs)
+
+
+  def _update_pool_size(self, count):
+    # Keep the pool size proportional to the (decaying average) consumption rate
+    now = time.time()
+    self.consumption = self.consumption * math.exp(min(0, self.lastconsumption - now) / self.consumption_tau) + count / self.consumption_tau
+    self.lastconsumption = now
+    self.poolsize = int(min(self.pool_max, max(self.pool_min, math.ceil(self.consumption * self.pool_time))))
+
+
+  def _set_data(self, data):
+    # Install a new job template (or none), and throw away all jobs generated from the old one
+    with self.datalock:
+      self.data = data
+      self._invalidate_pool()
+
+
+  def _invalidate_pool(self):
+    with self.datalock:
+      self.pool.clear()
+      self.poolgeneration += 1
+      self.datalock.notify_all()
+
+
+  def _generator(self):
+    while True:
+      with self.datalock:
+        while not self.shutdown and (not self.data or len(self.pool) >= self.poolsize): self.datalock.wait()
+        if self.shutdown: return
+        generation = self.poolgeneration
+        count = min(self.generator_batch, self.poolsize - len(self.pool))
+      try: jobs = self._generate_jobs(count)
+      except:
+        self.core.log(self, "Error while generating jobs: %s\n", 200, "r", traceback.format_exc())
+        time.sleep(1)
+        continue
+      with self.datalock:
+        # Drop the jobs if the template was replaced while they were being generated
+        if not jobs or generation != self.poolgeneration: continue
+        wasempty = not self.pool
+        self.pool.extend(jobs)
+      if wasempty: self.core.fetcher.wakeup()
+
+
+  def _prepare_data(self, data):
+    # Precalculate everything that is the same for all jobs of a template.
+    # The coinbase hash state after coinb1 + extranonce1 is kept and copied for
+    # every job, so only extranonce2 + coinb2 need to be hashed per job. The merkle
+    # branch can't be shortened like that, because the coinbase hash comes first.
+    data["coinbase_prefix"] = sha256(data["coinb1"] + data["extranonce1"])
+    data["extranonce2_format"] = "%%0%dx" % (2 * data["extranonce2len"])
+    data["header_prefix"] = data["version"] + data["prevhash"]
+    data["header_suffix"] = data["nbits"] + self.tail
+    
+    
+  def _generate_jobs(self, count):
+    # Generate count jobs for consecutive extranonce2 values. Only the extranonce2
+    # range is reserved under the data lock, the hashing is done outside of it.
+    with self.datalock:
+      data = self.data
+      if not data or self.shutdown: return []
+      first = data["extranonce2"]
+      data["extranonce2"] += count
+    now = time.time()
+    expiry = now + self.job_lifetime
+    ntime = struct.pack(">I", data["ntime"] + int(now))
+    ntimehex = hexlify(ntime).decode("ascii")
+    prefix = data["coinbase_prefix"]
+    coinb2 = data["coinb2"]
+    branches = data["merkle_branch"]
+    headerprefix = data["header_prefix"]
+    headersuffix = ntime + data["header_suffix"]
+    extranonce2format = data["extranonce2_format"]
+    target = data["target"]
+    job_id = data["job_id"]
+    extranonces = []
+    headers = []
+    for extranonce2 in range(first, first + count):
+      extranonce2 = extranonce2format % extranonce2
+      coinbase = prefix.copy()
+      coinbase.update(unhexlify(extranonce2.encode("ascii")) + coinb2)
+      merkle = sha256(coinbase.digest()).digest()
+      for branch in branches: merkle = sha256(sha256(merkle + branch).digest()).digest()
       merkle = struct.pack("<8I", *struct.unpack(">8I", merkle))
-      ntime = struct.pack(">I", self.data["ntime"] + int(time.time()))
-      data = self.data["version"] + self.data["prevhash"] + merkle + ntime + self.data["nbits"] + self.tail
-      target = self.data["target"]
-      job_id = self.data["job_id"]
-    job = Job(self.core, self, time.time() + 60, data, target)
-    job._stratum_job_id = job_id
-    job._stratum_extranonce2 = hexlify(extranonce2).decode("ascii")
-    job._stratum_ntime = hexlify(ntime).decode("ascii")
-    self._push_jobs([job], "stratum generator")
-    return 1, 1
+      extranonces.append(extranonce2)
+      headers.append(headerprefix + merkle + headersuffix)
+    jobs = []
+    for extranonce2, header, midstate in zip(extranonces, headers, Job.calculate_midstates(headers)):
+      job = Job(self.core, self, expiry, header, target, midstate)
+      job._stratum_job_id = job_id
+      job._stratum_extranonce2 = extranonce2
+      job._stratum_ntime = ntimehex
+      jobs.append(job)
+    return jobs
   
   
   def _txn(self, method, params = None, callback = None, errorcallback = None, timeoutcallback = None, timeout = None):
@@ -197,7 +317,7 @@ class StratumWorkSource(ActualWorkSource):
             if "id" in msg and msg["id"]:
               with self.txnlock:
                 if not msg["id"] in self.txns:
-                  self.core.log(self, "Received unexpected Stratum response: %s\n" % msg, 200, "y")
+                  self.core.log(self, "Received unexpected Stratum response: %s\n", 200, "y", msg)
                   continue
                 txn = self.txns[msg["id"]]
                 if "error" in msg and msg["error"]:
@@ -206,34 +326,38 @@ class StratumWorkSource(ActualWorkSource):
                 elif txn["callback"]: txn["callback"](txn, msg["result"])
                 del self.txns[msg["id"]]
             elif msg["method"] == "mining.notify":
-              with self.datalock:
-                self.data = {
-                  "job_id": msg["params"][0],
-                  "prevhash": unhexlify(msg["params"][1].encode("ascii")),
-                  "coinb1": unhexlify(msg["params"][2].encode("ascii")),
-                  "coinb2": unhexlify(msg["params"][3].encode("ascii")),
-                  "merkle_branch": [unhexlify(branch.encode("ascii")) for branch in msg["params"][4]],
-                  "version": unhexlify(msg["params"][5].encode("ascii")),
-                  "nbits": unhexlify(msg["params"][6].encode("ascii")),
-                  "ntime": struct.unpack(">I", unhexlify(msg["params"][7].encode("ascii")))[0] - int(time.time()),
-                  "extranonce1": self.extranonce1,
-                  "extranonce2len": self.extranonce2len,
-                  "extranonce2": 0,
-                  "difficulty": self.difficulty,
-                  "target": self.target,
-                }
-              self.core.log(self, "Received new job generation data (%sflushing old jobs)\n" % ("" if msg["params"][8] else "not "), 500)
+              data = {
+                "job_id": msg["params"][0],
+                "prevhash": unhexlify(msg["params"][1].encode("ascii")),
+                "coinb1": unhexlify(msg["params"][2].encode("ascii")),
+                "coinb2": unhexlify(msg["params"][3].encode("ascii")),
+                "merkle_branch": [unhexlify(branch.encode("ascii")) for branch in msg["params"][4]],
+                "version": unhexlify(msg["params"][5].encode("ascii")),
+                "nbits": unhexlify(msg["params"][6].encode("ascii")),
+                "ntime": struct.unpack(">I", unhexlify(msg["params"][7].encode("ascii")))[0] - int(time.time()),
+                "extranonce1": self.extranonce1,
+                "extranonce2len": self.extranonce2len,
+                "extranonce2": 0,
+                "difficulty": self.difficulty,
+                "target": self.target,
+              }
+              self._prepare_data(data)
+              self._set_data(data)
+              self.core.log(self, "Received new job generation data (%sflushing old jobs)\n", 500, "", "" if msg["params"][8] else "not ")
               if msg["params"][8]: self._cancel_jobs()
               self.blockchain.check_job(Job(self.core, self, 0, self.data["version"] + self.data["prevhash"] + b"\0" * 68 + self.data["nbits"] + self.tail, self.target, True))
             elif msg["method"] == "mining.set_difficulty":
               self.difficulty = float(msg["params"][0])
               self._calculate_target()
-              self.core.log(self, "Received new job difficulty: %f\n" % self.difficulty, 500)
+              self.core.log(self, "Received new job difficulty: %f\n", 500, "", self.difficulty)
+              # Jobs generated from now on need to use the new difficulty
+              with self.datalock:
+                if self.data: self._set_data(dict(self.data, difficulty = self.difficulty, target = self.target))
               self._cancel_jobs()
-            else: self.core.log(self, "Received unknown Stratum notification: %s\n" % msg, 300, "y")
+            else: self.core.log(self, "Received unknown Stratum notification: %s\n", 300, "y", msg)
       except:
-        with self.datalock: self.data = None
-        self.core.log(self, "Stratum connection died: %s\n" % (traceback.format_exc()), 200, "r")
+        self._set_data(None)
+        self.core.log(self, "Stratum connection died: %s\n", 200, "r", traceback.format_exc())
         self._close_connection()
         tries += 1
         if time.time() - starttime >= 60: tries = 0
@@ -260,12 +384,12 @@ class StratumWorkSource(ActualWorkSource):
     
     
   def _default_error_handler(txn, error):
-    self.core.log(self, "Stratum transaction failed: method=%s, params=%s, error=%s\n" % (txn["method"], txn["params"], error), 200, "y")
+    self.core.log(self, "Stratum transaction failed: method=%s, params=%s, error=%s\n", 200, "y", txn["method"], txn["params"], error)
     
     
   def _default_timeout_handler(txn, shutdown):
     if shutdown: return
-    self.core.log(self, "Stratum transaction timed out: method=%s, params=%s\n" % (txn["method"], txn["params"]), 200, "y")
+    self.core.log(self, "Stratum transaction timed out: method=%s, params=%s\n", 200, "y", txn["method"], txn["params"])
     
     
   def _subscribed(self, txn, response):
@@ -276,11 +400,11 @@ class StratumWorkSource(ActualWorkSource):
   
   def _authorized(self, txn, response):
     self._txn("mining.subscribe", [], self._subscribed, self._setup_failed, self._setup_timeout)
-    self.core.log(self, "Successfully authorized Stratum worker %s\n" % self.settings.username, 400, "g")
+    self.core.log(self, "Successfully authorized Stratum worker %s\n", 400, "g", self.settings.username)
     
     
   def _setup_failed(self, txn, error):
-    self.core.log(self, "Stratum worker authorization failed: %s\n" % error, 200, "r")
+    self.core.log(self, "Stratum worker authorization failed: %s\n", 200, "r", error)
     self._close_connection()
     
     
@@ -296,10 +420,13 @@ class StratumWorkSource(ActualWorkSource):
     return "timed out"
         
         
-  def nonce_found(self, job, data, nonce, noncediff):
-    data = [self.username, job._stratum_job_id, job._stratum_extranonce2, job._stratum_ntime, hexlify(nonce).decode("ascii")]
-    submitted = lambda txn, result: job.nonce_handled_callback(nonce, noncediff, result)
-    submit_failed = lambda txn, error: job.nonce_handled_callback(nonce, noncediff, error)
-    submit_timeout = lambda txn, shutdown: job.nonce_handled_callback(nonce, noncediff, self._nonce_timeout_err(shutdown))
-    try: self._txn("mining.submit", data, submitted, submit_failed, submit_timeout)
-    except Exception as e: job.nonce_handled_callback(nonce, noncediff, str(e))
+  def _submit_share(self, share):
+    # The result arrives asynchronously, so this just sends the share. If the
+    # connection isn't active, _txn raises and the submitter will retry later.
+    job = share.job
+    data = [self.username, job._stratum_job_id, job._stratum_extranonce2, job._stratum_ntime, hexlify(share.nonce).decode("ascii")]
+    finish = self.core.submitter.finish
+    submitted = lambda txn, result: finish(share, result)
+    submit_failed = lambda txn, error: finish(share, error)
+    submit_timeout = lambda txn, shutdown: finish(share, self._nonce_timeout_err(shutdown))
+    self._txn("mining.submit", data, submitted, submit_failed, submit_timeout)
@@ -3,6 +3,7 @@ from . import gadgethost
 from . import menugadget
 from . import statsgadget
 from . import log
+from . import statshistory
 from . import uiconfig
 from . import frontendeditor
 from . import workereditor
@@ -18,8 +19,13 @@ handlermap = {
   "/api/statsgadget/getworkerstats": statsgadget.getworkerstats,
   "/api/statsgadget/getworksourcestats": statsgadget.getworksourcestats,
   "/api/statsgadget/getblockchainstats": statsgadget.getblockchainstats,
+  "/api/statsgadget/getfetcherstats": statsgadget.getfetcherstats,
+  "/api/statsgadget/getfrontendstats": statsgadget.getfrontendstats,
   "/api/statsgadget/getallstats": statsgadget.getallstats,
+  "/api/statsgadget/getstatschanges": statsgadget.getstatschanges,
   "/api/log/stream": log.stream,
+  "/api/statshistory/getinfo": statshistory.getinfo,
+  "/api/statshistory/query": statshistory.query,
   "/api/uiconfig/read": uiconfig.read,
   "/api/uiconfig/write": uiconfig.write,
   "/api/frontendeditor/getfrontendclasses": frontendeditor.getfrontendclasses,
@@ -45,11 +45,11 @@ def stream(core, webui, httprequest, path, request, privileges):
     httprequest.wfile.write(("%X\r\n" % len(data)).encode("ascii") + data + "\r\n".encode("ascii"))
     httprequest.wfile.flush()
 
-  queue = Queue()
+  queue = Queue(webui.settings.log_buffer_max_length)
     
   try:
     # Register our log message queue
-    webui.register_log_listener(queue)
+    webui.register_log_listener(queue, loglevel)
     
     while True:
       # Wait for data to turn up in the queue
@@ -27,43 +27,85 @@ from ..decorators import jsonapi
 
 @jsonapi
 def getworkerstats(core, webui, httprequest, path, request, privileges):
-  now = time.time()
-  ghashes = core.stats.ghashes
+  snapshot = core.get_statistics_snapshot()
   return {
-    "timestamp": now,
-    "starttime": core.stats.starttime,
-    "ghashes": ghashes,
-    "avgmhps": 1000. * ghashes / (now - core.stats.starttime),
-    "workers": core.get_worker_statistics(),
+    "timestamp": snapshot.timestamp,
+    "version": snapshot.version,
+    "starttime": snapshot.starttime,
+    "ghashes": snapshot.ghashes,
+    "avgmhps": snapshot.avgmhps,
+    "workers": snapshot.workers,
   }
 
 
 @jsonapi
 def getworksourcestats(core, webui, httprequest, path, request, privileges):
+  snapshot = core.get_statistics_snapshot()
   return {
-    "timestamp": time.time(),
-    "worksources": core.get_work_source_statistics(),
+    "timestamp": snapshot.timestamp,
+    "version": snapshot.version,
+    "worksources": snapshot.worksources,
   }
 
 
 @jsonapi
 def getblockchainstats(core, webui, httprequest, path, request, privileges):
+  snapshot = core.get_statistics_snapshot()
+  return {
+    "timestamp": snapshot.timestamp,
+    "version": snapshot.version,
+    "blockchains": snapshot.blockchains,
+  }
+
+
+@jsonapi
+def getfetcherstats(core, webui, httprequest, path, request, privileges):
   return {
     "timestamp": time.time(),
-    "blockchains": core.get_blockchain_statistics(),
+    "fetcher": core.get_fetcher_statistics(),
+  }
+
+
+@jsonapi
+def getfrontendstats(core, webui, httprequest, path, request, privileges):
+  return {
+    "timestamp": time.time(),
+    "events": core.get_event_statistics(),
+    "frontends": core.get_frontend_statistics(),
   }
 
 
 @jsonapi
 def getallstats(core, webui, httprequest, path, request, privileges):
-  now = time.time()
-  ghashes = core.stats.ghashes
+  snapshot = core.get_statistics_snapshot()
+  return {
+    "timestamp": snapshot.timestamp,
+    "version": snapshot.version,
+    "starttime": snapshot.starttime,
+    "ghashes": snapshot.ghashes,
+    "avgmhps": snapshot.avgmhps,
+    "workers": snapshot.workers,
+    "worksources": snapshot.worksources,
+    "blockchains": snapshot.blockchains,
+    "fetcher": core.get_fetcher_statistics(),
+    "events": core.get_event_statistics(),
+    "frontends": core.get_frontend_statistics(),
+  }
+
+
+@jsonapi
+def getstatschanges(core, webui, httprequest, path, request, privileges):
+  # Only the worker, work source and blockchain nodes that changed since the given version.
+  # If "full" is set, the client is too far behind and has to replace all nodes it knows.
+  snapshot = core.get_statistics_snapshot()
+  changed, removed, full = snapshot.get_changes(int(request.get("since", 0)))
   return {
-    "timestamp": now,
-    "starttime": core.stats.starttime,
-    "ghashes": ghashes,
-    "avgmhps": 1000. * ghashes / (now - core.stats.starttime),
-    "workers": core.get_worker_statistics(),
-    "worksources": core.get_work_source_statistics(),
-    "blockchains": core.get_blockchain_statistics(),
+    "timestamp": snapshot.timestamp,
+    "version": snapshot.version,
+    "starttime": snapshot.starttime,
+    "ghashes": snapshot.ghashes,
+    "avgmhps": snapshot.avgmhps,
+    "full": full,
+    "changed": changed,
+    "removed": removed,
   }
@@ -0,0 +1,93 @@
+# Modular Python Bitcoin Miner
+# Copyright (C) 2012 Michael Sparmann (TheSeven)
+#
+#     This program is free software; you can redistribute it and/or
+#     modify it under the terms of the GNU General Public License
+#     as published by the Free Software Foundation; either version 2
+#     of the License, or (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program; if not, write to the Free Software
+#     Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Please consider donating to 1PLAPWDejJPJnY2ppYCgtw5ko8G5Q4hPzh if you
+# want to support further development of the Modular Python Bitcoin Miner.
+
+
+
+from ..decorators import jsonapi
+import json
+import traceback
+
+
+
+def _find_store(core, request):
+  # Any running frontend that keeps a statistics history can answer queries,
+  # the client can pick one by name if there is more than one.
+  for frontend in core.frontends:
+    if not frontend.started or not hasattr(frontend, "query_history"): continue
+    if "frontend" in request and request["frontend"] != frontend.settings.name: continue
+    return frontend
+  return None
+
+
+
+@jsonapi
+def getinfo(core, webui, httprequest, path, request, privileges):
+  store = _find_store(core, request)
+  if not store: return {"error": "No statistics database is running"}
+  try: return store.get_history_info()
+  except:
+    core.log(webui, "Exception while reading statistics history info: %s\n", 700, "y", traceback.format_exc())
+    return {"error": "Could not read statistics history info"}
+
+
+
+@jsonapi
+def query(core, webui, httprequest, path, request, privileges):
+  store = _find_store(core, request)
+  if not store: return {"error": "No statistics database is running"}
+  try:
+    header, rows = store.query_history(request.get("objects"), request.get("columns"),
+                                       request.get("start"), request.get("end"), request.get("points", 300))
+  except ValueError as e: return {"error": str(e)}
+  except:
+    core.log(webui, "Exception while querying statistics history: %s\n", 700, "y", traceback.format_exc())
+    return {"error": "Could not query statistics history"}
+
+  # Stream the rows by means of a chunked transfer, they are read from the database while sending
+  httprequest.protocol_version = "HTTP/1.1"
+  httprequest.log_request(200, "<chunked>")
+  httprequest.send_response(200)
+  httprequest.send_header("Content-Type", "application/json; charset=UTF-8")
+  httprequest.send_header("Transfer-Encoding", "chunked")
+  httprequest.end_headers()
+
+  def write_chunk(data):
+    data = data.encode("utf_8")
+    httprequest.wfile.write(("%X\r\n" % len(data)).encode("ascii") + data + "\r\n".encode("ascii"))
+
+  try:
+    data = json.dumps(header, ensure_ascii = False)
+    write_chunk(data[:-1] + ", \"rows\": [")
+    buffer = []
+    first = True
+    for row in rows:
+      buffer.append(json.dumps(row))
+      if len(buffer) >= 1000:
+        write_chunk(("" if first else ",") + ",".join(buffer))
+        first = False
+        buffer = []
+    if buffer: write_chunk(("" if first else ",") + ",".join(buffer))
+    write_chunk("]}")
+    httprequest.wfile.write("0\r\n\r\n".encode("ascii"))
+    httprequest.wfile.flush()
+  except: core.log(webui, "Exception while streaming statistics history: %s\n", 700, "y", traceback.format_exc())
+  finally:
+    # Give the read connection back even if the client went away
+    if hasattr(rows, "close"): rows.close()
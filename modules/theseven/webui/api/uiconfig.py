@@ -34,4 +34,5 @@ def read(core, webui, httprequest, path, request, privileges):
 def write(core, webui, httprequest, path, request, privileges):
   if privileges != "admin": return httprequest.send_response(403)
   webui.settings.uiconfig = request
+  core.update_log_filter()
   return {}
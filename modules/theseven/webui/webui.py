@@ -33,6 +33,8 @@ import base64
 from threading import RLock, Thread
 from core.basefrontend import BaseFrontend
 from .api import handlermap
+try: from queue import Full
+except: from Queue import Full
 try: import urllib.parse as urllib
 except: import urllib
 try: from socketserver import ThreadingTCPServer
@@ -93,6 +95,7 @@ class WebUI(BaseFrontend):
   def _reset(self):
     self.log_buffer = []
     self.log_listeners = []
+    self.log_listener_levels = {}
 
 
   def _start(self):
@@ -116,6 +119,12 @@ class WebUI(BaseFrontend):
     super(WebUI, self)._stop()
 
 
+  def get_log_level(self):
+    # Keep what the log gadget shows by default, and what the connected log streams ask for
+    with self.log_lock: levels = list(self.log_listener_levels.values())
+    return max([self.settings.uiconfig.get("loggadget", {}).get("loglevel", self.core.default_loglevel)] + levels)
+
+
   def write_log_message(self, source, timestamp, loglevel, messages):
     if not self.started: return
     data = {
@@ -126,23 +135,31 @@ class WebUI(BaseFrontend):
     }
     with self.log_lock:
       for queue in self.log_listeners:
-        queue.put(data)
+        # Don't let a stalled client hold up everything else
+        try: queue.put_nowait(data)
+        except Full: pass
       self.log_buffer.append(data)
       if len(self.log_buffer) > self.settings.log_buffer_max_length:
         self.log_buffer = self.log_buffer[self.settings.log_buffer_purge_size:]
 
 
-  def register_log_listener(self, listener):
+  def register_log_listener(self, listener, loglevel = 1000):
     with self.log_lock:
       if not listener in self.log_listeners:
         self.log_listeners.append(listener)
-      for data in self.log_buffer: listener.put(data)
+      self.log_listener_levels[listener] = loglevel
+      for data in self.log_buffer:
+        try: listener.put_nowait(data)
+        except Full: break
+    self.core.update_log_filter()
 
 
   def unregister_log_listener(self, listener):
     with self.log_lock:
       while listener in self.log_listeners:
         self.log_listeners.remove(listener)
+      self.log_listener_levels.pop(listener, None)
+    self.core.update_log_filter()
 
 
 
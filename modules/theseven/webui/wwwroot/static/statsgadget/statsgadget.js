@@ -150,7 +150,7 @@ mod.statsgadget = {
                     "rendererconfig": {"reference": foundSharesReference, "percentagePrecision": 2},
                 };
                 var workerTable = makeTable(data["workers"],
-                {
+                addRateDefinitions(addWasteDefinitions({
                     "obj": {},
                     "id": {},
                     "name": {100: {"title": "Worker name"}},
@@ -166,13 +166,22 @@ mod.statsgadget = {
                     "sharesinvalid": {430: invalidSharesDefinition, 440: makePerHourDefinition("Invalids per hour", 2)},
                     "starttime": {1000: uptimeDefinition},
                     "parallel_jobs": {1100: {"title": "Jobs processed in parallel", "renderer": intRenderer}},
+                    "avgjobgap": {1110: {"title": "Average job gap [s]", "renderer": floatRenderer, "rendererconfig": {"precision": 3}}},
+                    "maxjobgap": {1120: {"title": "Maximum job gap [s]", "renderer": floatRenderer, "rendererconfig": {"precision": 3}}},
                     "current_job": {},
                     "current_work_source": {},
                     "current_work_source_id": {},
                     "current_work_source_name": {2000: {"title": "Current work source"}},
-                });
+                    "latency":
+                    {
+                        700: makeLatencyDefinition("Queue time", "queue"),
+                        710: makeLatencyDefinition("Upload time", "upload"),
+                        720: makeLatencyDefinition("Verify time", "verify"),
+                        730: makeLatencyDefinition("Submit latency", "submit"),
+                    },
+                }, 800, false), 600));
                 var worksourceTable = makeTable(data["worksources"],
-                {
+                addRateDefinitions(addWasteDefinitions({
                     "obj": {},
                     "id": {},
                     "name": {100: {"title": "Work source name"}},
@@ -182,6 +191,7 @@ mod.statsgadget = {
                     "signals_new_block": {110: {"title": "Signals new block", "renderer": booleanRenderer}},
                     "supports_rollntime": {120: {"title": "Supports X-Roll-NTime", "renderer": booleanRenderer}},
                     "jobs_per_request": {130: {"title": "Jobs per request", "renderer": intRenderer}},
+                    "fetch_latency": {135: {"title": "Fetch latency [s]", "renderer": floatRenderer, "rendererconfig": {"precision": 3}}},
                     "job_expiry": {140: {"title": "Job validity timeframe", "renderer": timespanRenderer}},
                     "difficulty": {150: {"title": "Difficulty", "renderer": floatRenderer, "rendererconfig": {"precision": 2}}},
                     "avgmhps": {200: averageMHpsDefinition},
@@ -194,17 +204,30 @@ mod.statsgadget = {
                     "jobscanceled": {440: canceledJobsDefinition, 450: makePerHourDefinition("Canceled per hour", 2)},
                     "sharesaccepted": {210: effectiveMHpsDefinition, 220: utilityDefinition, 500: acceptedSharesDefinition},
                     "sharesrejected": {510: rejectedSharesDefinition, 520: makePerHourDefinition("Rejects per hour", 2)},
+                    "sharequeue": {530: {"title": "Queued shares", "renderer": intRenderer}},
+                    "oldestshare": {540: {"title": "Oldest queued share [s]", "renderer": floatRenderer, "rendererconfig": {"precision": 1}}},
+                    "accountinglocks": {550: {"title": "Accounting lock acquisitions", "renderer": intRenderer}},
                     "starttime": {1000: uptimeDefinition},
                     "consecutive_errors": {1100: {"title": "Consecutive errors", "renderer": intRenderer}},
                     "locked_out": {1200: {"title": "Lockout time remaining", "renderer": timespanRenderer}},
-                });
+                    "latency":
+                    {
+                        700: makeLatencyDefinition("Fetch latency", "fetch"),
+                        710: makeLatencyDefinition("Queue time", "queue"),
+                        720: makeLatencyDefinition("Upload time", "upload"),
+                        730: makeLatencyDefinition("Verify time", "verify"),
+                        740: makeLatencyDefinition("Submit latency", "submit"),
+                    },
+                }, 800, true), 600));
                 var blockchainTable = makeTable(data["blockchains"],
-                {
+                addRateDefinitions(addWasteDefinitions({
                     "obj": {},
                     "id": {},
                     "name": {100: {"title": "Blockchain name"}},
                     "blocks": {200: {"title": "Blocks seen", "renderer": intRenderer}, 210: makePerHourDefinition("Blocks per hour", 2)},
                     "lastblock": {220: {"title": "Last block", "renderer": timestampRenderer}, 230: timeAgoDefinition},
+                    "cancellatency": {240: {"title": "Block change cancel latency [s]", "renderer": floatRenderer, "rendererconfig": {"precision": 3}}},
+                    "maxcancellatency": {250: {"title": "Max. cancel latency [s]", "renderer": floatRenderer, "rendererconfig": {"precision": 3}}},
                     "avgmhps": {300: averageMHpsDefinition},
                     "ghashes": {330: gHashesTotalDefinition},
                     "jobsreceived": {400: receivedJobsDefinition, 410: makePerHourDefinition("Received per hour", 2)},
@@ -213,6 +236,24 @@ mod.statsgadget = {
                     "sharesaccepted": {310: effectiveMHpsDefinition, 320: utilityDefinition, 500: acceptedSharesDefinition},
                     "sharesrejected": {510: rejectedSharesDefinition, 520: makePerHourDefinition("Rejects per hour", 2)},
                     "starttime": {1000: uptimeDefinition},
+                    "latency":
+                    {
+                        700: makeLatencyDefinition("Fetch latency", "fetch"),
+                        710: makeLatencyDefinition("Queue time", "queue"),
+                        720: makeLatencyDefinition("Upload time", "upload"),
+                        730: makeLatencyDefinition("Verify time", "verify"),
+                        740: makeLatencyDefinition("Submit latency", "submit"),
+                    },
+                }, 800, true), 600));
+                var fetcherTable = makeTable([data["fetcher"]],
+                {
+                    "queuetarget": {100: {"title": "Queue target", "renderer": intRenderer}},
+                    "queuecount": {110: {"title": "Queued jobs", "renderer": intRenderer}},
+                    "inflightjobs": {120: {"title": "Jobs in flight", "renderer": intRenderer}},
+                    "inflightrequests": {130: {"title": "Requests in flight", "renderer": intRenderer}},
+                    "consumption": {200: {"title": "Consumption [jobs/s]", "renderer": floatRenderer, "rendererconfig": {"precision": 2}}},
+                    "latency": {210: {"title": "Fetch latency [s]", "renderer": floatRenderer, "rendererconfig": {"precision": 3}}},
+                    "runway": {220: {"title": "Projected runway [s]", "renderer": floatRenderer, "rendererconfig": {"precision": 1}}},
                 });
                 mod.dom.clean(div);
                 div.appendChild(workerTable);
@@ -220,6 +261,8 @@ mod.statsgadget = {
                 div.appendChild(worksourceTable);
                 div.appendChild(document.createElement("hr"));
                 div.appendChild(blockchainTable);
+                div.appendChild(document.createElement("hr"));
+                div.appendChild(fetcherTable);
                 timeout = setTimeout(refresh, mod.uiconfig.data.statsgadget.refreshinterval * 1000);
                 
                 function perMinuteTransform(stats, value, def)
@@ -260,6 +303,56 @@ mod.statsgadget = {
                     }
                 }
                 
+                function addRateDefinitions(defs, position)
+                {
+                    var windows = {"1m": "1 min", "5m": "5 min", "15m": "15 min"};
+                    for (var suffix in windows)
+                        if (windows.hasOwnProperty(suffix))
+                        {
+                            defs["mhps_" + suffix] = {};
+                            defs["mhps_" + suffix][position++] = {"title": "MH/s (" + windows[suffix] + ")", "renderer": floatRenderer, "rendererconfig": {"precision": 2}};
+                            defs["acceptrate_" + suffix] = {};
+                            defs["rejectrate_" + suffix] = {};
+                            defs["rejectratio_" + suffix] = {};
+                            defs["cancelrate_" + suffix] = {};
+                        }
+                    defs["rejectratio_5m"][position++] = {"title": "Reject ratio (5 min)", "renderer": percentageRenderer, "rendererconfig": {"percentagePrecision": 2}};
+                    defs["rejectratio_15m"][position++] = {"title": "Reject ratio (15 min)", "renderer": percentageRenderer, "rendererconfig": {"percentagePrecision": 2}};
+                    defs["cancelrate_15m"][position++] = {"title": "Canceled per minute (15 min)", "renderer": floatRenderer, "rendererconfig": {"precision": 2}};
+                    defs["version"] = {};
+                    return defs;
+                }
+                
+                function addWasteDefinitions(defs, position, jobs)
+                {
+                    defs["wastedratio"] = {};
+                    defs["wastedratio"][position++] = {"title": "Wasted work (max.)", "renderer": percentageRenderer, "rendererconfig": {"percentagePrecision": 2}};
+                    defs["ghashes_canceled"] = {};
+                    defs["ghashes_canceled"][position++] = {"title": "GH on canceled jobs", "renderer": floatRenderer, "rendererconfig": {"precision": 2}};
+                    defs["ghashes_stale"] = {};
+                    defs["ghashes_stale"][position++] = {"title": "GH on stale shares", "renderer": floatRenderer, "rendererconfig": {"precision": 2}};
+                    defs["sharesstale"] = {};
+                    defs["sharesstale"][position++] = {"title": "Stale shares", "renderer": intRenderer};
+                    var fields = {"jobsexpired": "Expired unused jobs", "jobsstale": "Stale unused jobs",
+                                  "fetchesdiscarded": "Discarded fetches", "jobsdiscarded": "Discarded fetched jobs"};
+                    for (var field in fields)
+                        if (fields.hasOwnProperty(field))
+                        {
+                            defs[field] = {};
+                            if (jobs) defs[field][position++] = {"title": fields[field], "renderer": intRenderer};
+                        }
+                    return defs;
+                }
+                
+                function makeLatencyDefinition(title, stage)
+                {
+                    return {
+                        "title": title + " [ms]",
+                        "renderer": latencyRenderer,
+                        "rendererconfig": {"stage": stage}
+                    };
+                }
+                
                 function makePerHourDefinition(title, precision)
                 {
                     return {
@@ -407,6 +500,23 @@ mod.statsgadget = {
                     td.appendChild(document.createTextNode(percentage + "%"));
                 }
                 
+                function latencyRenderer(td, stats, value, def, config)
+                {
+                    var histogram = value ? value[config.stage] : null;
+                    if (!histogram || !histogram.count)
+                    {
+                        td.appendChild(document.createTextNode("-"));
+                        return;
+                    }
+                    var ms = function(seconds)
+                    {
+                        return (seconds * 1000).toFixed(1);
+                    };
+                    td.appendChild(document.createTextNode(ms(histogram.p50) + " / " + ms(histogram.p90) + " / " + ms(histogram.max)));
+                    td.title = "Median / 90th percentile / maximum of " + histogram.count + " samples, average "
+                             + ms(histogram.avg) + " ms, 99th percentile " + ms(histogram.p99) + " ms";
+                }
+                
                 function booleanRenderer(td, stats, value, def, config)
                 {
                     if (!config["default"]) config["default"] = "Unknown";
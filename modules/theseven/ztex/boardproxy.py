@@ -158,11 +158,14 @@ class ZtexBoardProxy(Process):
             self.lastnonce = nonces[0][1]
             exhausted = True
         if exhausted: self.send("keyspace_exhausted")
+        found = []
         for nonce in nonces:
           if nonce[0] != -self.device.nonce_offset and not nonce[0] in lastshares:
-            if self.job: self.send("nonce_found", time.time(), struct.pack("<I", nonce[0]))
+            if self.job: found.append(struct.pack("<I", nonce[0]))
             lastshares.append(nonce[0])
             while len(lastshares) > len(nonces): lastshares.pop(0)
+        # Send all new nonces of this poll at once, they can be verified as a batch
+        if found: self.send("nonces_found", time.time(), found)
         
         # Verify proper operation and adjust clocking if neccessary
         if now > self.checklockout and self.job:
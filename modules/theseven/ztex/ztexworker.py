@@ -164,13 +164,14 @@ class ZtexWorker(BaseWorker):
         while not self.shutdown:
           data = self.rxconn.recv()
           if self.dead: break
-          if data[0] == "log": self.core.log(self, "Proxy: %s" % data[1], data[2], data[3])
+          if data[0] == "log": self.core.log(self, "Proxy: %s", data[2], data[3], data[1])
           elif data[0] == "ping": self._proxy_message("pong")
           elif data[0] == "pong": pass
           elif data[0] == "dying": raise Exception("Proxy died!")
           elif data[0] == "response": self.response_queue.put(data[1:])
           elif data[0] == "started_up": self._notify_proxy_started_up(*data[1:])
           elif data[0] == "nonce_found": self._notify_nonce_found(*data[1:])
+          elif data[0] == "nonces_found": self._notify_nonces_found(*data[1:])
           elif data[0] == "speed_changed": self._notify_speed_changed(*data[1:])
           elif data[0] == "error_rate": self._notify_error_rate(*data[1:])
           elif data[0] == "keyspace_exhausted": self._notify_keyspace_exhausted(*data[1:])
@@ -180,7 +181,7 @@ class ZtexWorker(BaseWorker):
       # If something went wrong...
       except Exception as e:
         # ...complain about it!
-        self.core.log(self, "%s\n" % traceback.format_exc(), 100, "rB")
+        self.core.log(self, "%s\n", 100, "rB", traceback.format_exc())
       finally:
         with self.workloopwakeup: self.workloopwakeup.notify()
         try:
@@ -249,17 +250,28 @@ class ZtexWorker(BaseWorker):
       if oldjob.nonce_found(nonce): job = oldjob
 
 
+  def _notify_nonces_found(self, now, nonces):
+    # Same as above, for all nonces that were read from the device at once
+    oldjob = self.oldjob
+    newjob = self.job
+    if not oldjob and not newjob: return
+    if newjob:
+      results = newjob.nonces_found(nonces, oldjob)
+      nonces = [nonce for nonce, result in zip(nonces, results) if not result]
+    if nonces and oldjob: oldjob.nonces_found(nonces)
+
+
   def _notify_speed_changed(self, speed):
     self.stats.mhps = speed / 1000000.
     self.core.event(350, self, "speed", self.stats.mhps * 1000, "%f MH/s" % self.stats.mhps, worker = self)
-    self.core.log(self, "Running at %f MH/s\n" % self.stats.mhps, 300, "B")
+    self.core.log(self, "Running at %f MH/s\n", 300, "B", self.stats.mhps)
     # Calculate the time that the device will need to process 2**32 nonces.
     # This is limited at 60 seconds in order to have some regular communication,
     # even with very slow devices (and e.g. detect if the device was unplugged).
     interval = min(60, 2**32 / speed)
     # Add some safety margin and take user's interval setting (if present) into account.
     self.jobinterval = min(self.settings.jobinterval, max(0.5, interval * 0.8 - 1))
-    self.core.log(self, "Job interval: %f seconds\n" % self.jobinterval, 400, "B")
+    self.core.log(self, "Job interval: %f seconds\n", 400, "B", self.jobinterval)
     # Tell the MPBM core that our hash rate has changed, so that it can adjust its work buffer.
     self.jobs_per_second = 1. / self.jobinterval
     self.core.notify_speed_changed(self)
@@ -311,10 +323,12 @@ class ZtexWorker(BaseWorker):
       while not self.shutdown:
 
         # Fetch a job, add 2 seconds safety margin to the requested minimum expiration time.
-        # Blocks until one is available. Because of this we need to release the
+        # The next job is reserved for us in the background while we work on this one,
+        # so this will usually return immediately, but it might still block until one
+        # is available. Because of this we need to release the
         # wakeup lock temporarily in order to avoid possible deadlocks.
         self.workloopwakeup.release()
-        job = self.core.get_job(self, self.jobinterval + 2)
+        job = self.core.get_job(self, self.jobinterval + 2, prefetch = True)
         self.workloopwakeup.acquire()
         
         # If a new block was found while we were fetching that job, just discard it and get a new one.
@@ -335,10 +349,12 @@ class ZtexWorker(BaseWorker):
     # If something went wrong...
     except Exception as e:
       # ...complain about it!
-      self.core.log(self, "%s\n" % traceback.format_exc(), 100, "rB")
+      self.core.log(self, "%s\n", 100, "rB", traceback.format_exc())
     finally:
       # We're not doing productive work any more, update stats and destroy current job
       self._jobend()
+      # Hand back the job that was reserved for us, someone else might need it
+      self.core.cancel_prefetch(self)
       self.stats.mhps = 0
       # Make the proxy and its listener thread restart
       self.dead = True
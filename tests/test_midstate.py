@@ -0,0 +1,128 @@
+# Modular Python Bitcoin Miner
+# Copyright (C) 2012 Michael Sparmann (TheSeven)
+#
+#     This program is free software; you can redistribute it and/or
+#     modify it under the terms of the GNU General Public License
+#     as published by the Free Software Foundation; either version 2
+#     of the License, or (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program; if not, write to the Free Software
+#     Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Please consider donating to 1PLAPWDejJPJnY2ppYCgtw5ko8G5Q4hPzh if you
+# want to support further development of the Modular Python Bitcoin Miner.
+
+
+
+######################################
+# Midstate engine known answer tests #
+######################################
+
+
+
+# Run from the repository root: python -m unittest discover -s tests
+
+
+
+import os
+import sys
+import struct
+import random
+import unittest
+from hashlib import sha256
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from core import midstate
+from core.sha256 import SHA256
+
+
+
+def reference_midstate(data):
+  # Straight from the SHA256 class, without going through any engine
+  return struct.pack("<8I", *struct.unpack(">8I", SHA256.hash(struct.pack("<16I", *struct.unpack(">16I", data[:64])), False)))
+
+
+
+class MidstateEngineTest(unittest.TestCase):
+
+
+  def setUp(self):
+    generator = random.Random(1)
+    # Random 80 byte block headers, plus the known answer vectors (which are only 64 bytes long)
+    self.vectors = [struct.pack("80B", *[generator.randrange(256) for i in range(80)]) for i in range(64)]
+    self.vectors += midstate.known_vectors
+
+
+  def check(self, engineclass):
+    try: engine = engineclass()
+    except Exception as e: raise unittest.SkipTest("%s engine not available: %s" % (engineclass.name, e))
+    expected = [reference_midstate(data) for data in self.vectors]
+    self.assertEqual([engine.midstate(data) for data in self.vectors], expected)
+    for count in (0, 1, 2, 31, 32, 33, len(self.vectors)):
+      self.assertEqual(engine.midstates(self.vectors[:count]), expected[:count])
+    self.assertEqual(midstate.check_engine(engine), None)
+
+
+  def test_known_answers(self):
+    self.assertEqual([reference_midstate(data) for data in midstate.known_vectors], midstate.known_midstates)
+    # Midstates only depend on the first 64 bytes, and are 32 bytes long
+    data = sha256(b"header").digest() * 2
+    self.assertEqual(reference_midstate(data + b"\0" * 16), reference_midstate(data + b"\xff" * 16))
+    self.assertEqual(len(reference_midstate(data)), 32)
+
+
+  def test_reference(self):
+    self.check(midstate.ReferenceMidstateEngine)
+
+
+  def test_python(self):
+    self.check(midstate.PythonMidstateEngine)
+
+
+  def test_openssl(self):
+    self.check(midstate.OpenSSLMidstateEngine)
+
+
+  def test_numpy(self):
+    self.check(midstate.NumPyMidstateEngine)
+
+
+  def test_selection(self):
+    midstate.select_engines()
+    self.assertTrue(midstate.engine.minbatch <= 1)
+    names = [engineclass.name for engineclass in midstate.engines]
+    for name, reason in midstate.rejected:
+      self.assertTrue(name in names)
+      self.assertTrue(reason)
+    expected = [reference_midstate(data) for data in self.vectors]
+    self.assertEqual([midstate.calculate_midstate(data) for data in self.vectors], expected)
+    self.assertEqual(midstate.calculate_midstates(self.vectors), expected)
+    self.assertEqual(midstate.calculate_midstates(self.vectors[:3]), expected[:3])
+
+
+  def test_broken_engine(self):
+    # An engine with wrong results must be skipped, and the reason recorded
+    class BrokenMidstateEngine(midstate.MidstateEngine):
+      name = "broken"
+      def midstate(self, data): return b"\0" * 32
+    class FailingMidstateEngine(midstate.MidstateEngine):
+      name = "failing"
+      def __init__(self): raise Exception("not available")
+    engines = midstate.engines
+    midstate.engines = [BrokenMidstateEngine, FailingMidstateEngine] + engines
+    try:
+      midstate.select_engines()
+      self.assertEqual(midstate.rejected[:2], [("broken", "wrong single midstate results"), ("failing", "Exception: not available")])
+      self.assertNotEqual(midstate.engine.name, "broken")
+    finally:
+      midstate.engines = engines
+      midstate.select_engines()
+
+
+
+if __name__ == "__main__": unittest.main()
@@ -0,0 +1,243 @@
+# Modular Python Bitcoin Miner
+# Copyright (C) 2012 Michael Sparmann (TheSeven)
+#
+#     This program is free software; you can redistribute it and/or
+#     modify it under the terms of the GNU General Public License
+#     as published by the Free Software Foundation; either version 2
+#     of the License, or (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program; if not, write to the Free Software
+#     Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Please consider donating to 1PLAPWDejJPJnY2ppYCgtw5ko8G5Q4hPzh if you
+# want to support further development of the Modular Python Bitcoin Miner.
+
+
+
+#################################################
+# Work source group fair share simulation tests #
+#################################################
+
+
+
+# Simulates a tree of work source groups handing out jobs, with a fake clock,
+# and compares the long-run distribution with the configured priorities and hashrates.
+# Run from the repository root: python -m unittest discover -s tests
+
+
+
+import os
+import sys
+import random
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from core import worksourcegroup
+from core.util import Bunch
+from core.baseworksource import BaseWorkSource
+from core.worksourcegroup import WorkSourceGroup
+
+
+
+class FakeClock(object):
+
+
+  def __init__(self):
+    self.now = 1000000.
+
+
+  def time(self):
+    return self.now
+
+
+
+class FakeCore(object):
+
+
+  def __init__(self):
+    self.nextid = 0
+    self.registry = self
+    self.stats = Bunch(ghashes = 0)
+
+
+  def register(self, obj):
+    self.nextid += 1
+    return self.nextid
+
+
+  def event(self, *args, **kwargs):
+    pass
+
+
+  def log(self, *args, **kwargs):
+    pass
+
+
+
+class FakeWorkSource(BaseWorkSource):
+
+
+  def __init__(self, core, clock, name, priority = 1, hashrate = 0, jobs = 1):
+    super(FakeWorkSource, self).__init__(core)
+    self.clock = clock
+    self.settings.name = name
+    self.settings.priority = priority
+    self.settings.hashrate = hashrate
+    self.jobsperfetch = jobs
+    self.lockoutend = 0
+    self.asked = 0
+    self.jobsfetched = 0
+    self.latency = None
+
+
+  def get_fetch_latency(self):
+    return self.latency
+
+
+  def start_fetchers(self, count, jobs):
+    self.asked += 1
+    if not self.started or not self.settings.enabled or self.clock.time() <= self.lockoutend: return False, 0
+    self.jobsfetched += self.jobsperfetch
+    return 1, self.jobsperfetch
+
+
+
+class WorkSourceGroupTest(unittest.TestCase):
+
+
+  def setUp(self):
+    self.clock = FakeClock()
+    self.time = worksourcegroup.time
+    worksourcegroup.time = self.clock
+    self.core = FakeCore()
+
+
+  def tearDown(self):
+    worksourcegroup.time = self.time
+
+
+  def make_group(self, name, children, priority = 1, hashrate = 0):
+    group = WorkSourceGroup(self.core)
+    group.settings.name = name
+    group.settings.priority = priority
+    group.settings.hashrate = hashrate
+    for child in children: group.add_work_source(child)
+    return group
+
+
+  def run_picks(self, root, picks, interval):
+    for i in range(picks):
+      root.start_fetchers(1, 1)
+      self.clock.now += interval
+
+
+  def test_priority_shares(self):
+    # 40 work sources in 5 nested groups, with different priorities and jobs per fetch
+    generator = random.Random(2)
+    groups = []
+    leaves = []
+    for i in range(5):
+      children = []
+      for j in range(8):
+        leaf = FakeWorkSource(self.core, self.clock, "Work source %d.%d" % (i, j), generator.choice([1, 2, 4]), 0, generator.choice([1, 1, 60]))
+        children.append(leaf)
+        leaves.append(leaf)
+      groups.append(self.make_group("Group %d" % i, children, i + 1))
+    disabled = leaves[3]
+    disabled.settings.enabled = False
+    lockedout = leaves[9]
+    lockedout.lockoutend = self.clock.now + 3600
+    root = self.make_group("Root", groups)
+    root.start()
+    # Share of every work source: its group's share of the root, times its share of the group
+    expected = {}
+    grouppriorities = float(sum(group.settings.priority for group in groups))
+    for group in groups:
+      active = [child for child in group.children if child is not disabled and child is not lockedout]
+      priorities = float(sum(child.settings.priority for child in active))
+      for child in active: expected[child] = group.settings.priority / grouppriorities * child.settings.priority / priorities
+    # 100 seconds at 1000 picks per second
+    self.run_picks(root, 100000, 0.001)
+    total = float(sum(leaf.jobsfetched for leaf in leaves))
+    self.assertEqual(disabled.jobsfetched, 0)
+    self.assertEqual(lockedout.jobsfetched, 0)
+    for leaf, share in expected.items():
+      self.assertAlmostEqual(leaf.jobsfetched / total, share, delta = max(0.001, share * 0.05))
+    # Parked work sources are only rechecked once per second, or when their lockout ends
+    self.assertTrue(disabled.asked <= 101)
+    self.assertEqual(lockedout.asked, 1)
+
+
+  def test_hashrate_reservation(self):
+    # A work source with a priority of 0 only gets its reserved hashrate,
+    # even though the other work source could take all the jobs
+    jobmhashes = 2**32 / 1000000.
+    reserved = FakeWorkSource(self.core, self.clock, "Reserved", 0, 50 * jobmhashes)
+    # The same for a group, which passes its reservation on to its children
+    nested = FakeWorkSource(self.core, self.clock, "Nested", 1)
+    group = self.make_group("Group", [nested], 0, 20 * jobmhashes)
+    other = FakeWorkSource(self.core, self.clock, "Other", 1)
+    root = self.make_group("Root", [reserved, group, other])
+    root.start()
+    # 100 seconds at 1000 picks per second
+    self.run_picks(root, 100000, 0.001)
+    self.assertTrue(abs(reserved.jobsfetched - 5000) <= 50, reserved.jobsfetched)
+    self.assertTrue(abs(nested.jobsfetched - 2000) <= 20, nested.jobsfetched)
+    self.assertEqual(reserved.jobsfetched + nested.jobsfetched + other.jobsfetched, 100000)
+
+
+  def test_stale_refund(self):
+    # Work lost to stale jobs is given back to the work source over time
+    jobmhashes = 2**32 / 1000000.
+    first = FakeWorkSource(self.core, self.clock, "First", 1)
+    second = FakeWorkSource(self.core, self.clock, "Second", 1)
+    root = self.make_group("Root", [first, second])
+    root.start()
+    first.add_deferred_mhashes(100 * jobmhashes)
+    self.run_picks(root, 10000, 0.001)
+    self.assertTrue(abs(first.jobsfetched - second.jobsfetched - 100) <= 2, first.jobsfetched - second.jobsfetched)
+    self.assertTrue(first.mhashes_deferred < jobmhashes)
+
+
+  def test_fetch_latency(self):
+    # A slow work source only counts with its share of the jobs
+    fast = FakeWorkSource(self.core, self.clock, "Fast", 9)
+    fast.latency = 0.1
+    slow = FakeWorkSource(self.core, self.clock, "Slow", 1)
+    slow.latency = 10.
+    root = self.make_group("Root", [fast, slow])
+    root.start()
+    self.assertAlmostEqual(root.get_fetch_latency(), 5.05)
+    self.run_picks(root, 10000, 0.01)
+    self.assertAlmostEqual(root.get_fetch_latency(), 0.9 * 0.1 + 0.1 * 10., delta = 0.05)
+    # Without jobs from it, the slow work source doesn't matter any more after a while
+    slow.settings.enabled = False
+    self.run_picks(root, 60000, 0.01)
+    slow.settings.enabled = True
+    self.assertTrue(root.get_fetch_latency() < 0.2)
+
+
+  def test_priority_zero_fallback(self):
+    # Work sources with a priority of 0 are used if nobody else has jobs
+    backup = FakeWorkSource(self.core, self.clock, "Backup", 0)
+    primary = FakeWorkSource(self.core, self.clock, "Primary", 1)
+    root = self.make_group("Root", [primary, backup])
+    root.start()
+    self.run_picks(root, 1000, 0.001)
+    self.assertEqual(backup.jobsfetched, 0)
+    # The primary work source is back as soon as its lockout ends
+    primary.lockoutend = self.clock.now + 0.5
+    self.run_picks(root, 1000, 0.001)
+    self.assertTrue(abs(backup.jobsfetched - 500) <= 1, backup.jobsfetched)
+    self.run_picks(root, 1000, 0.001)
+    self.assertEqual(backup.jobsfetched + primary.jobsfetched, 3000)
+    self.assertEqual(primary.asked, primary.jobsfetched + 1)
+
+
+
+if __name__ == "__main__": unittest.main()